@@ -0,0 +1,12 @@
+'''
+Benchmarks for the txcurrentcost message ingest pipeline.
+
+Run the ingest pipeline benchmarks, write the results to a file and
+compare them against an earlier run using:
+
+$ python -m benchmarks --output=results.json
+$ python -m benchmarks --compare=results.json
+
+The remaining modules in this package are standalone scripts that focus
+on a single change, e.g. python benchmarks/decoder.py
+'''
@@ -0,0 +1,69 @@
+'''
+Run the ingest pipeline benchmarks.
+
+$ python -m benchmarks [--corpus=capture.log] [--output=results.json] [--compare=baseline.json]
+'''
+
+import json
+import sys
+from twisted.python import usage
+from benchmarks import pipeline
+
+
+class BenchmarkOptions(usage.Options):
+    optParameters = [['corpus', None, None, 'Captured log to use instead of a synthetic corpus'],
+                     ['sensors', None, 3, 'Sensor count of the synthetic corpus', int],
+                     ['clamps', None, 3, 'Clamp count of the corpus', int],
+                     ['duration', None, 7200, 'Seconds of synthetic traffic', int],
+                     ['repeat', 'r', 3, 'Number of runs of each stage', int],
+                     ['stages', 's', None, 'Comma separated stages to run (default all)'],
+                     ['output', 'o', None, 'Write the results as JSON to this file'],
+                     ['compare', 'c', None, 'Compare the results against a JSON results file'],
+                     ['threshold', 't', 0.1, 'Fractional throughput drop reported as a regression', float]]
+
+
+def main(argv):
+    options = BenchmarkOptions()
+    try:
+        options.parseOptions(argv)
+    except usage.UsageError as errortext:
+        print("%s\nTry --help for usage details." % errortext)
+        return 2
+
+    if options['corpus']:
+        corpus = pipeline.Corpus.captured(options['corpus'], options['clamps'])
+    else:
+        corpus = pipeline.Corpus.synthetic(options['sensors'], options['clamps'], options['duration'])
+
+    stages = options['stages'].split(',') if options['stages'] else None
+    results = pipeline.run(corpus, stages, options['repeat'])
+
+    print("Corpus: %s (%i lines)" % (corpus.description, len(corpus.lines)))
+    print("%-16s %12s %10s %10s %10s" % ("stage", "msgs/s", "mean us", "p50 us", "p99 us"))
+    for stage in pipeline.Stages:
+        if stage in results["stages"]:
+            result = results["stages"][stage]
+            print("%-16s %12.0f %10.2f %10.2f %10.2f" % (stage, result["msgs_per_sec"],
+                                                          result["latency_us"]["mean"],
+                                                          result["latency_us"]["p50"],
+                                                          result["latency_us"]["p99"]))
+
+    if options['output']:
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    regressed = False
+    if options['compare']:
+        with open(options['compare']) as f:
+            baseline = json.load(f)
+        print("\nCompared with %s" % options['compare'])
+        for stage, before, after, ratio, regression in pipeline.compare(baseline, results, options['threshold']):
+            regressed = regressed or regression
+            print("%-16s %12.0f -> %12.0f msgs/s %6.2fx%s" % (stage, before, after, ratio,
+                                                             "  REGRESSION" if regression else ""))
+
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+#
+'''
+This script compares the fast path periodic update decoder against the
+ElementTree parsing path.
+
+It reports the per message cost of each path using the corpus of sample
+messages that txcurrentcost.test.test_decoder checks both paths agree on.
+
+$ python benchmarks/decoder.py
+'''
+
+import timeit
+try:
+    from xml.etree import cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+from txcurrentcost.decoder import decodePeriodicUpdate
+from txcurrentcost.test.test_decoder import PeriodicMessages, extract
+
+
+def etreeDecode(line):
+    try:
+        msg = etree.fromstring(line)
+    except etree.ParseError:
+        return None
+    if msg.find("hist") is not None:
+        return None
+    return msg
+
+
+def run(number=20000):
+    line = PeriodicMessages[0]
+    for name, decode in [("etree", etreeDecode),
+                         ("fast path", decodePeriodicUpdate)]:
+        elapsed = min(timeit.repeat(lambda: extract(decode(line)), number=number, repeat=3))
+        print("%-10s %8.2f us/msg" % (name, elapsed / number * 1e6))
+
+
+if __name__ == "__main__":
+    run()
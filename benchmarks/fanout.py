@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#
+'''
+This script measures the cost of streaming readings to a growing number
+of subscribers of a FanoutFactory.
+
+Subscribers connect over the loopback interface from the same process.
+Readings are published in bursts and the time spent publishing, and the
+time until every subscriber has received every reading, are reported.
+
+$ python benchmarks/fanout.py
+'''
+
+import time
+from twisted.internet import defer, protocol, reactor, task
+from txcurrentcost.fanout import FanoutFactory
+
+
+Reading = {'timestamp': '2012-01-10 09:55:59.997599',
+           'temperature': '21.7',
+           'sensor_type': 1,
+           'sensor_instance': 0,
+           'sensor_data': ['00345', '02151', '00000']}
+
+
+class CountingSubscriber(protocol.Protocol):
+
+    def connectionMade(self):
+        self.received = 0
+        self.factory.connected.append(self)
+        if len(self.factory.connected) == self.factory.count:
+            self.factory.allConnected.callback(None)
+
+    def dataReceived(self, data):
+        self.received += data.count(b"\n")
+        if self.received == self.factory.expected:
+            self.factory.done += 1
+            if self.factory.done == self.factory.count:
+                self.factory.allReceived.callback(None)
+
+
+class CountingSubscriberFactory(protocol.ClientFactory):
+    protocol = CountingSubscriber
+
+    def __init__(self, count, expected):
+        self.count = count
+        self.expected = expected
+        self.connected = []
+        self.done = 0
+        self.allConnected = defer.Deferred()
+        self.allReceived = defer.Deferred()
+
+
+@defer.inlineCallbacks
+def run(subscriber_count, messages=2000, burst=100):
+    fanout = FanoutFactory()
+    port = reactor.listenTCP(0, fanout, backlog=subscriber_count, interface='127.0.0.1')
+    subscribers = CountingSubscriberFactory(subscriber_count, messages)
+    for _ in range(subscriber_count):
+        reactor.connectTCP('127.0.0.1', port.getHost().port, subscribers)
+    yield subscribers.allConnected
+    while len(fanout.subscribers) < subscriber_count:
+        yield task.deferLater(reactor, 0, lambda: None)
+
+    publishing = 0.0
+    start = time.time()
+    for n in range(0, messages, burst):
+        started = time.time()
+        for _ in range(burst):
+            fanout.publish(Reading)
+        publishing += time.time() - started
+        # Let the subscribers read between bursts
+        yield task.deferLater(reactor, 0, lambda: None)
+    yield subscribers.allReceived
+    elapsed = time.time() - start
+
+    for subscriber in subscribers.connected:
+        subscriber.transport.loseConnection()
+    yield port.stopListening()
+    defer.returnValue((publishing / messages, messages * subscriber_count / elapsed))
+
+
+@defer.inlineCallbacks
+def main():
+    try:
+        for subscriber_count in (1, 10, 50, 100, 250, 500):
+            publish, delivered = yield run(subscriber_count)
+            print("%4i subscribers %8.2f us/publish %10i readings/s delivered" % (
+                subscriber_count, publish * 1e6, delivered))
+    finally:
+        reactor.stop()
+
+
+if __name__ == "__main__":
+    reactor.callWhenRunning(main)
+    reactor.run()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+#
+'''
+This script measures the time taken to import parts of the package in a
+new interpreter, and whether Twisted and the global reactor are imported.
+
+Each import is timed in a fresh interpreter process so that nothing is
+already cached in sys.modules. Interpreter start up is not included. The
+transports import matches what importing the package cost when it
+imported the Twisted serial port eagerly.
+
+$ python benchmarks/imports.py [runs]
+'''
+
+import subprocess
+import sys
+
+
+# The statements timed, each run in a new interpreter.
+Imports = [('core', 'import txcurrentcost.core'),
+           ('package', 'import txcurrentcost'),
+           ('decoder', 'import txcurrentcost.decoder'),
+           ('transports', 'import txcurrentcost; txcurrentcost.CurrentCostDataProtocol'),
+           ('monitor', 'import txcurrentcost.monitor'),
+           ('reactor', 'import txcurrentcost.monitor; from twisted.internet import reactor')]
+
+_Timer = '''
+import sys, time
+started = time.time()
+%s
+elapsed = time.time() - started
+print("%%f %%i %%i" %% (elapsed, 'twisted' in sys.modules, 'twisted.internet.reactor' in sys.modules))
+'''
+
+
+def measure(statement, runs):
+    """
+    Return the fastest time, in seconds, taken to run statement in a new
+    interpreter and whether it imported Twisted and the reactor.
+    """
+    best = None
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', _Timer % statement])
+        elapsed, twisted, reactor = output.split()
+        elapsed = float(elapsed)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, twisted == b'1', reactor == b'1'
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    print("%-12s %10s %8s %8s" % ("import", "ms", "twisted", "reactor"))
+    for name, statement in Imports:
+        elapsed, twisted, reactor = measure(statement, runs)
+        print("%-12s %10.2f %8s %8s" % (name, elapsed * 1000, twisted, reactor))
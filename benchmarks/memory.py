@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+'''
+This script compares the memory used by the array backed SensorHistoryData
+against the previous layout of one dict of value strings per data kind.
+
+A fleet of devices, each with the maximum number of sensors holding a full
+complement of hour, day, month and year history, is built with each layout.
+
+$ python benchmarks/memory.py [device_count]
+'''
+
+import array
+import sys
+import txcurrentcost
+
+
+class DictSensorHistoryData(object):
+    """ The previous dict based layout of SensorHistoryData """
+
+    def __init__(self, sensor_type, sensor_instance, sensor_units):
+        self.instance = sensor_instance
+        self.type = sensor_type
+        self.units = sensor_units
+        self.last_update = None
+        self.hourData = {}
+        self.dayData = {}
+        self.monthData = {}
+        self.yearData = {}
+        self.dataPresent = False
+
+    def storeDataPoints(self, timestamp, datapoints):
+        self.last_update = timestamp
+        stores = {'h': self.hourData, 'd': self.dayData, 'm': self.monthData, 'y': self.yearData}
+        for tag, value in datapoints:
+            stores[tag[0]][tag] = value
+            if float(value) > 0:
+                self.dataPresent = True
+
+
+def datapoints(seed):
+    """ Return a full complement of history datapoints as sent by a device """
+    points = []
+    points.extend(('h%03d' % n, '%05.3f' % ((n * seed) % 997 / 100.0)) for n in range(4, 745, 2))
+    points.extend(('d%03d' % n, '%05.1f' % ((n * seed) % 991 / 10.0)) for n in range(1, 91))
+    points.extend(('m%03d' % n, '%05.0f' % ((n * seed) % 983)) for n in range(1, 85))
+    points.extend(('y%03d' % n, '%05.0f' % ((n * seed) % 977)) for n in range(1, 5))
+    # Use distinct string objects for each sensor as parsing a message would.
+    return [(''.join(tag), ''.join(value)) for tag, value in points]
+
+
+def sizeof(obj, seen=None):
+    """ Return the approximate deep size of an object in bytes """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += sizeof(key, seen) + sizeof(value, seen)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += sizeof(item, seen)
+    elif isinstance(obj, (str, array.array, int, float)) or obj is None:
+        pass
+    else:
+        if hasattr(obj, '__dict__'):
+            size += sizeof(obj.__dict__, seen)
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if hasattr(obj, slot):
+                    size += sizeof(getattr(obj, slot), seen)
+    return size
+
+
+def fleet(cls, device_count):
+    devices = []
+    for device in range(device_count):
+        sensors = {}
+        for sensor in range(txcurrentcost.Sensors.Maximum):
+            history = cls(txcurrentcost.Sensors.ElectricitySensor, sensor, 'kwhr')
+            history.storeDataPoints(None, datapoints(device * 10 + sensor + 1))
+            sensors[sensor] = history
+        devices.append(sensors)
+    return devices
+
+
+if __name__ == "__main__":
+    device_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print("%i devices, %i sensors each" % (device_count, txcurrentcost.Sensors.Maximum))
+    for name, cls in [("dict", DictSensorHistoryData),
+                      ("array", txcurrentcost.SensorHistoryData)]:
+        size = sizeof(fleet(cls, device_count))
+        print("%-6s %10.1f KiB total %8.1f KiB/sensor" % (name, size / 1024.0,
+                                                         size / 1024.0 / device_count / txcurrentcost.Sensors.Maximum))
@@ -0,0 +1,264 @@
+'''
+This module measures the throughput and per message latency of each stage
+of the txcurrentcost ingest pipeline, and of the pipeline end to end, using
+an offline corpus of Current Cost messages.
+
+The stages measured are:
+
+  framing           - splitting the raw byte stream into messages (MessageFramer)
+  parsing           - decoding lines into messages in lineReceived
+  periodic_update   - Monitor._parsePeriodicUpdate
+  periodic_reading  - Monitor._parsePeriodicUpdate with typedReadings enabled,
+                      given the readings decoded by the protocol
+  history_update    - Monitor._parseHistoryUpdate and the completion of the
+                      history cycle by Monitor._historicalDataUpdateCompleted
+  history_to_json   - SensorHistoryData.toJson after a history cycle
+  end_to_end        - raw byte stream in to user callbacks out
+'''
+
+import platform
+import timeit
+from twisted.internet import task
+import txcurrentcost
+from txcurrentcost.decoder import decodePeriodicReading, decodePeriodicUpdate, etree
+from txcurrentcost.monitor import Monitor
+from txcurrentcost.replay import DeviceSimulator, readCapturedLog
+
+
+# The size of the chunks the raw byte stream is delivered in, similar to
+# the amount of data returned by a serial port read.
+ChunkSize = 64
+
+Stages = ["framing",
+          "parsing",
+          "periodic_update",
+          "periodic_reading",
+          "history_update",
+          "history_to_json",
+          "end_to_end"]
+
+
+class BenchmarkConfig(object):
+    """ Monitor configuration used by the benchmarks """
+    port = None
+    baudrate = 57600
+    use_utc_timestamps = True
+
+    def __init__(self, clamp_count):
+        self.clamp_count = clamp_count
+
+
+class _FramingProtocol(txcurrentcost.CurrentCostDataProtocol):
+    """ Frame messages without decoding them """
+
+    def frameReceived(self, frame):
+        pass
+
+
+class Corpus(object):
+    """
+    A corpus of raw Current Cost message lines.
+    """
+
+    def __init__(self, lines, description, clamp_count):
+        self.lines = lines
+        self.description = description
+        self.clamp_count = clamp_count
+
+    @classmethod
+    def synthetic(cls, sensor_count=3, clamp_count=3, duration=7200, seed=1):
+        """
+        Create a corpus of simulated device traffic that includes a history
+        update message cycle.
+        """
+        simulator = DeviceSimulator(sensor_count=sensor_count, clamp_count=clamp_count,
+                                    duration=duration, seed=seed)
+        description = "synthetic: %i sensors, %i clamps, %is" % (sensor_count, clamp_count, duration)
+        return cls([line for _, line in simulator], description, clamp_count)
+
+    @classmethod
+    def captured(cls, path, clamp_count=3):
+        """
+        Create a corpus from a captured log, see txcurrentcost.replay.readCapturedLog.
+        """
+        return cls([line for _, line in readCapturedLog(path)], "captured: %s" % path, clamp_count)
+
+    def periodicLines(self):
+        return [line for line in self.lines if "<hist>" not in line]
+
+    def historyLines(self):
+        return [line for line in self.lines if "<hist>" in line]
+
+    def stream(self):
+        """
+        Return the raw byte stream as a list of chunks.
+        """
+        data = "".join(line + "\r\n" for line in self.lines).encode("ascii")
+        return [data[n:n + ChunkSize] for n in range(0, len(data), ChunkSize)]
+
+
+def _summarise(timings, messages):
+    """
+    Summarise per item timings of a stage that processed a number of messages.
+    """
+    total = sum(timings)
+    ordered = sorted(timings)
+    perMessage = [t * 1e6 * len(timings) / messages for t in ordered] if messages else []
+
+    def percentile(p):
+        if not perMessage:
+            return 0.0
+        return perMessage[min(len(perMessage) - 1, int(p * len(perMessage)))]
+
+    return {"messages": messages,
+            "seconds": total,
+            "msgs_per_sec": messages / total if total else 0.0,
+            "latency_us": {"mean": total * 1e6 / messages if messages else 0.0,
+                           "p50": percentile(0.50),
+                           "p99": percentile(0.99),
+                           "max": perMessage[-1] if perMessage else 0.0}}
+
+
+def _time(func, items):
+    """ Return the time taken to call func with each item """
+    timer = timeit.default_timer
+    timings = []
+    append = timings.append
+    for item in items:
+        start = timer()
+        func(item)
+        append(timer() - start)
+    return timings
+
+
+def benchFraming(corpus):
+    protocol = _FramingProtocol(None)
+    return _time(protocol.dataReceived, corpus.stream()), len(corpus.lines)
+
+
+def benchParsing(corpus):
+    protocol = txcurrentcost.CurrentCostDataProtocol(lambda kind, msg: None)
+    return _time(protocol.lineReceived, corpus.lines), len(corpus.lines)
+
+
+def benchPeriodicUpdate(corpus):
+    monitor = Monitor(BenchmarkConfig(corpus.clamp_count), task.Clock())
+    messages = [decodePeriodicUpdate(line) for line in corpus.periodicLines()]
+    return _time(monitor._parsePeriodicUpdate, messages), len(messages)
+
+
+def benchPeriodicReading(corpus):
+    monitor = Monitor(BenchmarkConfig(corpus.clamp_count), task.Clock())
+    monitor.typedReadings = True
+    messages = [decodePeriodicReading(line, corpus.clamp_count) for line in corpus.periodicLines()]
+    return _time(monitor._parsePeriodicUpdate, messages), len(messages)
+
+
+def _historyCycles(corpus, timeout=20):
+    """
+    Return the history messages of the corpus grouped by history cycle. A
+    new cycle starts when a history message is received more than timeout
+    seconds, going by the device time, after the previous history message.
+    """
+    cycles = []
+    last = None
+    for line in corpus.historyLines():
+        msg = etree.fromstring(line)
+        hours, minutes, seconds = [int(x) for x in msg.findtext("time").split(":")]
+        now = hours * 3600 + minutes * 60 + seconds
+        if last is None or (now - last) % 86400 > timeout:
+            cycles.append([])
+        cycles[-1].append(msg)
+        last = now
+    return cycles
+
+
+def _completedMonitor(corpus, cycle):
+    monitor = Monitor(BenchmarkConfig(corpus.clamp_count), task.Clock())
+    for msg in cycle:
+        monitor._parseHistoryUpdate(msg)
+    return monitor
+
+
+def benchHistoryUpdate(corpus):
+    timings = []
+    messages = 0
+    for cycle in _historyCycles(corpus):
+        monitor = Monitor(BenchmarkConfig(corpus.clamp_count), task.Clock())
+        timings.extend(_time(monitor._parseHistoryUpdate, cycle))
+        for sensor_type in list(monitor.historicalDataUpdateCompleteForSensorType):
+            timings.extend(_time(monitor._historicalDataUpdateCompleted, [sensor_type]))
+        messages += len(cycle)
+    return timings, messages
+
+
+def benchHistoryToJson(corpus):
+    histories = []
+    for cycle in _historyCycles(corpus):
+        for sensors in _completedMonitor(corpus, cycle).historicSensorData.values():
+            histories.extend(sensors.values())
+    return _time(lambda history: history.toJson(), histories), len(histories)
+
+
+def benchEndToEnd(corpus):
+    clock = task.Clock()
+    monitor = Monitor(BenchmarkConfig(corpus.clamp_count), clock)
+    protocol = txcurrentcost.CurrentCostDataProtocol(monitor._messageHandler)
+    timings = _time(protocol.dataReceived, corpus.stream())
+    # complete any outstanding history cycles
+    timings.extend(_time(clock.advance, [monitor.historicDataMessageTimeout]))
+    return timings, len(corpus.lines)
+
+
+Benchmarks = {"framing": benchFraming,
+              "parsing": benchParsing,
+              "periodic_update": benchPeriodicUpdate,
+              "periodic_reading": benchPeriodicReading,
+              "history_update": benchHistoryUpdate,
+              "history_to_json": benchHistoryToJson,
+              "end_to_end": benchEndToEnd}
+
+
+def run(corpus, stages=None, repeat=3):
+    """
+    Run the benchmark stages against a corpus.
+
+    Each stage is run repeat times and the fastest run is reported.
+
+    @return: A dict of results suitable for encoding as JSON
+    """
+    results = {}
+    for stage in stages or Stages:
+        best = None
+        for _ in range(repeat):
+            timings, messages = Benchmarks[stage](corpus)
+            summary = _summarise(timings, messages)
+            if best is None or summary["seconds"] < best["seconds"]:
+                best = summary
+        results[stage] = best
+
+    return {"python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "corpus": {"description": corpus.description,
+                       "lines": len(corpus.lines)},
+            "stages": results}
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compare two sets of results.
+
+    @param threshold: The fractional drop in throughput reported as a regression
+    @type threshold: float
+
+    @return: A list of (stage, baseline msgs/s, current msgs/s, ratio, regressed) tuples
+    """
+    comparison = []
+    for stage in Stages:
+        if stage not in baseline["stages"] or stage not in current["stages"]:
+            continue
+        before = baseline["stages"][stage]["msgs_per_sec"]
+        after = current["stages"][stage]["msgs_per_sec"]
+        ratio = after / before if before else 0.0
+        comparison.append((stage, before, after, ratio, ratio < 1.0 - threshold))
+    return comparison
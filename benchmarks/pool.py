@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+#
+'''
+This script measures the per message overhead of a MonitorPool as the
+number of devices in the pool grows.
+
+Messages are fed round robin to the protocol of every device in the pool
+so no serial ports are opened.
+
+$ python benchmarks/pool.py
+'''
+
+import time
+import txcurrentcost
+from txcurrentcost.pool import DeviceConfig, MonitorPool
+
+
+Message = '<msg><src>CC128-v0.11</src><dsb>00089</dsb><time>13:02:39</time><tmpr>18.7</tmpr><sensor>0</sensor><id>01234</id><type>1</type><ch1><watts>00345</watts></ch1><ch2><watts>02151</watts></ch2><ch3><watts>00000</watts></ch3></msg>'
+
+
+class CountingPool(MonitorPool):
+
+    def __init__(self, config):
+        super(CountingPool, self).__init__(config)
+        self.received = 0
+
+    def periodicUpdateReceived(self, device_id, timestamp, temperature, sensor_type, sensor_instance, sensor_data):
+        self.received += 1
+
+
+class PoolConfig(object):
+
+    def __init__(self, device_count):
+        self.devices = [DeviceConfig("device%i" % n, "/dev/null", 57600, 3, True) for n in range(device_count)]
+
+
+def run(device_count, messages=50000):
+    pool = CountingPool(PoolConfig(device_count))
+    protocols = [txcurrentcost.CurrentCostDataProtocol(monitor._messageHandler)
+                 for monitor in pool.monitors.values()]
+
+    start = time.time()
+    for n in range(messages):
+        protocols[n % device_count].lineReceived(Message)
+    elapsed = time.time() - start
+
+    assert pool.received == messages
+    return elapsed / messages
+
+
+if __name__ == "__main__":
+    for device_count in (1, 10, 50, 100, 500):
+        print("%4i devices %8.2f us/msg" % (device_count, run(device_count) * 1e6))
@@ -10,14 +10,15 @@ $ python demo.py --configfile=monitor.cfg
 '''
 
 from twisted.internet import reactor
-from twisted.python import log
+from twisted.python import log, usage
 import logging
+import sys
 try:
     import txcurrentcost
-    from txcurrentcost.monitor import MonitorOptions, MonitorConfig, Monitor
+    from txcurrentcost.monitor import MonitorConfig, Monitor
+    from txcurrentcost.options import MonitorOptions
 except ImportError:
     print "Unable to import txcurrentcost. Install the package or make is visible using PYTHONPATH"
-    import sys
     sys.exit(1)
 
 
@@ -63,7 +64,7 @@ if __name__ == "__main__":
     o = MonitorOptions()
     try:
         o.parseOptions()
-    except usage.UsageError, errortext:
+    except usage.UsageError as errortext:
         print "%s: %s" % (sys.argv[0], errortext)
         print "%s: Try --help for usage details." % (sys.argv[0])
         raise SystemExit, 1
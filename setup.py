@@ -4,7 +4,10 @@
 A distutils installation script for txcurrentcost.
 """
 
-from distutils.core import setup
+try:
+    from setuptools import setup
+except ImportError:
+    from distutils.core import setup
 import txcurrentcost
 
 
@@ -22,7 +25,7 @@ setup(name='txcurrentcost',
       license='http://www.opensource.org/licenses/mit-license.php',
       url='https://github.com/claws/txCurrentCost',
       download_url='https://github.com/claws/txCurrentCost/tarball/master',
-      packages=['txcurrentcost'],
+      packages=['txcurrentcost', 'txcurrentcost.test'],
       classifiers=['Development Status :: 4 - Beta',
                    'Environment :: Console',
                    'Intended Audience :: End Users/Desktop',
@@ -35,7 +38,9 @@ setup(name='txcurrentcost',
                    'Topic :: Home Automation',
                    'Topic :: System :: Monitoring',
                    'Topic :: Software Development :: Libraries :: Python Modules'],
-      requires=['pyserial', 'Twisted']
+      requires=['pyserial', 'Twisted'],
+      # NumPy array export, see txcurrentcost.arrays
+      extras_require={'numpy': ['numpy']}
       )
 
 
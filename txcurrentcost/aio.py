@@ -0,0 +1,264 @@
+'''
+This module implements an asyncio engine for Current Cost devices, for
+applications built on asyncio rather than Twisted. It requires Python 3.
+
+The AsyncioMonitor is a Monitor whose serial port is read by the asyncio
+event loop and whose history cycle timers are scheduled on it, so no
+Twisted reactor is needed. Messages are framed, decoded and assembled into
+history cycles by the same code used by the Twisted Monitor. Any event loop
+implementing the standard loop interface, such as uvloop, can be used.
+
+Periodic readings are delivered as txcurrentcost.decoder.PeriodicReading
+objects by iterating over the monitor:
+
+    async def main():
+        monitor = AsyncioMonitor(config)
+        await monitor.start()
+        async for reading in monitor:
+            print(reading.sensor_instance, reading.watts)
+
+History update message cycles are delivered to historyUpdateReceived, as
+with the Twisted Monitor.
+'''
+
+import asyncio
+import logging
+import time
+from txcurrentcost.core import CurrentCostMessageReceiver
+from txcurrentcost.monitor import Monitor
+
+
+# Marks the end of the readings queued by an AsyncioMonitor.
+_End = object()
+
+
+class AsyncioDelayedCall(object):
+    """
+    A call scheduled by an AsyncioClock. Provides the parts of the Twisted
+    IDelayedCall interface used by the monitor.
+    """
+
+    def __init__(self, loop, delay, func, args, kw):
+        self.loop = loop
+        self.func = func
+        self.args = args
+        self.kw = kw
+        self.called = False
+        self.cancelled = False
+        self._handle = loop.call_later(delay, self._call)
+
+    def _call(self):
+        self.called = True
+        self.func(*self.args, **self.kw)
+
+    def active(self):
+        return not (self.called or self.cancelled)
+
+    def cancel(self):
+        self.cancelled = True
+        self._handle.cancel()
+
+    def reset(self, delay):
+        """ Reschedule the call to run delay seconds from now """
+        self._handle.cancel()
+        self._handle = self.loop.call_later(delay, self._call)
+
+
+class AsyncioClock(object):
+    """
+    Schedule calls on an asyncio event loop using the parts of the Twisted
+    IReactorTime interface used by the monitor, batcher and reading log.
+    """
+
+    def __init__(self, loop=None):
+        """
+        @param loop: The event loop calls are scheduled on. Defaults to the
+                     loop running when the first call is scheduled.
+        """
+        self.loop = loop
+
+    def seconds(self):
+        return time.time()
+
+    def callLater(self, delay, func, *args, **kw):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        return AsyncioDelayedCall(self.loop, delay, func, args, kw)
+
+
+class CurrentCostAsyncioProtocol(CurrentCostMessageReceiver, asyncio.Protocol):
+    """
+    Receive CurrentCost messages from an asyncio transport. See
+    txcurrentcost.core.CurrentCostMessageReceiver.
+    """
+
+    def __init__(self, msgHandler, parseHistory=True, metrics=None, lost=None, clampCount=None):
+        """
+        @param lost: Called with the exception that closed the transport, or
+                     None if it was closed normally, when the connection is lost
+        """
+        super(CurrentCostAsyncioProtocol, self).__init__(msgHandler, parseHistory, metrics, clampCount)
+        self.lost = lost
+        self.transport = None
+
+    def connection_made(self, transport):
+        logging.debug("%s connection made!" % self.__class__.__name__)
+        self.transport = transport
+
+    # Received data goes straight to the framer.
+    data_received = CurrentCostMessageReceiver.dataReceived
+
+    def connection_lost(self, exc):
+        logging.debug("%s connection lost!" % self.__class__.__name__)
+        self.transport = None
+        self.framer.clear()
+        if self.lost is not None:
+            self.lost(exc)
+
+
+async def openSerialPort(protocol, port, loop, baudrate=57600):
+    """
+    Open a serial port and read it on an asyncio event loop. This is the
+    default portFactory of an AsyncioMonitor. Serial ports are read as
+    character devices so this is only supported on POSIX platforms.
+
+    @param protocol: The protocol that receives data from the port
+    @type protocol: an asyncio.Protocol
+    @param port: The serial port device name
+    @type port: string
+    @param loop: The event loop reading the port
+    @param baudrate: The serial port baudrate
+    @type baudrate: int
+
+    @return: The transport reading the port. Closing it closes the port.
+    """
+    import serial
+    device = serial.Serial(port, baudrate=baudrate, timeout=0)
+    try:
+        transport, _ = await loop.connect_read_pipe(lambda: protocol, device)
+    except Exception:
+        device.close()
+        raise
+    return transport
+
+
+class AsyncioMonitor(Monitor):
+    """
+    Monitor a current cost device from an asyncio event loop.
+
+    Iterating over the monitor, using async for, yields each periodic update
+    as a txcurrentcost.decoder.PeriodicReading. If the typedReadings
+    attribute is set to False the periodicUpdateReceived arguments are
+    yielded as a 5-tuple instead. When more than max_queue readings are
+    waiting the oldest are dropped and counted by droppedReadings. Iteration
+    ends when the monitor is stopped and raises the error that closed the
+    port if it is lost. Readings are not queued when batching is enabled.
+
+    The serial port is opened using the portFactory attribute, a coroutine
+    function accepting the same arguments as openSerialPort, which is the
+    default.
+
+    These Monitor features work as they do with Twisted:
+
+      - typedReadings, historyDeltas and expectedHistory
+      - metrics, recorded into a MetricsRegistry that can be inspected
+        using its snapshot or render methods
+      - statistics, recentReadings and deadband
+      - periodic batching, see enablePeriodicBatching
+      - readingLog, when the ReadingLog is created with the monitor clock
+      - exporter, when the Exporter is created with the monitor clock and
+        given a sender that does not use Twisted
+
+    These features need a Twisted reactor and are not supported: history
+    decoders and reconnection, which raise NotImplementedError, the
+    exporter's HTTPSender, FanoutFactory and listenMetrics.
+    """
+
+    def __init__(self, config, loop=None, max_queue=1000):
+        """
+        @param config: A MonitorConfig instance holding configuration settings
+        @type config: a MonitorConfig instance
+        @param loop: The event loop the monitor runs on. Defaults to the
+                     loop running when the monitor is started.
+        @param max_queue: The maximum number of readings waiting to be iterated
+        @type max_queue: int
+        """
+        super(AsyncioMonitor, self).__init__(config, AsyncioClock(loop))
+        self.loop = loop
+        self.portFactory = openSerialPort
+        self.typedReadings = True
+        self.max_queue = max_queue
+        self.droppedReadings = 0
+        self._readings = None
+        self._lostError = None
+
+    def enableReconnection(self, initial_delay=0.05, max_delay=1.0):
+        raise NotImplementedError("%s does not support reconnection" % self.__class__.__name__)
+
+    def periodicReadingReceived(self, reading):
+        self._queueReading(reading)
+
+    def periodicUpdateReceived(self, timestamp, temperature, sensor_type, sensor_instance, sensor_data):
+        self._queueReading((timestamp, temperature, sensor_type, sensor_instance, sensor_data))
+
+    def _queueReading(self, reading):
+        if self._readings is None:
+            return
+        if self._readings.qsize() >= self.max_queue:
+            self._readings.get_nowait()
+            self.droppedReadings += 1
+        self._readings.put_nowait(reading)
+
+    async def start(self):
+        """
+        Start the CurrentCost monitor, opening the serial port.
+        """
+        logging.info('AsyncioMonitor starting')
+        if self.historyDecoder:
+            raise NotImplementedError("%s does not support history decoders" % self.__class__.__name__)
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.clock.loop = self.loop
+        logging.info('Attempting to open port %s at %dbps' % (self.config.port, self.config.baudrate))
+        self._readings = asyncio.Queue()
+        self._lostError = None
+        self.protocol = CurrentCostAsyncioProtocol(self._messageHandler,
+                                                   metrics=self.metrics,
+                                                   lost=self._portLost,
+                                                   clampCount=self._readingClampCount())
+        self.serialPort = await self.portFactory(self.protocol,
+                                                 self.config.port,
+                                                 self.loop,
+                                                 baudrate=self.config.baudrate)
+
+    def stop(self):
+        """
+        Stop the CurrentCost monitor, closing the serial port.
+        """
+        logging.info('AsyncioMonitor stopping')
+        if self.serialPort is not None:
+            self.serialPort.close()
+        self._flushOutputs()
+
+    def _portLost(self, exc):
+        if exc is not None:
+            logging.error("Lost port %s: %s" % (self.config.port, exc))
+            self._lostError = exc
+        self._flushOutputs()
+        if self._readings is not None:
+            self._readings.put_nowait(_End)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._readings is None:
+            raise StopAsyncIteration
+        reading = await self._readings.get()
+        if reading is _End:
+            # Leave the end marker for any other iterator.
+            self._readings.put_nowait(_End)
+            if self._lostError is not None:
+                raise self._lostError
+            raise StopAsyncIteration
+        return reading
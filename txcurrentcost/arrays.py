@@ -0,0 +1,180 @@
+'''
+This module implements NumPy array export of Current Cost data for
+analytics.
+
+NumPy is an optional dependency, installed using the numpy extra:
+
+    pip install txcurrentcost[numpy]
+
+The toNumpy methods of SensorHistoryData, PeriodicBatch and
+ReadingLogReader import this module when called so that the rest of the
+package can be used without NumPy.
+
+loadCapturedLog turns a whole captured log of raw messages, as read by
+txcurrentcost.replay.readCapturedLog, into per sensor arrays in one call.
+'''
+
+import re
+try:
+    import numpy
+except ImportError:
+    raise ImportError("txcurrentcost.arrays requires NumPy, install it using: pip install txcurrentcost[numpy]")
+from txcurrentcost.readinglog import FormatVersion, LegacyRecord, MaxChannels, MaxDeviceLength, Record
+
+
+# The layout of a txcurrentcost.readinglog record.
+ReadingLogDtype = numpy.dtype([('timestamp', '<f8'),
+                               ('device', 'S%i' % MaxDeviceLength),
+                               ('sensor_type', 'u1'),
+                               ('sensor_instance', 'u1'),
+                               ('channels', 'u1'),
+                               ('pad', 'V5'),
+                               ('temperature', '<f8'),
+                               ('values', '<f8', (MaxChannels,))])
+assert ReadingLogDtype.itemsize == Record.size
+
+# The layout of a record of a version 1 reading log segment.
+_LegacyReadingLogDtype = numpy.dtype([('timestamp', '<f8'),
+                                      ('device', 'S%i' % MaxDeviceLength),
+                                      ('sensor_type', 'u1'),
+                                      ('sensor_instance', 'u1'),
+                                      ('channels', 'u1'),
+                                      ('pad', 'V1'),
+                                      ('temperature', '<f4'),
+                                      ('values', '<f4', (MaxChannels,))])
+assert _LegacyReadingLogDtype.itemsize == LegacyRecord.size
+
+# The layout of the periodic readings of a PeriodicBatch.
+PeriodicDtype = numpy.dtype([('timestamp', 'datetime64[us]'),
+                             ('temperature', 'f8'),
+                             ('sensor_type', 'u1'),
+                             ('sensor_instance', 'u1'),
+                             ('values', 'f8', (MaxChannels,))])
+
+# The layout of the time indexed history datapoints of a SensorHistoryData.
+HistoryPeriodDtype = numpy.dtype([('period_start', 'datetime64[s]'),
+                                  ('value', 'f8')])
+
+# The layout of the per sensor arrays returned by loadCapturedLog. The
+# timestamp is in seconds since the epoch.
+CapturedDtype = numpy.dtype([('timestamp', 'f8'),
+                             ('temperature', 'f8'),
+                             ('values', 'f8', (MaxChannels,))])
+
+# Matches a periodic update message line of a captured log, optionally
+# prefixed by its receipt time and a tab, using the element order sent by
+# Current Cost devices.
+_CAPTURED_PERIODIC = re.compile(
+    r'^(?:([0-9.]+)\t)?\s*<msg>.*?<tmpr>([^<]*)</tmpr>\s*<sensor>(\d+)</sensor>.*?<type>(\d+)</type>' +
+    ''.join(r'\s*(?:<ch%i>\s*<watts>(\d+)</watts>\s*</ch%i>)?' % (n, n) for n in range(1, MaxChannels + 1)) +
+    r'.*?</msg>\s*$', re.MULTILINE)
+
+
+def _floats(column):
+    """ Convert a column of numeric strings, with empty strings for missing values, to floats """
+    column = numpy.asarray(column)
+    return numpy.where(column == '', 'nan', column).astype('f8')
+
+
+def periodicBatchArray(batch):
+    """
+    Return the readings of a PeriodicBatch as a structured array. Missing
+    channel values are NaN. OptiSmart readings hold the impulse count and
+    impulses per unit as their first two values.
+    """
+    result = numpy.empty(len(batch), dtype=PeriodicDtype)
+    result['timestamp'] = numpy.array(batch.timestamps, dtype='datetime64[us]')
+    result['temperature'] = [numpy.nan if t in (None, '') else float(t) for t in batch.temperatures]
+    result['sensor_type'] = batch.sensor_types
+    result['sensor_instance'] = batch.sensor_instances
+    values = numpy.full((len(batch), MaxChannels), numpy.nan)
+    for row, sensor_data in enumerate(batch.sensor_data):
+        for column, value in enumerate(sensor_data[:MaxChannels]):
+            if value not in (None, ''):
+                values[row, column] = float(value)
+    result['values'] = values
+    return result
+
+
+def historyValuesArray(values, irregular=()):
+    """
+    Return a float64 array sharing the memory of an array.array('d') of
+    history values, or a copy if irregular (index, value) 2-tuples have to
+    be merged in.
+    """
+    result = numpy.frombuffer(values, dtype='f8')
+    if not irregular:
+        # The view must not be used to modify the history data.
+        result.flags.writeable = False
+        return result
+    size = max(len(result), max(index for index, _ in irregular) + 1)
+    merged = numpy.full(size, numpy.nan)
+    merged[:len(result)] = result
+    for index, value in irregular:
+        merged[index] = value
+    return merged
+
+
+def historyPeriodsArray(starts, values):
+    """
+    Return a structured array of history period start times and values.
+    """
+    result = numpy.empty(len(starts), dtype=HistoryPeriodDtype)
+    result['period_start'] = numpy.array(starts, dtype='datetime64[s]')
+    result['value'] = values
+    return result
+
+
+def readingLogArray(buffer, offset, count, version=FormatVersion):
+    """
+    Return a structured array viewing count reading log records held in a
+    buffer, such as a memory mapped segment, starting at a byte offset.
+    Records of a version 1 segment are copied into a ReadingLogDtype array.
+    """
+    if version == FormatVersion:
+        return numpy.frombuffer(buffer, dtype=ReadingLogDtype, count=count, offset=offset)
+    legacy = numpy.frombuffer(buffer, dtype=_LegacyReadingLogDtype, count=count, offset=offset)
+    records = numpy.zeros(count, dtype=ReadingLogDtype)
+    for name in ('timestamp', 'device', 'sensor_type', 'sensor_instance', 'channels', 'temperature', 'values'):
+        records[name] = legacy[name]
+    return records
+
+
+def loadCapturedLog(path):
+    """
+    Load the periodic update messages of a captured log into per sensor
+    arrays in one call.
+
+    The log is scanned in a single pass and each column is converted
+    using vectorized operations. History messages, and any line that does
+    not fit the periodic update layout, are skipped. The timestamp of a
+    message without a receipt time prefix is NaN.
+
+    @param path: The path of the captured log file
+    @type path: string
+
+    @return: A dict keyed by (sensor_type, sensor_instance) 2-tuples holding
+             structured arrays of the readings from each sensor in log order.
+    """
+    with open(path) as log:
+        matches = _CAPTURED_PERIODIC.findall(log.read())
+    if not matches:
+        return {}
+
+    columns = numpy.array(matches).T
+    timestamps = _floats(columns[0])
+    temperatures = _floats(columns[1])
+    sensor_instances = columns[2].astype('i4')
+    sensor_types = columns[3].astype('i4')
+    values = numpy.column_stack([_floats(column) for column in columns[4:]])
+
+    keys, inverse = numpy.unique(sensor_types * 256 + sensor_instances, return_inverse=True)
+    result = {}
+    for n, key in enumerate(keys):
+        rows = inverse == n
+        sensor = numpy.empty(numpy.count_nonzero(rows), dtype=CapturedDtype)
+        sensor['timestamp'] = timestamps[rows]
+        sensor['temperature'] = temperatures[rows]
+        sensor['values'] = values[rows]
+        result[(int(key // 256), int(key % 256))] = sensor
+    return result
@@ -0,0 +1,115 @@
+'''
+This module implements batched delivery of periodic updates.
+
+Rather than handing each periodic update to the user one at a time, a
+PeriodicBatcher collects them into a PeriodicBatch that is delivered once
+it holds a maximum number of readings or once the oldest reading has waited
+a maximum delay, whichever happens first. This lets downstream writers
+(databases, HTTP services, etc) pay the cost of a round trip once per batch
+rather than once per reading.
+'''
+
+import logging
+
+
+class PeriodicBatch(object):
+    """
+    A batch of periodic updates stored by column. Each column is a list
+    holding one entry per reading, in order of receipt, with the same
+    meaning as the Monitor.periodicUpdateReceived argument of the same name.
+    """
+
+    __slots__ = ('timestamps', 'temperatures', 'sensor_types', 'sensor_instances', 'sensor_data')
+
+    def __init__(self):
+        self.timestamps = []
+        self.temperatures = []
+        self.sensor_types = []
+        self.sensor_instances = []
+        self.sensor_data = []
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, timestamp, temperature, sensor_type, sensor_instance, sensor_data):
+        """ Add a reading to the batch """
+        self.timestamps.append(timestamp)
+        self.temperatures.append(temperature)
+        self.sensor_types.append(sensor_type)
+        self.sensor_instances.append(sensor_instance)
+        self.sensor_data.append(sensor_data)
+
+    def rows(self):
+        """
+        Return an iterator of the readings in the batch. Each reading is a
+        tuple of the Monitor.periodicUpdateReceived arguments.
+        """
+        return zip(self.timestamps, self.temperatures, self.sensor_types,
+                   self.sensor_instances, self.sensor_data)
+
+    def toNumpy(self):
+        """
+        Return the readings in the batch as a NumPy structured array, see
+        txcurrentcost.arrays.PeriodicDtype.
+
+        Requires NumPy, see txcurrentcost.arrays.
+        """
+        from txcurrentcost import arrays
+        return arrays.periodicBatchArray(self)
+
+
+class PeriodicBatcher(object):
+    """
+    Collect periodic updates and deliver them in batches.
+    """
+
+    def __init__(self, clock, batchReceived, max_count=100, max_delay=1.0):
+        """
+        @param clock: The reactor used to schedule delivery of a batch
+        @param batchReceived: Called with each PeriodicBatch to deliver
+        @param max_count: The maximum number of readings in a batch
+        @type max_count: int
+        @param max_delay: The maximum seconds a reading waits before delivery
+        @type max_delay: float
+        """
+        self.clock = clock
+        self.batchReceived = batchReceived
+        self.max_count = max_count
+        self.max_delay = max_delay
+        self.batch = PeriodicBatch()
+        self._flushCall = None
+
+    @property
+    def latencyBound(self):
+        """ The maximum seconds between receipt and delivery of a reading """
+        return self.max_delay
+
+    def add(self, timestamp, temperature, sensor_type, sensor_instance, sensor_data):
+        """ Add a reading to the current batch """
+        self.batch.append(timestamp, temperature, sensor_type, sensor_instance, sensor_data)
+        if len(self.batch) >= self.max_count:
+            self.flush()
+        elif self._flushCall is None:
+            self._flushCall = self.clock.callLater(self.max_delay, self._flushLater)
+
+    def _flushLater(self):
+        self._flushCall = None
+        self.flush()
+
+    def flush(self):
+        """ Deliver the current batch now, if it holds any readings """
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+
+        if not self.batch:
+            return
+
+        batch = self.batch
+        self.batch = PeriodicBatch()
+        try:
+            self.batchReceived(batch)
+        except Exception as ex:
+            logging.error("Problem delivering a batch of %i periodic updates" % len(batch))
+            logging.exception(ex)
@@ -0,0 +1,799 @@
+'''
+This module defines the core Current Cost classes such as Sensors, the
+History data store and the receiver that frames and decodes the messages
+sent by a Current Cost device.
+
+The core imports no Twisted code, so it can be used by batch jobs and
+tools that only decode messages, as well as by the Twisted and asyncio
+engines.
+
+The Current Cost message defintion is defined at:
+http://www.currentcost.com/cc128/xml.htm
+'''
+
+import array
+import bisect
+import datetime
+import json
+import logging
+try:
+    from xml.etree import cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+from txcurrentcost.decoder import (decodePeriodicFrame, decodePeriodicReading, decodePeriodicReadingFrame,
+                                   decodePeriodicUpdate, messageText)
+from txcurrentcost.framing import MessageFramer
+
+
+# Define the kinds of messages that can be received from the CurrentCost device
+#
+PeriodicUpdateMsg = 'periodic_update_msg'
+HistoryUpdateMsg = 'history_update_msg'
+RawHistoryUpdateMsg = 'raw_history_update_msg'
+MessageKinds = [PeriodicUpdateMsg,
+                HistoryUpdateMsg,
+                RawHistoryUpdateMsg]
+
+
+class Sensors(object):
+    """ Define Current Cost sensor kinds """
+
+    # Defines the maximum number of sensors available.
+    # 0 - Whole House sensor
+    # 1-9 Appliance sensors
+    Maximum = 10
+
+    WholeHouseSensorId = 0
+    IndividualApplicanceMonitor1Id = 1
+    IndividualApplicanceMonitor2Id = 2
+    IndividualApplicanceMonitor3Id = 3
+    IndividualApplicanceMonitor4Id = 4
+    IndividualApplicanceMonitor5Id = 5
+    IndividualApplicanceMonitor6Id = 6
+    IndividualApplicanceMonitor7Id = 7
+    IndividualApplicanceMonitor8Id = 8
+    IndividualApplicanceMonitor9Id = 9
+
+    # Sensor Types
+    TemperatureSensor = 0  # A psuedo kind used for periodic updates
+    ElectricitySensor = 1  # Whole House unit, IAM's, etc
+    OptiSmartSensor = 2    # Impulse sensor
+
+    Types = [TemperatureSensor,
+             ElectricitySensor,
+             OptiSmartSensor]
+
+    Names = {TemperatureSensor: "Temperature",
+             ElectricitySensor: "Electricity",
+             OptiSmartSensor: "OptiSmart"}
+
+    Units = {TemperatureSensor: "C",
+             ElectricitySensor: "Watts",
+             OptiSmartSensor: "ipu"}
+
+    @classmethod
+    def nameForType(cls, sensor_type):
+        if sensor_type in Sensors.Types:
+            name = Sensors.Names[sensor_type]
+        else:
+            logging.warning("Invalid sensor type \'%s\' not in %s - can't return name" % (sensor_type, Sensors.Types))
+            name = "Unknown"
+        return name
+
+    @classmethod
+    def unitsForType(cls, sensor_type):
+        if sensor_type in Sensors.Types:
+            _type = Sensors.Units[sensor_type]
+        else:
+            logging.warning("Invalid sensor type \'%s\' not in %s - can't return units" % (sensor_type, Sensors.Types))
+            _type = "Unknown"
+        return _type
+
+
+# Marks a missing entry in the history data arrays
+_Missing = float('nan')
+
+def _valueFormat(value):
+    """
+    Return the format that reproduces a history value string such as 001.1
+    from its float value or None if the value is not a plain decimal number.
+    """
+    whole, _, fraction = value.partition('.')
+    if not whole.isdigit() or (fraction and not fraction.isdigit()):
+        return None
+    return '%%0%i.%if' % (len(value), len(fraction))
+
+
+def _tagIndex(tag):
+    """
+    Return the numeric part of a history datapoint tag, e.g. 18 for h018,
+    or None if the tag has no numeric part.
+    """
+    digits = tag[1:]
+    if digits.isdigit():
+        return int(digits)
+    return None
+
+
+def _monthsBefore(when, months):
+    """
+    Return the first day of the month the specified number of months before
+    the month holding when.
+    """
+    month = when.year * 12 + when.month - 1 - months
+    return when.replace(year=month // 12, month=month % 12 + 1, day=1,
+                        hour=0, minute=0, second=0, microsecond=0)
+
+
+class SensorHistoryData(object):
+    """
+    Store history data for a single Current Cost sensor
+
+    The values for each kind of history data are held in a fixed size array
+    of floats indexed by the numeric part of the datapoint tag, e.g. the
+    value for tag h018 is held at index 18 of the hour data array. Missing
+    entries hold NaN. Current Cost devices send all values of a data kind
+    using the same fixed width format (e.g. 001.1) which is recorded once
+    per data kind so that the original value strings can be reproduced. Any
+    datapoint that can not be reproduced exactly from the array is kept as
+    an irregular (tag, value) datapoint instead.
+
+    The sorted datapoint views and the JSON encoding are cached once built
+    and reused until a datapoint is stored. A history message cycle stores
+    all of its datapoints before the data is handed on so these are built
+    at most once per history message cycle.
+
+    Datapoint tags count periods back from the time the history was sent.
+    Tag hN covers the 2 hours from N hours before the start of the hour the
+    history was received, dN the day N days before the day it was received,
+    mN the month N months before and yN the year N years before. The time
+    index maps each numeric datapoint to the start of its period, using the
+    last_update timestamp as the time the history was received, so that
+    datapoints can be queried by time using the between method. The Monitor
+    builds the index when a history message cycle completes.
+    """
+
+    __slots__ = ('instance', 'type', 'units', 'last_update', 'dataPresent',
+                 '_values', '_formats', '_irregular', '_sortedData', '_json', '_index')
+
+    Hour_Data = 'hour'
+    Day_Data = 'day'
+    Month_Data = 'month'
+    Year_Data = 'year'
+
+    Hour_Data_Prefix = 'h'
+    Day_Data_Prefix = 'd'
+    Month_Data_Prefix = 'm'
+    Year_Data_Prefix = 'y'
+
+    Prefixes = [Hour_Data_Prefix,
+                Day_Data_Prefix,
+                Month_Data_Prefix,
+                Year_Data_Prefix]
+
+    Prefix_To_Data_Kind_Map = {Hour_Data_Prefix: Hour_Data,
+                               Day_Data_Prefix: Day_Data,
+                               Month_Data_Prefix: Month_Data,
+                               Year_Data_Prefix: Year_Data}
+
+    Data_Kind_To_Prefix_Map = {Hour_Data: Hour_Data_Prefix,
+                               Day_Data: Day_Data_Prefix,
+                               Month_Data: Month_Data_Prefix,
+                               Year_Data: Year_Data_Prefix}
+
+    # The number of entries allocated for each data kind. This covers the
+    # 2 hourly data for 31 days, 90 days, 84 months and 4 years of history
+    # held by the device. Datapoints with a larger tag index are kept as
+    # irregular datapoints so the arrays never move in memory, allowing
+    # toNumpy to share them.
+    Data_Kind_Capacity = {Hour_Data: 745,
+                          Day_Data: 91,
+                          Month_Data: 85,
+                          Year_Data: 5}
+
+    def __init__(self, sensor_type, sensor_instance, sensor_units):
+
+        self.instance = sensor_instance
+        self.type = sensor_type
+        self.units = sensor_units
+        self.last_update = None
+
+        # historical data stores
+        self._values = {}
+        self._formats = {}
+        for data_kind, capacity in SensorHistoryData.Data_Kind_Capacity.items():
+            self._values[data_kind] = array.array('d', [_Missing]) * capacity
+            self._formats[data_kind] = None
+        # irregular datapoints by data kind, each a dict of values keyed by tag
+        self._irregular = {}
+
+        # cached sorted datapoint lists by data kind and cached JSON encoding
+        self._sortedData = {}
+        self._json = None
+        # cached time index by data kind, each a 2-tuple of a list of period
+        # start times and a list of values in ascending time order.
+        self._index = {}
+
+        # This flag declares that this sensor has non-zero data. CurrentCost
+        # history messages contain a full complement of hour, day, month,
+        # year entries even when the content is entirely zeros. If any value
+        # is non-zero this flag is set. This can be useful if we only want to
+        # process history data for a sensor that actually contains data.
+        self.dataPresent = False
+
+    def _getDataPointKind(self, tag):
+        """
+        Detect the kind of history data point by inspecting the tag.
+        Examples of tags are: h018, d054, m002, y001
+        """
+        tag_prefix = tag[0]
+        if tag_prefix in SensorHistoryData.Prefixes:
+            history_data_kind = SensorHistoryData.Prefix_To_Data_Kind_Map[tag_prefix]
+            return history_data_kind
+        else:
+            logging.error("Unknown tag prefix \'%s\', can't resolve to history data kind" % (tag_prefix))
+
+    def _getData(self, data_kind):
+        """
+        Return a list of tuples containing the data in ascending tag order.
+        Each tuple in the list contains the data tag and the value.
+        The data key is kept associated with the value (rather than simply a
+        list of values) so that the value can't be misinterpreted as belonging
+        to a different tag in cases where intervening tags are missing.
+        """
+        sortedData = self._sortedData.get(data_kind)
+        if sortedData is None:
+            sortedData = self._sortData(data_kind)
+            self._sortedData[data_kind] = sortedData
+        # Return a copy so callers can't modify the cached list.
+        return list(sortedData)
+
+    def _sortData(self, data_kind):
+        """
+        Build the list of tuples returned by _getData from the data store.
+        """
+        tagFormat = SensorHistoryData.Data_Kind_To_Prefix_Map[data_kind] + '%03d'
+        valueFormat = self._formats[data_kind]
+        sortedData = []
+        for index, number in enumerate(self._values[data_kind]):
+            if number == number:
+                sortedData.append((tagFormat % index, valueFormat % number))
+
+        irregular = self._irregular.get(data_kind)
+        if irregular:
+            sortedData.extend(irregular.items())
+            # Sort the data using the integer value of the tag index. Tags
+            # without one sort last.
+            sortedData.sort(key=lambda x: (_tagIndex(x[0]) is None, _tagIndex(x[0]) or 0, x[0]))
+        return sortedData
+
+    def _hasData(self, data_kind):
+        """
+        Return True if any datapoints of the data kind are stored.
+        """
+        sortedData = self._sortedData.get(data_kind)
+        if sortedData is not None:
+            return len(sortedData) > 0
+        if self._irregular.get(data_kind):
+            return True
+        for number in self._values[data_kind]:
+            if number == number:
+                return True
+        return False
+
+    def _storeDataPoint(self, data_kind, tag, value):
+        """
+        Store a datapoint of the specified data kind.
+        """
+        self._sortedData[data_kind] = None
+        self._json = None
+        self._index.pop(data_kind, None)
+
+        index = _tagIndex(tag)
+        values = self._values[data_kind]
+        regular = len(tag) == 4 and index is not None and index < len(values)
+
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            number = _Missing
+
+        if regular and number == number:
+            valueFormat = self._formats[data_kind]
+            if valueFormat is None:
+                valueFormat = _valueFormat(value)
+                self._formats[data_kind] = valueFormat
+            if valueFormat is not None and valueFormat % number == value:
+                values[index] = number
+                irregular = self._irregular.get(data_kind)
+                if irregular:
+                    irregular.pop(tag, None)
+                self._checkForActualData(number)
+                return
+
+        # The datapoint can't be reproduced from the array so keep it as is.
+        if regular:
+            values[index] = _Missing
+        self._irregular.setdefault(data_kind, {})[tag] = value
+        if number == number:
+            self._checkForActualData(number)
+
+    def _checkForActualData(self, number):
+        """
+        Set a flag on this sensor if non-zero data is observed.
+        """
+        if not self.dataPresent:
+            if number > 0:
+                self.dataPresent = True
+
+    def _setData(self, data_kind, data):
+        """
+        Replace all datapoints of the specified data kind.
+        """
+        self._values[data_kind][:] = array.array('d', [_Missing]) * len(self._values[data_kind])
+        self._formats[data_kind] = None
+        self._irregular.pop(data_kind, None)
+        self._sortedData[data_kind] = None
+        self._json = None
+        self._index.pop(data_kind, None)
+        for tag, value in data.items():
+            self._storeDataPoint(data_kind, tag, value)
+
+    # The datapoint dicts are built from the data store on each access, so
+    # changes to a returned dict are not stored. Assign a whole dict to
+    # replace the datapoints of a kind.
+
+    @property
+    def hourData(self):
+        """ A dict of hour data keyed by tag """
+        return dict(self.getHourData())
+
+    @hourData.setter
+    def hourData(self, data):
+        self._setData(SensorHistoryData.Hour_Data, data)
+
+    @property
+    def dayData(self):
+        """ A dict of day data keyed by tag """
+        return dict(self.getDayData())
+
+    @dayData.setter
+    def dayData(self, data):
+        self._setData(SensorHistoryData.Day_Data, data)
+
+    @property
+    def monthData(self):
+        """ A dict of month data keyed by tag """
+        return dict(self.getMonthData())
+
+    @monthData.setter
+    def monthData(self, data):
+        self._setData(SensorHistoryData.Month_Data, data)
+
+    @property
+    def yearData(self):
+        """ A dict of year data keyed by tag """
+        return dict(self.getYearData())
+
+    @yearData.setter
+    def yearData(self, data):
+        self._setData(SensorHistoryData.Year_Data, data)
+
+    def getHourData(self):
+        """
+        Return a list of tuples containing hour data in ascending tag order.
+        """
+        return self._getData(SensorHistoryData.Hour_Data)
+
+    def getDayData(self):
+        """
+        Return a list of tuples containing day data in ascending tag order.
+        """
+        return self._getData(SensorHistoryData.Day_Data)
+
+    def getMonthData(self):
+        """
+        Return a list of tuples containing month data in ascending tag order.
+        """
+        return self._getData(SensorHistoryData.Month_Data)
+
+    def getYearData(self):
+        """
+        Return a list of tuples containing year data in ascending tag order.
+        """
+        return self._getData(SensorHistoryData.Year_Data)
+
+    def storeHourData(self, key, value):
+        """
+        Store an hour datapoint
+        """
+        self._storeDataPoint(SensorHistoryData.Hour_Data, key, value)
+
+    def storeDayData(self, key, value):
+        """
+        Store a day datapoint
+        """
+        self._storeDataPoint(SensorHistoryData.Day_Data, key, value)
+
+    def storeMonthData(self, key, value):
+        """
+        Store a month datapoint
+        """
+        self._storeDataPoint(SensorHistoryData.Month_Data, key, value)
+
+    def storeYearData(self, key, value):
+        """
+        Store a year datapoint
+        """
+        self._storeDataPoint(SensorHistoryData.Year_Data, key, value)
+
+    def storeDataPoints(self, timestamp, datapoints):
+        """
+        Store any kind of historical datapoints. History entries might exist
+        for hour, day, month, year. Handle all variants of datapoint kind.
+
+        @param timestamp: timestamp of the last history update received
+        @type timestamp: datetime
+        @param datapoints: A list of 2-tuples containing the history tag and value
+        @type datapoints: list of 2-tuples
+        """
+        self.last_update = timestamp
+        self._json = None
+        self._index = {}
+        for tag, value in datapoints:
+            history_data_kind = self._getDataPointKind(tag)
+
+            if history_data_kind == SensorHistoryData.Hour_Data:
+                self.storeHourData(tag, value)
+
+            elif history_data_kind == SensorHistoryData.Day_Data:
+                self.storeDayData(tag, value)
+
+            elif history_data_kind == SensorHistoryData.Month_Data:
+                self.storeMonthData(tag, value)
+
+            elif history_data_kind == SensorHistoryData.Year_Data:
+                self.storeYearData(tag, value)
+
+            else:
+                logging.warning("Don't know how to handle historical tag %s with value %s" % (tag, value))
+
+    def _periodStart(self, data_kind, index):
+        """
+        Return the start of the period covered by the datapoint with the
+        specified tag index, or None if it is before the earliest date.
+        """
+        received = self.last_update
+        try:
+            if data_kind == SensorHistoryData.Hour_Data:
+                return received.replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=index)
+            elif data_kind == SensorHistoryData.Day_Data:
+                return received.replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=index)
+            elif data_kind == SensorHistoryData.Month_Data:
+                return _monthsBefore(received, index)
+            else:
+                return received.replace(year=received.year - index, month=1, day=1,
+                                        hour=0, minute=0, second=0, microsecond=0)
+        except (OverflowError, ValueError):
+            return None
+
+    def _buildIndex(self, data_kind):
+        """
+        Build the time index of a data kind from the data store.
+        """
+        datapoints = [(index, number) for index, number in enumerate(self._values[data_kind])
+                      if number == number]
+        irregular = self._irregular.get(data_kind)
+        if irregular:
+            for tag, value in irregular.items():
+                index = _tagIndex(tag)
+                try:
+                    number = float(value)
+                except (TypeError, ValueError):
+                    continue
+                if index is not None and number == number:
+                    datapoints.append((index, number))
+            datapoints.sort()
+
+        # Larger tag indexes are further back in time.
+        datapoints.reverse()
+        periods = [(self._periodStart(data_kind, index), number) for index, number in datapoints]
+        starts = [start for start, _ in periods if start is not None]
+        values = [number for start, number in periods if start is not None]
+        return starts, values
+
+    def buildIndex(self):
+        """
+        Build the time index of every data kind, if not already built, so
+        that later queries using between do not need to build it.
+        """
+        if self.last_update is None:
+            return
+        for data_kind in SensorHistoryData.Data_Kind_Capacity:
+            if data_kind not in self._index:
+                self._index[data_kind] = self._buildIndex(data_kind)
+
+    def between(self, start, end, data_kind=Hour_Data):
+        """
+        Return a list of 2-tuples holding the period start time and the
+        float value of the datapoints, of the specified kind, whose period
+        starts from start up to, but not including, end in ascending time
+        order.
+
+        @param start: The start of the time range
+        @type start: datetime.datetime
+        @param end: The end of the time range
+        @type end: datetime.datetime
+        @param data_kind: The kind of history data, defaults to hour data
+        @type data_kind: string
+        """
+        if self.last_update is None:
+            return []
+        index = self._index.get(data_kind)
+        if index is None:
+            index = self._buildIndex(data_kind)
+            self._index[data_kind] = index
+        starts, values = index
+        first = bisect.bisect_left(starts, start)
+        last = bisect.bisect_left(starts, end, first)
+        return list(zip(starts[first:last], values[first:last]))
+
+    def snapshot(self):
+        """
+        Return a dict of the datapoint value strings keyed by a 2-tuple of
+        the data kind and the period start time. Unlike tags, which count
+        back from the time the history was received, these keys identify
+        the same period in every history message cycle.
+        """
+        snapshot = {}
+        if self.last_update is None:
+            return snapshot
+        for data_kind in SensorHistoryData.Data_Kind_Capacity:
+            for tag, value in self._getData(data_kind):
+                index = _tagIndex(tag)
+                period = None if index is None else self._periodStart(data_kind, index)
+                if period is not None:
+                    snapshot[(data_kind, period)] = value
+        return snapshot
+
+    def changedSince(self, snapshot):
+        """
+        Return a new SensorHistoryData holding only the datapoints that are
+        new or have changed since a snapshot was taken.
+
+        @param snapshot: A snapshot returned by the snapshot method
+        @type snapshot: dict
+        """
+        changed = SensorHistoryData(self.type, self.instance, self.units)
+        changed.last_update = self.last_update
+        if self.last_update is None:
+            return changed
+        for data_kind in SensorHistoryData.Data_Kind_Capacity:
+            for tag, value in self._getData(data_kind):
+                index = _tagIndex(tag)
+                period = None if index is None else self._periodStart(data_kind, index)
+                if period is None or snapshot.get((data_kind, period)) != value:
+                    changed._storeDataPoint(data_kind, tag, value)
+        return changed
+
+    def datapointCount(self):
+        """
+        Return the number of datapoints stored.
+        """
+        return sum(len(self._getData(data_kind)) for data_kind in SensorHistoryData.Data_Kind_Capacity)
+
+    def toNumpy(self, data_kind=Hour_Data):
+        """
+        Return the values of a kind of history data as a NumPy float64 array
+        indexed by the numeric part of the datapoint tag, holding NaN for
+        missing entries. The array shares the memory of the data store, so
+        it reflects datapoints stored later, unless irregular datapoints
+        have to be merged in, in which case a copy is returned.
+
+        Requires NumPy, see txcurrentcost.arrays.
+        """
+        from txcurrentcost import arrays
+        irregular = []
+        for tag, value in (self._irregular.get(data_kind) or {}).items():
+            index = _tagIndex(tag)
+            if index is None:
+                continue
+            try:
+                irregular.append((index, float(value)))
+            except (TypeError, ValueError):
+                continue
+        return arrays.historyValuesArray(self._values[data_kind], irregular)
+
+    def periodsToNumpy(self, data_kind=Hour_Data):
+        """
+        Return the time index of a kind of history data, see between, as a
+        NumPy structured array with period_start and value fields in
+        ascending time order.
+
+        Requires NumPy, see txcurrentcost.arrays.
+        """
+        from txcurrentcost import arrays
+        if self.last_update is None:
+            return arrays.historyPeriodsArray([], [])
+        index = self._index.get(data_kind)
+        if index is None:
+            index = self._buildIndex(data_kind)
+            self._index[data_kind] = index
+        return arrays.historyPeriodsArray(*index)
+
+    def toJson(self):
+        """
+        Return a JSON format encoding of this sensor's historical data.
+        """
+        if self._json is not None:
+            return self._json
+
+        d = {}
+        d['type'] = self.type
+        d['instance'] = self.instance
+        d['timestamp'] = str(self.last_update)
+        d['units'] = self.units
+        d['data'] = {'hour': self.getHourData(),
+                     'day': self.getDayData(),
+                     'month': self.getMonthData(),
+                     'year': self.getYearData()}
+        self._json = json.dumps(d)
+        return self._json
+
+    def __str__(self):
+        """
+        Return a string representation of this object
+        """
+        o = []
+
+        if self.dataPresent:
+            o.append("Sensor: %s [%s]" % (self.instance, Sensors.nameForType(self.type)))
+            o.append("Last update: %s" % (self.last_update))
+            if self._hasData(SensorHistoryData.Hour_Data):
+                o.append("Hour Data:")
+                for hourKey, hourValue in self.getHourData():
+                    o.append("\t%s %s %s" % (hourKey, hourValue, self.units))
+            else:
+                o.append("No hour data history available")
+
+            if self._hasData(SensorHistoryData.Day_Data):
+                o.append("Day Data:")
+                for dayKey, dayValue in self.getDayData():
+                    o.append("\t%s %s %s" % (dayKey, dayValue, self.units))
+            else:
+                o.append("No day data history available")
+
+            if self._hasData(SensorHistoryData.Month_Data):
+                o.append("Month Data:")
+                for monthKey, monthValue in self.getMonthData():
+                    o.append("\t%s %s %s" % (monthKey, monthValue, self.units))
+            else:
+                o.append("No month data history available")
+
+            if self._hasData(SensorHistoryData.Year_Data):
+                o.append("Year Data:")
+                for yearKey, yearValue in self.getYearData():
+                    o.append("\t%s %s %s" % (yearKey, yearValue, self.units))
+            else:
+                o.append("No year data history available")
+
+        else:
+            o.append("Sensor: %s - No history data" % self.instance)
+
+        return "\n".join(o)
+
+
+class CurrentCostMessageReceiver(object):
+    """
+    The CurrentCost device sends messages using a new line as a delimiter
+    between messages. Messages are framed by their <msg> and </msg> tags,
+    using a txcurrentcost.framing.MessageFramer, rather than by the new
+    line so that the receiver resynchronises after serial noise, partial
+    messages and missing new lines.
+
+    When parseHistory is False history update messages are not parsed but
+    passed to the handler as raw lines using the RawHistoryUpdateMsg kind so
+    that they can be parsed away from the reactor thread.
+
+    When metrics, a txcurrentcost.metrics.MonitorMetrics, is supplied the
+    bytes received, messages framed, bytes discarded and parse errors are
+    counted.
+
+    When clampCount is supplied periodic update messages are decoded
+    straight into a txcurrentcost.decoder.PeriodicReading, holding the
+    power on up to clampCount channels of the whole house sensor, which is
+    passed to the handler using the PeriodicUpdateMsg kind. Messages the
+    fast path decoder rejects are still passed as ElementTree elements.
+
+    The receiver does not depend on an event loop. The
+    txcurrentcost.serialport.CurrentCostDataProtocol adapts it to Twisted
+    and txcurrentcost.aio.CurrentCostAsyncioProtocol to asyncio.
+    """
+
+    # The maximum length of a message, see MessageFramer.
+    MAX_LENGTH = MessageFramer.MaxFrameLength
+
+    def __init__(self, msgHandler, parseHistory=True, metrics=None, clampCount=None):
+        self.msgHandler = msgHandler
+        self.parseHistory = parseHistory
+        self.metrics = metrics
+        self.clampCount = clampCount
+        self.framer = MessageFramer(self.frameReceived, self.MAX_LENGTH)
+
+    def dataReceived(self, data):
+        if self.metrics is None:
+            self.framer.feed(data)
+            return
+
+        self.metrics.bytesReceived.inc(len(data))
+        discarded = self.framer.discarded
+        self.framer.feed(data)
+        if self.framer.discarded != discarded:
+            self.metrics.bytesDiscarded.inc(self.framer.discarded - discarded)
+
+    def frameReceived(self, frame):
+        """
+        Handle a CurrentCost message frame from the serial port. The frame
+        is a view of the framer's buffer that is only valid during this call.
+        Periodic update messages are decoded in place using the fast path
+        decoder. Any other message is copied and parsed as a line.
+        """
+        if self.metrics is not None:
+            self.metrics.linesFramed.inc()
+
+        if self.clampCount is None:
+            msg = decodePeriodicFrame(frame)
+        else:
+            msg = decodePeriodicReadingFrame(frame, self.clampCount)
+        if msg is not None:
+            self.msgHandler(PeriodicUpdateMsg, msg)
+            return
+
+        self._parseLine(messageText(frame))
+
+    def lineReceived(self, line):
+        """
+        Handle a CurrentCost message line.
+        Periodic update messages are decoded using the fast path
+        decoder. Any other line is parsed into an ElementTree element
+        and inspected for which of the two message variants has been
+        received then dispatched to the handler.
+        """
+        logging.debug("Received a CurrentCost message with %i bytes" % (len(line)))
+        if self.metrics is not None:
+            self.metrics.linesFramed.inc()
+
+        if self.clampCount is None:
+            msg = decodePeriodicUpdate(line)
+        else:
+            msg = decodePeriodicReading(line, self.clampCount)
+        if msg is not None:
+            self.msgHandler(PeriodicUpdateMsg, msg)
+            return
+
+        self._parseLine(messageText(line))
+
+    def _parseLine(self, line):
+        """
+        Parse a message line that is not a well formed periodic update
+        message and dispatch it to the handler.
+        """
+        if not self.parseHistory and "<hist>" in line:
+            self.msgHandler(RawHistoryUpdateMsg, line)
+            return
+
+        try:
+            msg = etree.fromstring(line)
+            history = msg.find("hist")
+            if history is not None:
+                kind = HistoryUpdateMsg
+            else:
+                kind = PeriodicUpdateMsg
+
+            self.msgHandler(kind, msg)
+
+        except etree.ParseError as ex:
+            if self.metrics is not None:
+                self.metrics.parseErrors.inc()
+            logging.error("Error parsing msg xml: %s\n%s\n" % (ex, line))
+            return
@@ -0,0 +1,150 @@
+'''
+This module implements deadband filtering of periodic readings, so that
+only readings that have changed are passed on.
+
+Most consecutive readings from an idle appliance are identical or differ by
+a few watts. A DeadbandFilter forwards a reading only when the value on
+any of its channels has moved by more than the threshold of the channel
+since the last forwarded reading, or when the heartbeat interval has
+passed since the last forwarded reading, so consumers still see that the
+sensor is alive. A threshold of zero forwards every change.
+
+Thresholds and heartbeats default to the values given when the filter is
+created and can be set for each sensor and channel. Channels are numbered
+from 1, as in the periodic update message. OptiSmart sensors report the
+impulse count on channel 1 and the impulses per unit on channel 2.
+
+To forward readings that changed by more than 5 watts, or at least every
+five minutes:
+
+    monitor.deadband = DeadbandFilter(threshold=5, heartbeat=300)
+'''
+
+
+class _SensorState(object):
+    """
+    The last forwarded reading of a sensor and the counts of the readings
+    forwarded and suppressed.
+    """
+
+    __slots__ = ('values', 'forwardedAt', 'thresholds', 'heartbeat', 'forwarded', 'suppressed')
+
+    def __init__(self):
+        self.values = None
+        self.forwardedAt = None
+        # The thresholds and heartbeat of the sensor, resolved when first needed.
+        self.thresholds = None
+        self.heartbeat = None
+        self.forwarded = 0
+        self.suppressed = 0
+
+
+def _number(value):
+    """ Return a reported value as a float, or None if it was not reported """
+    if value is None or value == '':
+        return None
+    return float(value)
+
+
+class DeadbandFilter(object):
+    """
+    Decide which periodic readings of each sensor are passed on.
+    """
+
+    def __init__(self, threshold=0.0, heartbeat=300.0):
+        """
+        @param threshold: The change, on any channel, since the last forwarded
+                          reading above which a reading is forwarded
+        @type threshold: float
+        @param heartbeat: The seconds after which a reading is forwarded even
+                          if it has not changed, or None to only forward changes
+        @type heartbeat: float
+        """
+        self.threshold = threshold
+        self.heartbeat = heartbeat
+        # Thresholds keyed by (sensor type, sensor instance, channel) and
+        # heartbeats keyed by (sensor type, sensor instance)
+        self.thresholds = {}
+        self.heartbeats = {}
+        self.sensors = {}
+
+    def setThreshold(self, threshold, sensor_type, sensor_instance, channel=None):
+        """
+        Set the threshold of a sensor channel, or of every channel of the
+        sensor if no channel is given.
+        """
+        if channel is None:
+            for channel in range(1, 10):
+                self.thresholds[(sensor_type, sensor_instance, channel)] = threshold
+        else:
+            self.thresholds[(sensor_type, sensor_instance, channel)] = threshold
+        self._resolve(sensor_type, sensor_instance)
+
+    def setHeartbeat(self, heartbeat, sensor_type, sensor_instance):
+        """
+        Set the heartbeat interval, in seconds, of a sensor. None disables
+        the heartbeat of the sensor.
+        """
+        self.heartbeats[(sensor_type, sensor_instance)] = heartbeat
+        self._resolve(sensor_type, sensor_instance)
+
+    def _resolve(self, sensor_type, sensor_instance):
+        """ Look up the thresholds and heartbeat of a sensor when next needed """
+        state = self.sensors.get((sensor_type, sensor_instance))
+        if state is not None:
+            state.thresholds = None
+
+    def accept(self, timestamp, sensor_type, sensor_instance, values):
+        """
+        Return True if a reading should be forwarded.
+
+        @param timestamp: The receipt time of the reading in seconds
+        @type timestamp: float
+        @param values: The values reported on each channel of the sensor
+        @type values: sequence of numbers, numeric strings or None
+        """
+        key = (sensor_type, sensor_instance)
+        state = self.sensors.get(key)
+        if state is None:
+            state = _SensorState()
+            self.sensors[key] = state
+        if state.thresholds is None:
+            state.thresholds = [self.thresholds.get((sensor_type, sensor_instance, channel), self.threshold)
+                                for channel in range(1, 10)]
+            state.heartbeat = self.heartbeats.get(key, self.heartbeat)
+
+        values = [_number(value) for value in values]
+        last = state.values
+        forward = (last is None or len(values) != len(last) or
+                   (state.heartbeat is not None and timestamp - state.forwardedAt >= state.heartbeat))
+        if not forward:
+            for value, previous, threshold in zip(values, last, state.thresholds):
+                if value is None or previous is None:
+                    if value is not previous:
+                        forward = True
+                        break
+                elif abs(value - previous) > threshold:
+                    forward = True
+                    break
+
+        if forward:
+            state.values = values
+            state.forwardedAt = timestamp
+            state.forwarded += 1
+        else:
+            state.suppressed += 1
+        return forward
+
+    def suppressionRatio(self, sensor_type=None, sensor_instance=None):
+        """
+        Return the fraction of readings suppressed for a sensor, or for every
+        sensor if no sensor is given. Zero is returned before any reading.
+        """
+        if sensor_type is None:
+            states = list(self.sensors.values())
+        else:
+            state = self.sensors.get((sensor_type, sensor_instance))
+            states = [state] if state is not None else []
+        suppressed = sum(state.suppressed for state in states)
+        total = suppressed + sum(state.forwarded for state in states)
+        return float(suppressed) / total if total else 0.0
@@ -0,0 +1,406 @@
+'''
+This module implements decoders for Current Cost messages that do not
+depend on the reactor.
+
+The fast path decoder handles Current Cost periodic update messages.
+
+Periodic update messages make up almost all of the traffic emitted by a
+Current Cost device and have a fixed, flat layout. For example:
+
+<msg><src>CC128-v0.11</src><dsb>00089</dsb><time>13:02:39</time><tmpr>18.7</tmpr>
+<sensor>1</sensor><id>01234</id><type>1</type><ch1><watts>00345</watts></ch1>
+<ch2><watts>02151</watts></ch2><ch3><watts>00000</watts></ch3></msg>
+
+Rather than building a full ElementTree for every message the decoder makes a
+single pass over the raw line and collects the element text directly. Any line
+that does not fit the periodic layout (history messages, malformed or
+truncated lines, lines containing entities, etc) is rejected so that the
+caller can fall back to the general ElementTree based parser. Messages framed
+by a txcurrentcost.framing.MessageFramer are decoded in place, without being
+copied, using decodePeriodicFrame.
+
+A PeriodicReading holds the numeric values of a periodic update message,
+converted once on receipt, for consumers that prefer typed values to the
+message text. decodePeriodicReading and decodePeriodicReadingFrame build it
+in the same single pass over the message, straight from the element text.
+
+The history decoder extracts the datapoints held in a history update message.
+It is a plain function of the message so that it can be run in a worker
+thread or process as well as in the reactor thread.
+'''
+
+import collections
+import datetime
+import re
+import time
+try:
+    from xml.etree import cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+
+
+# Matches the opening of a message, allowing for leading whitespace.
+_MSG_START = re.compile(r'\s*<msg>')
+
+# The opening and closing tags of a message.
+_MSG_TAG = '<msg>'
+_MSG_END = '</msg>'
+
+# Matches a single element within a periodic update message. An element
+# either holds text directly (e.g. <tmpr>18.7</tmpr>) or is a channel
+# element wrapping a watts element (e.g. <ch1><watts>00345</watts></ch1>).
+_ELEMENT = re.compile(r'\s*<(\w+)>(?:([^<>&]*)|\s*<watts>([^<>&]*)</watts>\s*)</\1>')
+
+# The sensor types and sensor instance, see txcurrentcost.Sensors, that
+# decide which values of a periodic update message are held in a reading.
+_ElectricitySensor = 1
+_OptiSmartSensor = 2
+_WholeHouseSensorId = 0
+
+# The positions the text of the elements of a periodic update message held
+# in a PeriodicReading are collected at, keyed by tag. The watts of channel
+# n are collected at position _FirstChannel + n - 1.
+_ReadingFields = ('src', 'dsb', 'tmpr', 'sensor', 'type', 'imp', 'ipu')
+_FirstChannel = len(_ReadingFields)
+_ReadingTags = dict([(tag, index) for index, tag in enumerate(_ReadingFields)] +
+                    [('ch%i' % channel, _FirstChannel + channel - 1) for channel in range(1, 10)])
+
+
+class PeriodicUpdate(object):
+    """
+    A decoded periodic update message.
+
+    Provides the subset of the ElementTree element interface used when
+    extracting information from a periodic update message so that it can
+    be used in place of an element. Channel data is stored using the same
+    path used to find it in an element, e.g. 'ch1/watts'.
+    """
+
+    __slots__ = ('fields',)
+
+    def __init__(self, fields):
+        """
+        @param fields: A dict mapping element paths to element text
+        @type fields: dict
+        """
+        self.fields = fields
+
+    def findtext(self, path, default=None):
+        """
+        Return the text for the element at path or default if the
+        element was not present in the message.
+        """
+        return self.fields.get(path, default)
+
+
+if bytes is str:
+    # Python 2 patterns match message bytes, and buffers of them, directly.
+    _BytesPatterns = (_MSG_START, _MSG_END, _ELEMENT, '/watts', PeriodicUpdate, _ReadingTags)
+
+    # Return a message held in bytes, or a buffer of them, as a native string.
+    messageText = str
+else:
+    class _BytesPeriodicUpdate(PeriodicUpdate):
+        """
+        A periodic update message decoded from bytes. The element paths and
+        text are held as bytes and the text of an element is decoded when
+        it is found.
+        """
+
+        __slots__ = ()
+
+        # The element paths, encoded as bytes, keyed by path.
+        _paths = {}
+
+        def findtext(self, path, default=None):
+            key = self._paths.get(path)
+            if key is None:
+                key = self._paths[path] = path.encode('ascii')
+            text = self.fields.get(key)
+            if text is None:
+                return default
+            return str(text, 'latin-1')
+
+    # Python 3 messages held in bytes, or a buffer of them, are matched using
+    # bytes patterns so that the message is not decoded.
+    _BytesPatterns = (re.compile(_MSG_START.pattern.encode('ascii')),
+                      _MSG_END.encode('ascii'),
+                      re.compile(_ELEMENT.pattern.encode('ascii')),
+                      b'/watts',
+                      _BytesPeriodicUpdate,
+                      dict((tag.encode('ascii'), code) for tag, code in _ReadingTags.items()))
+
+    def messageText(data):
+        """ Return message bytes, or a buffer of them, as text """
+        if isinstance(data, str):
+            return data
+        return str(data, 'latin-1')
+
+
+# The patterns used to decode a message held in a native string.
+_TextPatterns = (_MSG_START, _MSG_END, _ELEMENT, '/watts', PeriodicUpdate, _ReadingTags)
+
+
+def _patterns(data):
+    """
+    Return the message start pattern, message end tag, element pattern,
+    channel path suffix, PeriodicUpdate class and reading element tags used
+    for a message held in data.
+    """
+    if isinstance(data, str):
+        return _TextPatterns
+    return _BytesPatterns
+
+
+def decodePeriodicUpdate(line):
+    """
+    Decode a periodic update message line in a single pass.
+
+    @param line: A raw Current Cost message line
+    @type line: string or bytes
+
+    @return: A PeriodicUpdate if the line is a well formed periodic update
+             message, otherwise None.
+    """
+    patterns = _patterns(line)
+    bounds = _messageBounds(line, patterns)
+    if bounds is None:
+        return None
+    return _decodeElements(line, bounds[0], bounds[1], patterns)
+
+
+def _messageBounds(line, patterns):
+    """
+    Return the positions of the start and end of the elements of the
+    message held in line, or None if line does not hold a single message.
+    """
+    start = patterns[0].match(line)
+    if start is None:
+        return None
+
+    msg_end = patterns[1]
+    end = line.rfind(msg_end)
+    if end < 0 or line[end + len(msg_end):].strip():
+        return None
+
+    return start.end(), end
+
+
+def decodePeriodicFrame(frame):
+    """
+    Decode a periodic update message frame without copying it.
+
+    @param frame: A buffer holding exactly one message, from its <msg> tag
+                  to its </msg> tag, such as a frame from a
+                  txcurrentcost.framing.MessageFramer.
+
+    @return: A PeriodicUpdate if the frame is a well formed periodic update
+             message, otherwise None.
+    """
+    return _decodeElements(frame, len(_MSG_TAG), len(frame) - len(_MSG_END), _patterns(frame))
+
+
+def _decodeElements(line, pos, end, patterns):
+    """
+    Decode the elements of a periodic update message held in line between
+    pos and end using the patterns returned by _patterns.
+    """
+    element, suffix, update = patterns[2:5]
+    fields = {}
+    match = element.match
+    while pos < end:
+        found = match(line, pos, end)
+        if found is None:
+            if not messageText(line[pos:end]).strip():
+                break
+            # Anything not fitting the periodic layout, including the nested
+            # elements of a history message, is left to the general parser.
+            return None
+        tag, text, watts = found.groups()
+        if watts is None:
+            fields.setdefault(tag, text)
+        else:
+            fields.setdefault(tag + suffix, watts)
+        pos = found.end()
+
+    return update(fields)
+
+
+# A clock that never goes backwards, where the platform provides one.
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class PeriodicReading(object):
+    """
+    The numeric values of a periodic update message.
+
+    The timestamp is the wall clock receipt time in seconds since the epoch
+    and monotonic is the receipt time from a clock that is not affected by
+    changes to the wall clock, for measuring intervals between readings.
+    The temperature is None if it was not reported. Electricity sensors
+    report watts, a tuple holding the power on each channel, while the
+    impulse count and impulses per unit are reported by OptiSmart sensors.
+    """
+
+    __slots__ = ('timestamp', 'monotonic', 'temperature', 'sensor_type', 'sensor_instance',
+                 'watts', 'impulses', 'impulses_per_unit', 'source', 'days_since_birth')
+
+    def __init__(self, timestamp, monotonic, temperature, sensor_type, sensor_instance,
+                 watts=(), impulses=None, impulses_per_unit=None, source=None, days_since_birth=None):
+        self.timestamp = timestamp
+        self.monotonic = monotonic
+        self.temperature = temperature
+        self.sensor_type = sensor_type
+        self.sensor_instance = sensor_instance
+        self.watts = watts
+        self.impulses = impulses
+        self.impulses_per_unit = impulses_per_unit
+        self.source = source
+        self.days_since_birth = days_since_birth
+
+    def receivedAt(self, utc=False):
+        """
+        Return the receipt time as a datetime.datetime in UTC or local time.
+        """
+        if utc:
+            return datetime.datetime.utcfromtimestamp(self.timestamp)
+        return datetime.datetime.fromtimestamp(self.timestamp)
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__,
+                           ", ".join("%s=%r" % (name, getattr(self, name)) for name in self.__slots__))
+
+
+def decodePeriodicReading(line, clamp_count):
+    """
+    Decode a periodic update message line into a PeriodicReading in a
+    single pass, without building the fields of a PeriodicUpdate.
+
+    The whole house sensor reports the power on up to clamp_count channels
+    and every other electricity sensor on one channel, as in
+    txcurrentcost.monitor.Monitor.
+
+    @param line: A raw Current Cost message line
+    @type line: string or bytes
+    @param clamp_count: The number of clamps on the whole house sensor
+    @type clamp_count: int
+
+    @return: A PeriodicReading if the line is a well formed periodic update
+             message, otherwise None.
+    """
+    patterns = _patterns(line)
+    bounds = _messageBounds(line, patterns)
+    if bounds is None:
+        return None
+    return _decodeReading(line, bounds[0], bounds[1], patterns, clamp_count)
+
+
+def decodePeriodicReadingFrame(frame, clamp_count):
+    """
+    Decode a periodic update message frame into a PeriodicReading without
+    copying it, see decodePeriodicFrame and decodePeriodicReading.
+    """
+    return _decodeReading(frame, len(_MSG_TAG), len(frame) - len(_MSG_END), _patterns(frame), clamp_count)
+
+
+def _decodeReading(line, pos, end, patterns, clamp_count):
+    """
+    Decode the elements of a periodic update message held in line between
+    pos and end into a PeriodicReading. None is returned if the message
+    does not fit the periodic layout or a value is not a number, so that
+    the caller can fall back to the general parser.
+    """
+    element, tags = patterns[2], patterns[5]
+    match = element.match
+    values = [None] * (_FirstChannel + 9)
+    while pos < end:
+        found = match(line, pos, end)
+        if found is None:
+            if not messageText(line[pos:end]).strip():
+                break
+            return None
+        tag, text, watts = found.groups()
+        pos = found.end()
+        index = tags.get(tag)
+        if index is None:
+            continue
+        value = text if index < _FirstChannel else watts
+        # The first of any repeated element is used, as in a PeriodicUpdate.
+        if value is not None and values[index] is None:
+            values[index] = value
+
+    source, dsb, tmpr, sensor, kind, imp, ipu = values[:_FirstChannel]
+    if sensor is None or kind is None:
+        return None
+    try:
+        sensor_instance = int(sensor)
+        sensor_type = int(kind)
+        temperature = float(tmpr) if tmpr else None
+        if sensor_type == _ElectricitySensor:
+            channels = clamp_count if sensor_instance == _WholeHouseSensorId else 1
+            reading = PeriodicReading(time.time(), monotonic(), temperature, sensor_type, sensor_instance,
+                                      watts=tuple(int(watts) for watts in values[_FirstChannel:_FirstChannel + channels]
+                                                  if watts is not None))
+        elif sensor_type == _OptiSmartSensor:
+            reading = PeriodicReading(time.time(), monotonic(), temperature, sensor_type, sensor_instance,
+                                      impulses=int(imp) if imp else None,
+                                      impulses_per_unit=int(ipu) if ipu else None)
+        else:
+            reading = PeriodicReading(time.time(), monotonic(), temperature, sensor_type, sensor_instance)
+    except ValueError:
+        return None
+    if source is not None:
+        reading.source = messageText(source)
+    if dsb is not None:
+        reading.days_since_birth = messageText(dsb)
+    return reading
+
+
+# The information extracted from a history update message. The sensors field
+# holds a list of (sensor_instance, datapoints) 2-tuples where datapoints is
+# a list of (tag, value) 2-tuples in message order.
+HistoryUpdate = collections.namedtuple('HistoryUpdate',
+                                       ['source', 'days_since_birth', 'days_since_wiped',
+                                        'sensor_type', 'sensor_units', 'sensors'])
+
+
+def decodeHistoryUpdate(msg):
+    """
+    Extract the history data from a history update message element.
+
+    @param msg: A history update message
+    @type msg: ElementTree element
+
+    @return: A HistoryUpdate
+    """
+    history = msg.find("hist")
+    sensors = []
+    for data_element in history.findall("data"):
+        sensor_instance = int(data_element.findtext("sensor"))
+        datapoints = []
+        for historical_element in data_element:
+            tag = historical_element.tag
+            if tag == "sensor":
+                # ignore the sensor element that has already been inspected.
+                continue
+            datapoints.append((tag, historical_element.text))
+        sensors.append((sensor_instance, datapoints))
+
+    return HistoryUpdate(msg.findtext("src"),
+                         msg.findtext("dsb"),
+                         history.findtext("dsw"),
+                         int(history.findtext("type")),
+                         history.findtext("units"),
+                         sensors)
+
+
+def decodeHistoryLine(line):
+    """
+    Parse a raw history update message line and extract its history data.
+
+    @param line: A raw Current Cost history update message line
+    @type line: string
+
+    @return: A HistoryUpdate
+    """
+    return decodeHistoryUpdate(etree.fromstring(line))
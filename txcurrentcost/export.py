@@ -0,0 +1,282 @@
+'''
+This module implements an asynchronous exporter that delivers readings to a
+remote service without blocking the monitor.
+
+Items added to an Exporter are held in a bounded queue and sent in batches,
+once max_batch items are waiting or max_delay seconds after the first item
+was queued, whichever is first. Only one batch is in flight at a time. A
+batch that fails to send, or is not accepted within timeout seconds, is
+retried after a backoff that doubles with each failed attempt up to
+max_backoff, and items stay queued until their batch has been sent.
+
+When the queue is full new items are either dropped or, if a spill path is
+supplied, appended to a spill file as JSON lines. Spilled items are queued
+again, in order, once the queue has drained.
+
+Batches are sent by a sender, any callable accepting a list of items and
+returning a Deferred that fires once the batch has been accepted. The
+HTTPSender posts each batch as a JSON array over persistent pooled HTTP
+connections.
+
+To export the periodic updates of a monitor:
+
+    exporter = Exporter(HTTPSender("http://localhost:8080/readings"))
+    monitor.exporter = exporter
+'''
+
+import collections
+import io
+import json
+import logging
+import os
+from twisted.internet import defer
+from twisted.web.client import Agent, FileBodyProducer, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+
+
+class ExportError(Exception):
+    """ Raised when a remote service does not accept a batch """
+
+
+class Exporter(object):
+    """
+    Queue items and send them in batches using a sender.
+    """
+
+    def __init__(self, sender, clock=None, max_queue=10000, max_batch=100, max_delay=1.0,
+                 initial_backoff=1.0, max_backoff=60.0, spill_path=None, metrics=None,
+                 timeout=30.0):
+        """
+        @param sender: Called with a list of items, returns a Deferred
+        @param clock: The reactor used to schedule sends. Defaults to the global reactor.
+        @param max_queue: The maximum number of items held in the queue
+        @type max_queue: int
+        @param max_batch: The maximum number of items sent in one batch
+        @type max_batch: int
+        @param max_delay: The maximum seconds an item waits before its batch is sent
+        @type max_delay: float
+        @param initial_backoff: The seconds before the first retry of a failed batch
+        @type initial_backoff: float
+        @param max_backoff: The maximum seconds between retries
+        @type max_backoff: float
+        @param spill_path: The file that items are spilled to when the queue
+                           is full. Items are dropped if None.
+        @type spill_path: string
+        @param metrics: The metrics recorded for the exporter
+        @type metrics: txcurrentcost.metrics.ExporterMetrics
+        @param timeout: The seconds allowed for a batch to be sent, after
+                        which the send is cancelled and the batch retried
+        @type timeout: float
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.sender = sender
+        self.clock = clock
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.spill_path = spill_path
+        self.metrics = metrics
+        self.timeout = timeout
+
+        # Queued items, each a 2-tuple of the clock time it was queued and the item
+        self._queue = collections.deque()
+        self._spilled = 0
+        self._inFlight = None
+        self._sendCall = None
+        self._retryCall = None
+        self._attempts = 0
+
+        if spill_path is not None and os.path.exists(spill_path):
+            # Recover items spilled by a previous run.
+            with open(spill_path, 'rb') as spill:
+                self._spilled = sum(1 for line in spill if line.strip())
+            if self._spilled:
+                self._unspill()
+                self._schedule()
+
+    def __len__(self):
+        """ Return the number of items waiting to be exported """
+        return len(self._queue) + self._spilled
+
+    @property
+    def full(self):
+        """ True when new items will be dropped or spilled """
+        return len(self._queue) >= self.max_queue
+
+    def add(self, item):
+        """
+        Queue an item for export. The item must be JSON serializable if it
+        may be spilled.
+
+        @return: False if the item was dropped, otherwise True
+        """
+        if self._spilled or self.full:
+            if self.spill_path is None:
+                if self.metrics is not None:
+                    self.metrics.dropped.inc()
+                return False
+            self._spill(item)
+            return True
+
+        self._queue.append((self.clock.seconds(), item))
+        self._updateDepth()
+        self._schedule()
+        return True
+
+    def flush(self):
+        """ Send the queued items now rather than waiting for max_delay """
+        self._send()
+
+    def stop(self):
+        """
+        Cancel any pending send or retry. Items still queued are not sent.
+        """
+        for call in (self._sendCall, self._retryCall):
+            if call is not None and call.active():
+                call.cancel()
+        self._sendCall = None
+        self._retryCall = None
+
+    def _updateDepth(self):
+        if self.metrics is not None:
+            self.metrics.queueDepth.set(len(self))
+
+    def _spill(self, item):
+        """ Append an item to the spill file """
+        with open(self.spill_path, 'ab') as spill:
+            spill.write((json.dumps(item, default=str) + "\n").encode('utf-8'))
+        self._spilled += 1
+        if self.metrics is not None:
+            self.metrics.spilled.inc()
+        self._updateDepth()
+
+    def _unspill(self):
+        """ Queue as many spilled items as fit, in the order they were spilled """
+        with open(self.spill_path, 'rb') as spill:
+            lines = [line for line in spill if line.strip()]
+        room = self.max_queue - len(self._queue)
+        now = self.clock.seconds()
+        for line in lines[:room]:
+            self._queue.append((now, json.loads(line.decode('utf-8'))))
+        remaining = lines[room:]
+        if remaining:
+            with open(self.spill_path, 'wb') as spill:
+                spill.writelines(remaining)
+        else:
+            os.remove(self.spill_path)
+        self._spilled = len(remaining)
+
+    def _schedule(self):
+        """ Send a batch now if one is full, otherwise once max_delay expires """
+        if self._inFlight is not None or self._retryCall is not None or not self._queue:
+            return
+        if len(self._queue) >= self.max_batch:
+            self._send()
+        elif self._sendCall is None:
+            self._sendCall = self.clock.callLater(self.max_delay, self._sendLater)
+
+    def _sendLater(self):
+        self._sendCall = None
+        self._send()
+
+    def _retry(self):
+        self._retryCall = None
+        self._send()
+
+    def _send(self):
+        """ Send a batch of the oldest queued items """
+        if self._sendCall is not None:
+            if self._sendCall.active():
+                self._sendCall.cancel()
+            self._sendCall = None
+
+        if self._inFlight is not None or self._retryCall is not None or not self._queue:
+            return
+
+        count = min(self.max_batch, len(self._queue))
+        batch = [self._queue[n][1] for n in range(count)]
+        started = self.clock.seconds()
+        self._inFlight = defer.maybeDeferred(self.sender, batch)
+        # A service that accepts the connection but never answers must not
+        # hold up every later batch.
+        self._inFlight.addTimeout(self.timeout, self.clock)
+        self._inFlight.addCallbacks(self._sent, self._sendFailed,
+                                    callbackArgs=(count, started), errbackArgs=(count,))
+
+    def _sent(self, _, count, started):
+        self._inFlight = None
+        self._attempts = 0
+        now = self.clock.seconds()
+        queued = self._queue[0][0]
+        for _ in range(count):
+            self._queue.popleft()
+        if self.metrics is not None:
+            self.metrics.exported.inc(count)
+            self.metrics.exportLatency.observe(now - queued)
+            self.metrics.requestDuration.observe(now - started)
+        if self._spilled and len(self._queue) < self.max_queue // 2:
+            self._unspill()
+        self._updateDepth()
+        self._schedule()
+
+    def _sendFailed(self, failure, count):
+        self._inFlight = None
+        self._attempts += 1
+        delay = min(self.initial_backoff * 2 ** (self._attempts - 1), self.max_backoff)
+        if self.metrics is not None:
+            self.metrics.retries.inc()
+        logging.error("Problem exporting a batch of %i items, retrying in %.1f seconds: %s" % (
+            count, delay, failure.getErrorMessage()))
+        self._retryCall = self.clock.callLater(delay, self._retry)
+
+
+class HTTPSender(object):
+    """
+    Send batches to a HTTP service as a JSON array in the body of a POST
+    request. Connections are kept open and reused between batches.
+    """
+
+    def __init__(self, url, reactor=None, headers=None, max_connections=2, timeout=30):
+        """
+        @param url: The URL batches are posted to
+        @type url: string
+        @param headers: Additional request headers, such as an API key
+        @type headers: dict of strings
+        @param max_connections: The maximum persistent connections kept to the service
+        @type max_connections: int
+        @param timeout: The seconds allowed to connect to the service
+        @type timeout: float
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self.url = url if isinstance(url, bytes) else url.encode('ascii')
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = max_connections
+        self.agent = Agent(reactor, connectTimeout=timeout, pool=self.pool)
+        self.headers = Headers({b'Content-Type': [b'application/json']})
+        for name, value in (headers or {}).items():
+            self.headers.setRawHeaders(name, [value])
+
+    def __call__(self, batch):
+        body = FileBodyProducer(io.BytesIO(json.dumps(batch, default=str).encode('utf-8')))
+        d = self.agent.request(b'POST', self.url, self.headers, body)
+        d.addCallback(self._checkResponse)
+        return d
+
+    def _checkResponse(self, response):
+        # The body is always read so the connection can be returned to the pool.
+        d = readBody(response)
+
+        def checkCode(body):
+            if not 200 <= response.code < 300:
+                raise ExportError("%s responded %i %s" % (self.url, response.code, response.phrase))
+            return body
+        d.addCallback(checkCode)
+        return d
+
+    def close(self):
+        """ Close the pooled connections, returns a Deferred """
+        return self.pool.closeCachedConnections()
@@ -0,0 +1,125 @@
+'''
+This module implements a TCP server that streams live readings to any
+number of subscribers as newline delimited JSON.
+
+Each published item is serialized once and the same string is written to
+the transport of every subscriber, so the cost of a reading grows only by
+a buffer append per subscriber.
+
+A subscriber that can not keep up is dropped rather than allowed to hold
+an ever growing amount of data in memory. The transport of each subscriber
+pauses its producer once its own send buffer is full and a subscriber is
+disconnected once more than max_buffer bytes have been written to it while
+it is paused.
+
+To stream the periodic updates of a monitor on port 8765:
+
+    fanout = FanoutFactory()
+    reactor.listenTCP(8765, fanout)
+    monitor.fanout = fanout
+
+A subscriber can watch the stream using, for example, nc localhost 8765.
+'''
+
+import json
+import logging
+from twisted.internet import interfaces, protocol
+from zope.interface import implementer
+
+
+@implementer(interfaces.IPushProducer)
+class FanoutProtocol(protocol.Protocol):
+    """
+    A subscriber to a FanoutFactory. Anything sent by the subscriber is
+    ignored.
+    """
+
+    paused = False
+
+    # The number of bytes written since the transport paused.
+    pending = 0
+
+    def connectionMade(self):
+        self.transport.registerProducer(self, True)
+        self.factory.subscriberConnected(self)
+
+    def connectionLost(self, reason):
+        self.factory.subscriberDisconnected(self)
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.pending = 0
+
+    def stopProducing(self):
+        pass
+
+    def send(self, data):
+        """
+        Write data to the subscriber.
+
+        @return: False if the subscriber is too slow and has been dropped,
+                 otherwise True.
+        """
+        if self.paused:
+            self.pending += len(data)
+            if self.pending > self.factory.max_buffer:
+                self.transport.abortConnection()
+                return False
+        self.transport.write(data)
+        return True
+
+
+class FanoutFactory(protocol.ServerFactory):
+    """
+    Stream published items to every connected subscriber.
+    """
+
+    protocol = FanoutProtocol
+
+    def __init__(self, max_buffer=256 * 1024, metrics=None):
+        """
+        @param max_buffer: The maximum bytes written to a subscriber while its
+                           send buffer is full before it is dropped
+        @type max_buffer: int
+        @param metrics: The metrics recorded for the server
+        @type metrics: txcurrentcost.metrics.FanoutMetrics
+        """
+        self.max_buffer = max_buffer
+        self.metrics = metrics
+        self.subscribers = set()
+
+    def subscriberConnected(self, subscriber):
+        self.subscribers.add(subscriber)
+        if self.metrics is not None:
+            self.metrics.subscribers.set(len(self.subscribers))
+
+    def subscriberDisconnected(self, subscriber):
+        self.subscribers.discard(subscriber)
+        if self.metrics is not None:
+            self.metrics.subscribers.set(len(self.subscribers))
+
+    def publish(self, item):
+        """
+        Send an item, which must be JSON serializable, to every subscriber.
+        Values that JSON does not support, such as datetimes, are sent as
+        strings.
+        """
+        if not self.subscribers:
+            return
+        data = (json.dumps(item, default=str) + "\n").encode('utf-8')
+        slow = [subscriber for subscriber in self.subscribers if not subscriber.send(data)]
+        for subscriber in slow:
+            logging.warning("Dropping slow subscriber %s" % (subscriber.transport.getPeer(),))
+            self.subscriberDisconnected(subscriber)
+        if self.metrics is not None:
+            self.metrics.published.inc()
+            if slow:
+                self.metrics.dropped.inc(len(slow))
+
+    def close(self):
+        """ Disconnect every subscriber """
+        for subscriber in list(self.subscribers):
+            subscriber.transport.loseConnection()
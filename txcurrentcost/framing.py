@@ -0,0 +1,129 @@
+'''
+This module implements the framing of the raw byte stream received from a
+Current Cost device into messages.
+
+Each message is framed by its <msg> and </msg> tags rather than by the new
+line that normally follows it, so serial noise, a partial message received
+after connecting, a missing new line or two messages run together do not
+cause good messages to be lost or merged. Bytes outside a message are
+discarded. A message that is interrupted by the start of another message,
+or that grows beyond the maximum frame length without being closed, is
+discarded and framing resumes at the next <msg> tag.
+
+Received data is accumulated in a single reusable bytearray and each
+complete message is passed on as a read only view of the buffer, a buffer
+object on Python 2 and a memoryview on Python 3, without being copied. A
+frame is only valid for the duration of the call it is passed to and must
+be copied, e.g. using bytes(frame), if it is to be kept.
+'''
+
+_MSG_START = b'<msg>'
+_MSG_END = b'</msg>'
+
+try:
+    # The Python 2 regular expression engine accepts buffer objects but
+    # not memoryviews.
+    _frameView = buffer
+
+    def _releaseFrame(frame):
+        pass
+
+except NameError:
+    def _frameView(data, start, length):
+        return memoryview(data)[start:start + length]
+
+    def _releaseFrame(frame):
+        # The buffer can't be resized while a view of it is exported.
+        frame.release()
+
+
+class MessageFramer(object):
+    """
+    Frame Current Cost messages from a byte stream.
+    """
+
+    # The default maximum length of a message. History messages from a
+    # device with many sensors are the longest messages sent.
+    MaxFrameLength = 16384
+
+    def __init__(self, frameReceived, max_frame=MaxFrameLength):
+        """
+        @param frameReceived: Called with each complete message frame
+        @param max_frame: The maximum length, in bytes, of a message
+        @type max_frame: int
+        """
+        self.frameReceived = frameReceived
+        self.max_frame = max_frame
+        self.buffer = bytearray()
+        # The total number of bytes, excluding whitespace between messages,
+        # discarded while resynchronising on message boundaries.
+        self.discarded = 0
+
+    def clear(self):
+        """ Discard any partially received message """
+        del self.buffer[:]
+
+    def _discard(self, start, end):
+        self.discarded += len(bytes(self.buffer[start:end]).strip())
+
+    def feed(self, data):
+        """
+        Add received data and pass on any messages it completes.
+        """
+        buf = self.buffer
+        buf.extend(data)
+        pos = 0
+        try:
+            while True:
+                start = buf.find(_MSG_START, pos)
+                if start < 0:
+                    # Keep enough of the tail to hold a partial start tag.
+                    keep = max(pos, len(buf) - len(_MSG_START) + 1)
+                    self._discard(pos, keep)
+                    pos = keep
+                    break
+
+                if start > pos:
+                    self._discard(pos, start)
+
+                end = buf.find(_MSG_END, start + len(_MSG_START))
+                if end < 0:
+                    following = buf.find(_MSG_START, start + len(_MSG_START))
+                    if following >= 0:
+                        # The message was cut short by the start of another.
+                        self._discard(start, following)
+                        pos = following
+                        continue
+                    if len(buf) - start > self.max_frame:
+                        # Give up on a message that is never closed and resync
+                        # on the next start tag.
+                        self._discard(start, start + len(_MSG_START))
+                        pos = start + len(_MSG_START)
+                        continue
+                    pos = start
+                    break
+
+                following = buf.find(_MSG_START, start + len(_MSG_START), end)
+                if following >= 0:
+                    # The message was cut short by the start of another.
+                    self._discard(start, following)
+                    pos = following
+                    continue
+
+                end += len(_MSG_END)
+                pos = end
+                if end - start > self.max_frame:
+                    self._discard(start, end)
+                    continue
+
+                frame = _frameView(buf, start, end - start)
+                try:
+                    self.frameReceived(frame)
+                finally:
+                    _releaseFrame(frame)
+                    del frame
+
+        finally:
+            # Remove the framed and discarded data, even if a frame handler fails.
+            if pos:
+                del buf[:pos]
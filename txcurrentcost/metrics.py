@@ -0,0 +1,353 @@
+'''
+This module implements metrics describing the operation of the Current Cost
+message pipeline, such as the number of bytes and messages received, parse
+errors and the time spent in user callbacks.
+
+Metrics are disabled by default. To enable them create a MetricsRegistry and
+assign a MonitorMetrics to a monitor before it is started:
+
+    registry = MetricsRegistry()
+    monitor.metrics = MonitorMetrics(registry, device="house")
+
+The registry can be inspected using its snapshot method or served as text,
+in the Prometheus exposition format, for a local scraper to poll:
+
+    listenMetrics(registry, 9100)
+'''
+
+import bisect
+from twisted.web import resource, server
+
+
+# Histogram bucket upper bounds, in seconds, for callback durations.
+LatencyBuckets = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005,
+                  0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# Histogram bucket upper bounds, in seconds, for history cycle durations.
+CycleBuckets = (5.0, 10.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0, 300.0)
+
+# Histogram bucket upper bounds, in seconds, for export latencies.
+ExportBuckets = (0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Bucket upper bounds, in seconds, for the time taken to reopen a lost serial port.
+RecoveryBuckets = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0, 3600.0)
+
+
+class Counter(object):
+    """ A monotonically increasing count """
+
+    __slots__ = ('value',)
+
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge(object):
+    """ A value that can go up and down """
+
+    __slots__ = ('value',)
+
+    kind = 'gauge'
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram(object):
+    """ A distribution of observed values counted in fixed buckets """
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    kind = 'histogram'
+
+    def __init__(self, buckets=LatencyBuckets):
+        self.buckets = buckets
+        # one count per bucket plus one for values above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {'count': self.count,
+                'sum': self.sum,
+                'buckets': cumulative}
+
+
+class MetricsRegistry(object):
+    """
+    Hold the metrics for any number of devices and sensors. Each metric is
+    identified by a name and a set of labels.
+    """
+
+    prefix = 'currentcost_'
+
+    def __init__(self):
+        self.metrics = {}
+        self.descriptions = {}
+
+    def _get(self, cls, name, description, labels, *args):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            metric = cls(*args)
+            self.metrics[key] = metric
+            self.descriptions.setdefault(name, (cls.kind, description))
+        return metric
+
+    def counter(self, name, description, **labels):
+        """ Return the counter with the name and labels, creating it if required """
+        return self._get(Counter, name, description, labels)
+
+    def gauge(self, name, description, **labels):
+        """ Return the gauge with the name and labels, creating it if required """
+        return self._get(Gauge, name, description, labels)
+
+    def histogram(self, name, description, buckets=LatencyBuckets, **labels):
+        """ Return the histogram with the name and labels, creating it if required """
+        return self._get(Histogram, name, description, labels, buckets)
+
+    def snapshot(self):
+        """
+        Return the current value of every metric as a dict keyed by metric
+        name holding a list of (labels, value) 2-tuples.
+        """
+        result = {}
+        for (name, labels), metric in sorted(self.metrics.items()):
+            result.setdefault(name, []).append((dict(labels), metric.snapshot()))
+        return result
+
+    def render(self):
+        """
+        Return every metric as text in the Prometheus exposition format.
+        """
+        lines = []
+        for name, values in sorted(self.snapshot().items()):
+            kind, description = self.descriptions[name]
+            fullname = self.prefix + name
+            lines.append("# HELP %s %s" % (fullname, description))
+            lines.append("# TYPE %s %s" % (fullname, kind))
+            for labels, value in values:
+                if kind == Histogram.kind:
+                    for bound, count in value['buckets']:
+                        lines.append("%s_bucket%s %s" % (fullname, _formatLabels(labels, le=repr(bound)), count))
+                    lines.append("%s_bucket%s %s" % (fullname, _formatLabels(labels, le="+Inf"), value['count']))
+                    lines.append("%s_sum%s %r" % (fullname, _formatLabels(labels), value['sum']))
+                    lines.append("%s_count%s %s" % (fullname, _formatLabels(labels), value['count']))
+                else:
+                    lines.append("%s%s %s" % (fullname, _formatLabels(labels), value))
+        lines.append("")
+        return "\n".join(lines)
+
+
+def _formatLabels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                             for k, v in sorted(labels.items()))
+
+
+class SensorMetrics(object):
+    """ The metrics for a single sensor of a device """
+
+    __slots__ = ('periodicDispatched', 'periodicCallbackDuration', 'periodicSuppressed', 'suppressionRatio')
+
+    def __init__(self, registry, device, sensor_type, sensor_instance):
+        labels = dict(device=device, sensor_type=sensor_type, sensor=sensor_instance)
+        self.periodicDispatched = registry.counter('periodic_updates_total',
+                                                   'Periodic updates dispatched', **labels)
+        self.periodicCallbackDuration = registry.histogram('periodic_callback_seconds',
+                                                           'Time spent in periodicUpdateReceived', **labels)
+        self.periodicSuppressed = registry.counter('periodic_suppressed_total',
+                                                   'Periodic updates suppressed by the deadband filter', **labels)
+        self.suppressionRatio = registry.gauge('periodic_suppression_ratio',
+                                               'Fraction of periodic updates suppressed by the deadband filter',
+                                               **labels)
+
+
+class SensorTypeMetrics(object):
+    """ The history metrics for a single sensor type of a device """
+
+    __slots__ = ('registry', 'labels', 'historyMessages', 'historyCallbackDuration', 'historyCycleDuration')
+
+    def __init__(self, registry, device, sensor_type):
+        labels = dict(device=device, sensor_type=sensor_type)
+        self.registry = registry
+        self.labels = labels
+        self.historyMessages = registry.counter('history_messages_total',
+                                                'History update messages dispatched', **labels)
+        self.historyCallbackDuration = registry.histogram('history_callback_seconds',
+                                                          'Time spent in historyUpdateReceived', **labels)
+        self.historyCycleDuration = registry.histogram('history_cycle_seconds',
+                                                       'Duration of history update message cycles',
+                                                       buckets=CycleBuckets, **labels)
+
+    def historyCycles(self, reason):
+        """ Return the counter of history cycles completed for a reason """
+        return self.registry.counter('history_cycles_total',
+                                     'History update message cycles completed by reason',
+                                     reason=reason, **self.labels)
+
+
+class MonitorMetrics(object):
+    """
+    The metrics for a single device. Metrics for each sensor are created
+    when the sensor is first seen.
+    """
+
+    def __init__(self, registry, device=""):
+        """
+        @param registry: The registry holding the metrics
+        @type registry: MetricsRegistry
+        @param device: The device identifier used to label the metrics
+        @type device: string
+        """
+        self.registry = registry
+        self.device = device
+        self.bytesReceived = registry.counter('bytes_received_total',
+                                              'Bytes received from the device', device=device)
+        self.linesFramed = registry.counter('lines_framed_total',
+                                            'Message lines framed', device=device)
+        self.bytesDiscarded = registry.counter('bytes_discarded_total',
+                                               'Bytes discarded while resynchronising on message boundaries',
+                                               device=device)
+        self.parseErrors = registry.counter('parse_errors_total',
+                                            'Messages that could not be parsed or processed', device=device)
+        self.pendingHistoryUpdates = registry.gauge('pending_history_updates',
+                                                    'History messages waiting on the history decoder',
+                                                    device=device)
+        self.portConnected = registry.gauge('serial_port_connected',
+                                            'Whether the serial port is open', device=device)
+        self.reconnectAttempts = registry.counter('serial_reconnect_attempts_total',
+                                                  'Attempts made to reopen the serial port', device=device)
+        self.recoveryTime = registry.histogram('serial_recovery_seconds',
+                                               'Time taken to reopen a lost serial port',
+                                               buckets=RecoveryBuckets, device=device)
+        self._sensors = {}
+        self._sensorTypes = {}
+
+    def sensor(self, sensor_type, sensor_instance):
+        """ Return the SensorMetrics for a sensor """
+        key = (sensor_type, sensor_instance)
+        metrics = self._sensors.get(key)
+        if metrics is None:
+            metrics = SensorMetrics(self.registry, self.device, sensor_type, sensor_instance)
+            self._sensors[key] = metrics
+        return metrics
+
+    def sensorType(self, sensor_type):
+        """ Return the SensorTypeMetrics for a sensor type """
+        metrics = self._sensorTypes.get(sensor_type)
+        if metrics is None:
+            metrics = SensorTypeMetrics(self.registry, self.device, sensor_type)
+            self._sensorTypes[sensor_type] = metrics
+        return metrics
+
+
+class ExporterMetrics(object):
+    """ The metrics for a txcurrentcost.export.Exporter """
+
+    __slots__ = ('queueDepth', 'exported', 'dropped', 'spilled', 'retries',
+                 'exportLatency', 'requestDuration')
+
+    def __init__(self, registry, exporter=""):
+        """
+        @param registry: The registry holding the metrics
+        @type registry: MetricsRegistry
+        @param exporter: The exporter name used to label the metrics
+        @type exporter: string
+        """
+        labels = dict(exporter=exporter)
+        self.queueDepth = registry.gauge('export_queue_depth',
+                                         'Items waiting to be exported', **labels)
+        self.exported = registry.counter('exported_total',
+                                         'Items exported', **labels)
+        self.dropped = registry.counter('export_dropped_total',
+                                        'Items dropped because the export queue was full', **labels)
+        self.spilled = registry.counter('export_spilled_total',
+                                        'Items spilled to disk because the export queue was full', **labels)
+        self.retries = registry.counter('export_retries_total',
+                                        'Failed export attempts that were retried', **labels)
+        self.exportLatency = registry.histogram('export_latency_seconds',
+                                                'Time from queueing the oldest item of a batch to its export',
+                                                buckets=ExportBuckets, **labels)
+        self.requestDuration = registry.histogram('export_request_seconds',
+                                                  'Duration of successful export requests',
+                                                  buckets=ExportBuckets, **labels)
+
+
+class FanoutMetrics(object):
+    """ The metrics for a txcurrentcost.fanout.FanoutFactory """
+
+    __slots__ = ('subscribers', 'published', 'dropped')
+
+    def __init__(self, registry, server=""):
+        """
+        @param registry: The registry holding the metrics
+        @type registry: MetricsRegistry
+        @param server: The server name used to label the metrics
+        @type server: string
+        """
+        labels = dict(server=server)
+        self.subscribers = registry.gauge('fanout_subscribers',
+                                          'Connected subscribers', **labels)
+        self.published = registry.counter('fanout_published_total',
+                                          'Items published to the subscribers', **labels)
+        self.dropped = registry.counter('fanout_dropped_subscribers_total',
+                                        'Subscribers dropped for not keeping up', **labels)
+
+
+class MetricsResource(resource.Resource):
+    """ Serve the metrics of a registry as text """
+
+    isLeaf = True
+
+    def __init__(self, registry):
+        resource.Resource.__init__(self)
+        self.registry = registry
+
+    def render_GET(self, request):
+        request.setHeader("Content-Type", "text/plain; version=0.0.4")
+        return self.registry.render().encode("utf-8")
+
+
+def listenMetrics(registry, port, interface="127.0.0.1", reactor=None):
+    """
+    Serve the metrics of a registry over HTTP.
+
+    @param registry: The registry holding the metrics
+    @type registry: MetricsRegistry
+    @param port: The TCP port to listen on
+    @type port: int
+    @param interface: The interface to listen on, local only by default
+    @type interface: string
+
+    @return: The listening port
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    return reactor.listenTCP(port, server.Site(MetricsResource(registry)), interface=interface)
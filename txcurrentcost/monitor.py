@@ -4,17 +4,29 @@
 This module implements the Current Cost monitor class.
 '''
 
+import collections
 import datetime
 import logging
 import os
-import ConfigParser
+import time
+try:
+    from ConfigParser import SafeConfigParser as ConfigParser
+except ImportError:
+    from configparser import ConfigParser
 import txcurrentcost
-from twisted.internet import reactor
-from twisted.python import usage
+from txcurrentcost.batch import PeriodicBatcher
+from txcurrentcost.decoder import PeriodicReading, decodeHistoryUpdate, monotonic
+try:
+    # MonitorOptions is defined in txcurrentcost.options and imported here
+    # for existing scripts. It needs Twisted, which AsyncioMonitor does not.
+    from txcurrentcost.options import MonitorOptions
+except ImportError:
+    pass
 
 
-class MonitorOptions(usage.Options):
-    optParameters = [['configfile', 'c', None, 'Configuration file path']]
+# How the completion of a history update message cycle was detected.
+HistoryCycleCompletedByStructure = 'structure'
+HistoryCycleCompletedByTimeout = 'timeout'
 
 
 class MonitorConfig(object):
@@ -50,7 +62,7 @@ class MonitorConfig(object):
         self.parse(config_file)
 
     def parse(self, config_file):
-        parser = ConfigParser.SafeConfigParser()
+        parser = ConfigParser()
         parser.read(config_file)
 
         self.port = parser.get(MonitorConfig.CURRENT_COST_SECTION, MonitorConfig.PORT)
@@ -66,16 +78,92 @@ class Monitor(object):
     The monitor expects a MonitorConfig object passed to it as the config
     argument but any object providing the port, baudrate, clamp_count and
     use_utc_timestamps attributes will suffice.
+
+    History update messages are parsed in the reactor thread unless a
+    history decoder (see txcurrentcost.workers) is assigned to the
+    historyDecoder attribute before the monitor is started. The decoder
+    parses raw history messages in worker threads or processes and the
+    results are stored in the order the messages were received.
+
+    The serial port is opened using the portFactory attribute which defaults
+    to txcurrentcost.FixedSerialPort. Any callable accepting the same
+    arguments, such as a txcurrentcost.replay.ReplayPortFactory, can be
+    used instead. When reconnection has been enabled, using
+    enableReconnection, the port is reopened whenever it is lost, see
+    txcurrentcost.supervisor.
+
+    Periodic updates are passed to periodicUpdateReceived as message text.
+    When the typedReadings attribute is set to True they are instead decoded
+    once into a txcurrentcost.decoder.PeriodicReading holding numeric values
+    and passed to periodicReadingReceived. Batched delivery, when enabled,
+    takes precedence over both.
+
+    Pipeline metrics are recorded when a txcurrentcost.metrics.MonitorMetrics
+    is assigned to the metrics attribute before the monitor is started.
+
+    Rolling window statistics for each electricity sensor channel are kept
+    when a txcurrentcost.stats.StatisticsAggregator is assigned to the
+    statistics attribute. Readings are timestamped using the monitor clock.
+
+    The most recent readings of each sensor are kept for queries when a
+    txcurrentcost.recent.RecentReadings is assigned to the recentReadings
+    attribute. Readings are timestamped using the monitor clock.
+
+    Readings that have not changed are not passed on when a
+    txcurrentcost.deadband.DeadbandFilter is assigned to the deadband
+    attribute. Filtering is applied after the statistics and recent
+    readings are updated, which see every reading, and before readings are
+    logged, exported, streamed, batched or dispatched.
+
+    Periodic readings are persisted when a DeviceReadingLog, obtained from
+    txcurrentcost.readinglog.ReadingLog.device, is assigned to the
+    readingLog attribute.
+
+    A history message cycle is complete once every datapoint tag expected
+    for each sensor has been received, or once no history message has been
+    received for historicDataMessageTimeout seconds. The expected tags are
+    learned from the previous cycle and can be configured for the first
+    cycle by assigning a set of (sensor instance, tag) 2-tuples, keyed by
+    sensor type, to the expectedHistory attribute. Tags received in a cycle
+    that were not expected are added to the expected tags. Expected tags
+    are only dropped once historyShrinkCycles consecutive cycles have
+    completed on the timeout without them, so that a partial cycle can not
+    cause the next cycle to complete early. Clear expectedHistory to drop
+    the tags of a removed sensor at once.
+
+    When the historyDeltas attribute is set to True each completed history
+    message cycle delivers, for each sensor, only the datapoints that are
+    new or have changed since the previous cycle. Datapoints are compared
+    by the period they cover rather than by tag, as tags count back from
+    the time the history was sent. Sensors without changes are left out.
+    The full history remains available using historySnapshot.
+
+    Periodic updates are queued for export to a remote service when a
+    txcurrentcost.export.Exporter is assigned to the exporter attribute.
+
+    Periodic updates are streamed to subscribers when a
+    txcurrentcost.fanout.FanoutFactory is assigned to the fanout attribute.
     """
 
-    def __init__(self, config):
+    def __init__(self, config, clock=None):
         """
         @param config: A MonitorConfig instance holding configuration settings
         @type config: a MonitorConfig instance
+        @param clock: The reactor used to open the port and schedule history
+                      timers. Defaults to the global reactor. A
+                      twisted.internet.task.Clock may be used along with a
+                      replay port to drive the monitor in tests.
         """
         self.config = config
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.portFactory = txcurrentcost.FixedSerialPort
         self.serialPort = None
         self.protocol = None
+        # The initial and maximum delays between attempts to reopen a lost
+        # port, when reconnection is enabled.
+        self.reconnectDelays = None
 
         self.source = None
         self.days_since_birth = None
@@ -85,6 +173,40 @@ class Monitor(object):
         self.historicDataMessageTimeout = 20.0  # seconds
         self.historicalDataUpdateCompleteForSensorType = {}
 
+        self.historyDecoder = None
+        # History messages passed to the history decoder, in order of receipt,
+        # that have not yet been stored. Each entry is a list holding the
+        # receipt timestamp, the decoded HistoryUpdate and a done flag.
+        self._pendingHistoryUpdates = collections.deque()
+        # The clock time the current history cycle started for each sensor type.
+        self._historyCycleStarted = {}
+        # The (sensor instance, tag) 2-tuples expected in a history cycle by sensor type.
+        self.expectedHistory = {}
+        # The (sensor instance, tag) 2-tuples received, and the expected ones
+        # not yet received, in the current history cycle by sensor type.
+        self._historyCycleTags = {}
+        self._historyCycleMissing = {}
+        # The number of consecutive cycles missing expected tags after which
+        # the expected tags are reduced to those received in those cycles.
+        self.historyShrinkCycles = 3
+        # The number of consecutive cycles that missed expected tags, and
+        # the tags received in them, by sensor type.
+        self._historyShortCycles = {}
+        self.historyDeltas = False
+        # The history delivered by the previous cycle of each sensor, keyed
+        # by sensor type and sensor instance, when historyDeltas is enabled.
+        self._historySnapshots = {}
+
+        self.metrics = None
+        self.periodicBatcher = None
+        self.typedReadings = False
+        self.statistics = None
+        self.recentReadings = None
+        self.deadband = None
+        self.readingLog = None
+        self.exporter = None
+        self.fanout = None
+
     def periodicUpdateReceived(self, timestamp, temperature, sensor_type, sensor_instance, sensor_data):
         """
         Called to notify receipt of a periodic update message after parsing important
@@ -107,6 +229,31 @@ class Monitor(object):
         """
         pass
 
+    def periodicReadingReceived(self, reading):
+        """
+        Called instead of periodicUpdateReceived to notify receipt of a periodic
+        update message when the typedReadings attribute is set to True.
+
+        @param reading: The numeric values of the periodic update message
+        @type reading: txcurrentcost.decoder.PeriodicReading
+
+        Implement this method to handle data in the way you want.
+        """
+        pass
+
+    def periodicBatchReceived(self, batch):
+        """
+        Called to deliver a batch of periodic updates when batching has been
+        enabled using enablePeriodicBatching.
+
+        @param batch: The periodic updates received since the last batch
+        @type batch: txcurrentcost.batch.PeriodicBatch
+
+        Implement this method to handle data in the way you want. For example
+        you may want to write the whole batch to a database in one go.
+        """
+        pass
+
     def historyUpdateReceived(self, sensor_type, sensorHistoryData):
         """
         Called to notify receipt of a history update message after the completion of
@@ -124,26 +271,97 @@ class Monitor(object):
         """
         pass
 
+    def serialPortRecovered(self, gap):
+        """
+        Called when the serial port has been reopened after being lost, when
+        reconnection has been enabled using enableReconnection.
+
+        @param gap: The interval during which the port was not open
+        @type gap: txcurrentcost.supervisor.Gap
+
+        Implement this method to handle data in the way you want. For example
+        you may want to mark the gap in your stored readings.
+        """
+        pass
+
+    def enablePeriodicBatching(self, max_count=100, max_delay=1.0):
+        """
+        Deliver periodic updates in batches to periodicBatchReceived instead
+        of one at a time to periodicUpdateReceived. A batch is delivered once
+        it holds max_count readings or max_delay seconds after its first
+        reading was received, whichever is first, and when the monitor stops.
+
+        @param max_count: The maximum number of readings in a batch
+        @type max_count: int
+        @param max_delay: The maximum seconds a reading waits before delivery
+        @type max_delay: float
+        """
+        self.periodicBatcher = PeriodicBatcher(self.clock, self.periodicBatchReceived,
+                                               max_count, max_delay)
+
+    def enableReconnection(self, initial_delay=0.05, max_delay=1.0):
+        """
+        Reopen the serial port whenever it is lost, or can't be opened when
+        the monitor starts, retrying after a delay that doubles with each
+        failed attempt up to max_delay.
+
+        @param initial_delay: The seconds before the first attempt to reopen the port
+        @type initial_delay: float
+        @param max_delay: The maximum seconds between attempts to reopen the port
+        @type max_delay: float
+        """
+        self.reconnectDelays = (initial_delay, max_delay)
+
     def start(self):
         """
         Start the CurrenCost monitor
         """
         logging.info('CurrentCostMonitor starting')
         logging.info('Attempting to open port %s at %dbps' % (self.config.port, self.config.baudrate))
-        self.protocol = txcurrentcost.CurrentCostDataProtocol(self._messageHandler)
-        self.serialPort = txcurrentcost.FixedSerialPort(self.protocol,
-                                                        self.config.port,
-                                                        reactor,
-                                                        baudrate=self.config.baudrate)
+        if self.historyDecoder:
+            self.historyDecoder.start()
+        self.protocol = txcurrentcost.CurrentCostDataProtocol(self._messageHandler,
+                                                              parseHistory=self.historyDecoder is None,
+                                                              metrics=self.metrics,
+                                                              clampCount=self._readingClampCount())
+        if self.reconnectDelays is None:
+            self.serialPort = self.portFactory(self.protocol,
+                                               self.config.port,
+                                               self.clock,
+                                               baudrate=self.config.baudrate)
+        else:
+            from txcurrentcost.supervisor import SerialPortSupervisor
+            initial_delay, max_delay = self.reconnectDelays
+            self.serialPort = SerialPortSupervisor(self.portFactory,
+                                                   self.protocol,
+                                                   self.config.port,
+                                                   self.clock,
+                                                   baudrate=self.config.baudrate,
+                                                   initial_delay=initial_delay,
+                                                   max_delay=max_delay,
+                                                   metrics=self.metrics,
+                                                   recovered=self.serialPortRecovered)
 
     def stop(self):
         """
         Stop the CurrenCost monitor
         """
         logging.info('CurrentCostMonitor stopping')
-        if self.protocol and self.protocol.transport:
-            self.protocol.transport.loseConnection()
+        # Closing the port, rather than the transport of the protocol, stops
+        # a supervisor from reopening it.
         self.serialPort.close()
+        self._flushOutputs()
+        if self.historyDecoder:
+            self.historyDecoder.stop()
+
+    def _flushOutputs(self):
+        """ Deliver, write or send any readings held for later """
+        if self.periodicBatcher:
+            self.periodicBatcher.flush()
+        if self.readingLog:
+            self.readingLog.flush()
+        if self.exporter:
+            self.exporter.flush()
 
     def _messageHandler(self, kind, message):
         """
@@ -158,7 +376,7 @@ class Monitor(object):
         @type message: string
         """
         if kind not in txcurrentcost.MessageKinds:
-            logging.error("Invalid message kind \'%s\' not in kinds: %s" % txcurrentcost.MessageKinds)
+            logging.error("Invalid message kind \'%s\' not in kinds: %s" % (kind, txcurrentcost.MessageKinds))
             return
 
         if kind == txcurrentcost.PeriodicUpdateMsg:
@@ -167,70 +385,227 @@ class Monitor(object):
         elif kind == txcurrentcost.HistoryUpdateMsg:
             self._parseHistoryUpdate(message)
 
+        elif kind == txcurrentcost.RawHistoryUpdateMsg:
+            self._offloadHistoryUpdate(message)
+
+    def _getTimestamp(self):
+        """
+        Return a computer generated timestamp for a message received now.
+        The unit timestamp is ignored in preference for a computer generated
+        timestamp that can more easily be used when updating data points at
+        sites like Cosm.
+        """
+        if self.config.use_utc_timestamps:
+            return datetime.datetime.utcnow()
+        else:
+            return datetime.datetime.now()
+
+    def _readingClampCount(self):
+        """
+        Return the clamp count the protocol decodes periodic readings with,
+        or None if it passes on periodic update messages.
+        """
+        if self.typedReadings:
+            return self.config.clamp_count
+        return None
+
+    def _channels(self, sensor_instance):
+        """
+        Return the channel numbers reported by an electricity sensor.
+        """
+        # channel indexes start from 1, not zero.
+        if sensor_instance == txcurrentcost.Sensors.WholeHouseSensorId:
+            # The whole house sensor supports multiple channels.
+            return range(1, self.config.clamp_count + 1)
+        else:
+            # All other sensors only support 1 channel
+            return range(1, 2)
+
+    def _decodePeriodicReading(self, msg, sensor_type, sensor_instance):
+        """
+        Return a PeriodicReading holding the numeric values of a periodic
+        update message element or None if the sensor type is not supported.
+        Messages decoded by the fast path decoder are instead decoded
+        straight into a PeriodicReading by the protocol.
+        """
+        temperature = msg.findtext("tmpr")
+        if temperature:
+            temperature = float(temperature)
+        else:
+            temperature = None
+
+        if sensor_type == txcurrentcost.Sensors.ElectricitySensor:
+            watts_on_channel = []
+            for channel_number in self._channels(sensor_instance):
+                watts = msg.findtext("ch%i/watts" % channel_number)
+                if watts is not None:
+                    watts_on_channel.append(int(watts))
+            return PeriodicReading(time.time(), monotonic(), temperature, sensor_type, sensor_instance,
+                                   watts=tuple(watts_on_channel), source=self.source,
+                                   days_since_birth=self.days_since_birth)
+
+        elif sensor_type == txcurrentcost.Sensors.OptiSmartSensor:
+            imp = msg.findtext("imp")
+            ipu = msg.findtext("ipu")
+            return PeriodicReading(time.time(), monotonic(), temperature, sensor_type, sensor_instance,
+                                   impulses=int(imp) if imp else None,
+                                   impulses_per_unit=int(ipu) if ipu else None,
+                                   source=self.source, days_since_birth=self.days_since_birth)
+
+        return None
+
     def _parsePeriodicUpdate(self, msg):
         """
         Parse a periodic update message for important information and
-        pass to the user implemented handlePeriodicUpdate method.
+        pass to the user implemented handlePeriodicUpdate method, or to
+        the periodicReadingReceived method when typedReadings is enabled.
+
+        The message may be an ElementTree element or a fast path decoded
+        txcurrentcost.decoder.PeriodicUpdate as both support findtext, or a
+        txcurrentcost.decoder.PeriodicReading decoded by the protocol when
+        typedReadings is enabled.
         """
         logging.debug("Parsing a periodic update message")
         try:
-            self.source = msg.findtext("src")
-            self.days_since_birth = msg.findtext("dsb")
-            # Ignore the unit timestamp in preference for a
-            # computer generated timestamp that can more
-            # easily be used when updating data points at
-            # sites like Cosm.
-            #timestamp = msg.findtext("time")
-            if self.config.use_utc_timestamps:
-                timestamp = datetime.datetime.utcnow()
+            if isinstance(msg, PeriodicReading):
+                reading = msg
+                self.source = reading.source
+                self.days_since_birth = reading.days_since_birth
+                sensor_instance = reading.sensor_instance
+                sensor_type = reading.sensor_type
             else:
-                timestamp = datetime.datetime.now()
+                reading = None
+                self.source = msg.findtext("src")
+                self.days_since_birth = msg.findtext("dsb")
+
+                sensor_instance = int(msg.findtext("sensor"))
+                #identifier = msg.findtext("id")
+                sensor_type = int(msg.findtext("type"))
+
+            if reading is not None or self.typedReadings:
+                if reading is None:
+                    reading = self._decodePeriodicReading(msg, sensor_type, sensor_instance)
+                if reading is None or sensor_type not in (txcurrentcost.Sensors.ElectricitySensor,
+                                                          txcurrentcost.Sensors.OptiSmartSensor):
+                    logging.warning("Don't know how to handle sensor type: %s" % sensor_type)
+                    return
+                # The datetime timestamp is only created if a stage needs it.
+                timestamp = None
+                temperature = reading.temperature
+                if sensor_type == txcurrentcost.Sensors.ElectricitySensor:
+                    sensor_data = reading.watts
+                else:
+                    sensor_data = (reading.impulses, reading.impulses_per_unit)
 
-            temperature = msg.findtext("tmpr")
+            else:
+                reading = None
+                #timestamp = msg.findtext("time")
+                timestamp = self._getTimestamp()
 
-            sensor_instance = int(msg.findtext("sensor"))
-            #identifier = msg.findtext("id")
-            sensor_type = int(msg.findtext("type"))
+                temperature = msg.findtext("tmpr")
 
-            if sensor_type == txcurrentcost.Sensors.ElectricitySensor:
+                if sensor_type == txcurrentcost.Sensors.ElectricitySensor:
+                    watts_on_channel = []
+                    for channel_number in self._channels(sensor_instance):
+                        watts = msg.findtext("ch%i/watts" % channel_number)
+                        if watts is not None:
+                            watts_on_channel.append(watts)
+                    sensor_data = watts_on_channel
 
-                # channel indexes start from 1, not zero.
-                if sensor_instance == txcurrentcost.Sensors.WholeHouseSensorId:
-                    # The whole house sensor supports multiple channels.
-                    channels = range(1, self.config.clamp_count + 1)
-                else:
-                    # All other sensors only support 1 channel
-                    channels = range(1, 2)
-
-                watts_on_channel = []
-                for channel_number in channels:
-                    channel = msg.find("ch%i" % channel_number)
-                    if channel is not None:
-                        watts = channel.findtext("watts")
-                        watts_on_channel.append(watts)
-                sensor_data = watts_on_channel
-
-            elif sensor_type == txcurrentcost.Sensors.OptiSmartSensor:
-                imp = msg.findtext("imp")
-                imu = msg.findtext("ipu")
-                sensor_data = (imp, imu)
+                elif sensor_type == txcurrentcost.Sensors.OptiSmartSensor:
+                    imp = msg.findtext("imp")
+                    imu = msg.findtext("ipu")
+                    sensor_data = (imp, imu)
 
-            else:
-                logging.warning("Don't know how to handle sensor type: %s" % sensor_type)
-                return
+                else:
+                    logging.warning("Don't know how to handle sensor type: %s" % sensor_type)
+                    return
+
+            if self.statistics is not None and sensor_type == txcurrentcost.Sensors.ElectricitySensor:
+                self.statistics.add(self.clock.seconds(), sensor_type, sensor_instance, sensor_data)
+
+            if self.recentReadings is not None:
+                self.recentReadings.add(self.clock.seconds(), temperature, sensor_type, sensor_instance, sensor_data)
+
+            if self.deadband is not None:
+                forward = self.deadband.accept(self.clock.seconds(), sensor_type, sensor_instance, sensor_data)
+                if self.metrics is not None:
+                    sensorMetrics = self.metrics.sensor(sensor_type, sensor_instance)
+                    sensorMetrics.suppressionRatio.set(self.deadband.suppressionRatio(sensor_type, sensor_instance))
+                    if not forward:
+                        sensorMetrics.periodicSuppressed.inc()
+                if not forward:
+                    return
+
+            if self.readingLog is not None:
+                self.readingLog.append(self.clock.seconds(),
+                                       temperature,
+                                       sensor_type,
+                                       sensor_instance,
+                                       sensor_data)
+
+            if timestamp is None and (self.exporter is not None or self.fanout is not None or
+                                      self.periodicBatcher is not None):
+                timestamp = reading.receivedAt(self.config.use_utc_timestamps)
+
+            item = None
+            if self.exporter is not None or self.fanout is not None:
+                item = {'timestamp': str(timestamp),
+                        'temperature': temperature,
+                        'sensor_type': sensor_type,
+                        'sensor_instance': sensor_instance,
+                        'sensor_data': sensor_data}
+                if self.exporter is not None:
+                    self.exporter.add(item)
+
+            sensorMetrics = None
+            if self.metrics is not None:
+                sensorMetrics = self.metrics.sensor(sensor_type, sensor_instance)
+                sensorMetrics.periodicDispatched.inc()
+                started = time.time()
+
+            if self.periodicBatcher is not None:
+                self.periodicBatcher.add(timestamp,
+                                         temperature,
+                                         sensor_type,
+                                         sensor_instance,
+                                         sensor_data)
 
             # pass message data on to user implemented method
-            self.periodicUpdateReceived(timestamp,
-                                        temperature,
-                                        sensor_type,
-                                        sensor_instance,
-                                        sensor_data)
-
-        except Exception, ex:
+            elif reading is not None:
+                self.periodicReadingReceived(reading)
+            else:
+                self.periodicUpdateReceived(timestamp,
+                                            temperature,
+                                            sensor_type,
+                                            sensor_instance,
+                                            sensor_data)
+
+            if sensorMetrics is not None and self.periodicBatcher is None:
+                sensorMetrics.periodicCallbackDuration.observe(time.time() - started)
+
+        except Exception as ex:
+            if self.metrics is not None:
+                self.metrics.parseErrors.inc()
             logging.error("Problem processing periodic update")
             logging.exception(ex)
             return
 
+        # Streaming is done last so a problem with it can't stop the reading
+        # being dispatched.
+        if self.fanout is not None:
+            self._publish(item)
+
+    def _publish(self, item):
+        """
+        Stream a periodic update item to the fanout subscribers.
+        """
+        try:
+            self.fanout.publish(item)
+        except Exception as ex:
+            logging.error("Problem streaming periodic update")
+            logging.exception(ex)
+
     def _parseHistoryUpdate(self, msg):
         """
         Parse a history update message for important information and
@@ -240,32 +615,87 @@ class Monitor(object):
 
         The Current Cost device begins emitting set of history
         messages about 1 minute past every odd hour.
+        """
+        logging.debug("Parsing a history update message")
+        timestamp = self._getTimestamp()
+
+        try:
+            update = decodeHistoryUpdate(msg)
+        except Exception as ex:
+            if self.metrics is not None:
+                self.metrics.parseErrors.inc()
+            logging.exception(ex)
+            logging.error("Problem processing history update message")
+            return
+
+        self._storeHistoryUpdate(timestamp, update)
+
+    def _offloadHistoryUpdate(self, line):
+        """
+        Pass a raw history update message line to the history decoder. The
+        decoded history update is stored once all history messages received
+        before it have been stored.
+        """
+        logging.debug("Offloading a history update message")
+        entry = [self._getTimestamp(), None, False]
+        self._pendingHistoryUpdates.append(entry)
+        if self.metrics is not None:
+            self.metrics.pendingHistoryUpdates.set(len(self._pendingHistoryUpdates))
+
+        d = self.historyDecoder.decode(line)
+        d.addCallbacks(self._historyUpdateDecoded, self._historyUpdateDecodeFailed,
+                       callbackArgs=(entry,), errbackArgs=(entry,))
+
+    def _historyUpdateDecoded(self, update, entry):
+        """
+        Callback called when the history decoder has decoded a history
+        update message.
+        """
+        entry[1] = update
+        entry[2] = True
+
+        # Store decoded history updates in the order they were received.
+        while self._pendingHistoryUpdates and self._pendingHistoryUpdates[0][2]:
+            timestamp, update, _ = self._pendingHistoryUpdates.popleft()
+            if update is not None:
+                self._storeHistoryUpdate(timestamp, update)
+        if self.metrics is not None:
+            self.metrics.pendingHistoryUpdates.set(len(self._pendingHistoryUpdates))
+
+    def _historyUpdateDecodeFailed(self, failure, entry):
+        """
+        Errback called when the history decoder fails to decode a history
+        update message.
+        """
+        if self.metrics is not None:
+            self.metrics.parseErrors.inc()
+        logging.error("Problem processing history update message: %s" % failure.getErrorMessage())
+        self._historyUpdateDecoded(None, entry)
+
+    def _storeHistoryUpdate(self, timestamp, update):
+        """
+        Store the data from a decoded history update message.
 
         On receipt of the first history message a callback timer is
         started and the timer is extended upon receipt of each
-        subsequent history message. The expiry of the timer signifies
-        the completion of the history message cycle at which point
-        the accumulated history message data is passed to the user
+        subsequent history message. The receipt of every expected
+        datapoint tag, or else the expiry of the timer, signifies the
+        completion of the history message cycle at which point the
+        accumulated history message data is passed to the user
         implemented historyUpdateReceived method.
-        """
-        logging.debug("Parsing a history update message")
 
+        @param timestamp: The time the history update message was received
+        @type timestamp: datetime.datetime
+        @param update: A decoded history update message
+        @type update: txcurrentcost.decoder.HistoryUpdate
+        """
         try:
-            self.source = msg.findtext("src")
-            self.days_since_birth = msg.findtext("dsb")
-            # Ignore the unit timestamp in preference for a
-            # computer generated timestamp that can more
-            # easily be used when updating data points at
-            # sites like Cosm.
-            #timestamp = msg.findtext("time")
-            if self.config.use_utc_timestamps:
-                timestamp = datetime.datetime.utcnow()
-            else:
-                timestamp = datetime.datetime.now()
-
-            history = msg.find("hist")
-            self.days_since_wiped = history.findtext("dsw")
-            sensor_type = int(history.findtext("type"))
+            self.source = update.source
+            self.days_since_birth = update.days_since_birth
+            self.days_since_wiped = update.days_since_wiped
+            sensor_type = update.sensor_type
+            if self.metrics is not None:
+                self.metrics.sensorType(sensor_type).historyMessages.inc()
 
             # Add a new key for the sensor type if one does not yet exist.
             if sensor_type not in self.historicSensorData:
@@ -282,61 +712,163 @@ class Monitor(object):
             # timer and additional timeout period.
             #
             if self.historicalDataUpdateCompleteForSensorType[sensor_type] is None:
-                self.historicalDataUpdateCompleteForSensorType[sensor_type] = reactor.callLater(self.historicDataMessageTimeout,
-                                                                                                self._historicalDataUpdateCompleted,
-                                                                                                sensor_type)
+                self._historyCycleStarted[sensor_type] = self.clock.seconds()
+                self._historyCycleTags[sensor_type] = set()
+                expected = self.expectedHistory.get(sensor_type)
+                self._historyCycleMissing[sensor_type] = set(expected) if expected else None
+                self.historicalDataUpdateCompleteForSensorType[sensor_type] = self.clock.callLater(self.historicDataMessageTimeout,
+                                                                                                           self._historicalDataUpdateCompleted,
+                                                                                                           sensor_type)
             else:
-                # delay history data completed job another timeout period.
-                self.historicalDataUpdateCompleteForSensorType[sensor_type].delay(self.historicDataMessageTimeout)
-
-            sensor_units = history.findtext("units")
+                # restart the history data completed job timeout period. Note that
+                # DelayedCall.delay would add a further timeout period per message.
+                self.historicalDataUpdateCompleteForSensorType[sensor_type].reset(self.historicDataMessageTimeout)
 
-            for data_element in history.findall("data"):
-                sensor_instance = int(data_element.findtext("sensor"))
+            for sensor_instance, datapoints in update.sensors:
 
                 if sensor_instance not in self.historicSensorData[sensor_type]:
-                    sensorHistoricalData = txcurrentcost.SensorHistoryData(sensor_type, sensor_instance, sensor_units)
+                    sensorHistoricalData = txcurrentcost.SensorHistoryData(sensor_type, sensor_instance, update.sensor_units)
                     self.historicSensorData[sensor_type][sensor_instance] = sensorHistoricalData
 
                 logging.debug("Processing historical data for sensor %s" % sensor_instance)
 
-                datapoints = []
-                for historical_element in data_element:
-                    tag = historical_element.tag
-                    value = historical_element.text
-                    if tag == "sensor":
-                        # ignore the sensor element that has already been inspected.
-                        continue
-                    datapoints.append((tag, value))
-
                 historicalSensorData = self.historicSensorData[sensor_type][sensor_instance]
                 historicalSensorData.storeDataPoints(timestamp, datapoints)
 
-        except Exception, ex:
+                tags = [(sensor_instance, tag) for tag, _ in datapoints]
+                self._historyCycleTags[sensor_type].update(tags)
+                missing = self._historyCycleMissing[sensor_type]
+                if missing is not None:
+                    missing.difference_update(tags)
+
+        except Exception as ex:
+            if self.metrics is not None:
+                self.metrics.parseErrors.inc()
             logging.exception(ex)
             logging.error("Problem processing history update message")
             return
 
-    def _historicalDataUpdateCompleted(self, sensor_type):
-        """
-        Callback called to notify that a history update message cycle has completed
-        for the specified sensor type.
+        if self._historyCycleMissing[sensor_type] is not None and not self._historyCycleMissing[sensor_type]:
+            # Every expected datapoint has been received so there is no need
+            # to wait for the timeout.
+            self.historicalDataUpdateCompleteForSensorType[sensor_type].cancel()
+            self._completeHistoryCycle(sensor_type, HistoryCycleCompletedByStructure)
 
-        @param sensor_type: The sensor type that has completed it's history cycle.
-        @type sensor_type: A Sensors.Types item
+    def historySnapshot(self, sensor_type):
         """
-        logging.debug("History update cycle completed for sensor type: %s" % sensor_type)
+        Return the full history data for a sensor type, received over all
+        history message cycles, as passed to historyUpdateReceived when
+        historyDeltas is not enabled.
 
-        self.historicalDataUpdateCompleteForSensorType[sensor_type] = None
-        historicDataForSensorType = self.historicSensorData[sensor_type]
+        @param sensor_type: The sensor type to return history data for
+        @type sensor_type: A Sensors.Types item
 
+        @return: A dict keyed by sensor identifier with values of
+                 SensorHistoryData objects for sensors containing data.
+        """
         # Only pass on sensor historical data for sensors that actually contain data.
         sensorsWithHistoricalData = {}
-        for sensor_id, sensorHistoricalData in historicDataForSensorType.items():
+        for sensor_id, sensorHistoricalData in self.historicSensorData.get(sensor_type, {}).items():
             if sensorHistoricalData.dataPresent:
                 sensorsWithHistoricalData[sensor_id] = sensorHistoricalData
+        return sensorsWithHistoricalData
+
+    def _historyChanges(self, sensor_type, sensorsWithHistoricalData):
+        """
+        Return the history data that is new or has changed since the previous
+        history message cycle for each sensor with changes.
+        """
+        changes = {}
+        for sensor_id, sensorHistoricalData in sensorsWithHistoricalData.items():
+            key = (sensor_type, sensor_id)
+            changed = sensorHistoricalData.changedSince(self._historySnapshots.get(key, {}))
+            self._historySnapshots[key] = sensorHistoricalData.snapshot()
+            if changed.datapointCount():
+                changes[sensor_id] = changed
+        return changes
+
+    def _historicalDataUpdateCompleted(self, sensor_type):
+        """
+        Callback called when no history update message has been received for
+        the timeout period, signifying the completion of the history update
+        message cycle for the specified sensor type.
+
+        @param sensor_type: The sensor type that has completed it's history cycle.
+        @type sensor_type: A Sensors.Types item
+        """
+        if self._pendingHistoryUpdates:
+            # History messages belonging to this cycle may still be with the
+            # history decoder so wait for them before completing the cycle.
+            self.historicalDataUpdateCompleteForSensorType[sensor_type] = self.clock.callLater(self.historicDataMessageTimeout,
+                                                                                                       self._historicalDataUpdateCompleted,
+                                                                                                       sensor_type)
+            return
+
+        self._completeHistoryCycle(sensor_type, HistoryCycleCompletedByTimeout)
 
-        self.historyUpdateReceived(sensor_type, sensorsWithHistoricalData)
+    def _updateExpectedHistory(self, sensor_type, received):
+        """
+        Update the tags expected in the history cycles of a sensor type with
+        the tags received in a completed cycle.
+        """
+        expected = self.expectedHistory.get(sensor_type)
+        if not expected:
+            self.expectedHistory[sensor_type] = received
+            self._historyShortCycles.pop(sensor_type, None)
+            return
+
+        if not received.issubset(expected):
+            expected = self.expectedHistory[sensor_type] = expected | received
+
+        if received.issuperset(expected):
+            self._historyShortCycles.pop(sensor_type, None)
+            return
+
+        # Expected tags were not received, either because the cycle was
+        # interrupted or because a sensor has stopped sending history.
+        count, seen = self._historyShortCycles.get(sensor_type, (0, set()))
+        count += 1
+        seen = seen | received
+        if count < self.historyShrinkCycles:
+            self._historyShortCycles[sensor_type] = (count, seen)
+        else:
+            logging.info("Expected history of sensor type %s reduced after %i cycles missing %i tags" %
+                         (sensor_type, count, len(expected - seen)))
+            self.expectedHistory[sensor_type] = seen
+            self._historyShortCycles.pop(sensor_type, None)
+
+    def _completeHistoryCycle(self, sensor_type, reason):
+        """
+        Pass the history data of a completed history update message cycle to
+        the user implemented historyUpdateReceived method.
+
+        @param sensor_type: The sensor type that has completed it's history cycle.
+        @type sensor_type: A Sensors.Types item
+        @param reason: How the completion of the cycle was detected
+        @type reason: HistoryCycleCompletedByStructure or HistoryCycleCompletedByTimeout
+        """
+        logging.debug("History update cycle completed for sensor type %s by %s" % (sensor_type, reason))
+
+        self.historicalDataUpdateCompleteForSensorType[sensor_type] = None
+        self._historyCycleMissing.pop(sensor_type, None)
+        received = self._historyCycleTags.pop(sensor_type, set())
+        self._updateExpectedHistory(sensor_type, received)
+        sensorsWithHistoricalData = self.historySnapshot(sensor_type)
+        for sensorHistoricalData in sensorsWithHistoricalData.values():
+            sensorHistoricalData.buildIndex()
+
+        if self.historyDeltas:
+            sensorsWithHistoricalData = self._historyChanges(sensor_type, sensorsWithHistoricalData)
+
+        if self.metrics is None:
+            self.historyUpdateReceived(sensor_type, sensorsWithHistoricalData)
+        else:
+            sensorTypeMetrics = self.metrics.sensorType(sensor_type)
+            sensorTypeMetrics.historyCycles(reason).inc()
+            sensorTypeMetrics.historyCycleDuration.observe(self.clock.seconds() - self._historyCycleStarted[sensor_type])
+            started = time.time()
+            self.historyUpdateReceived(sensor_type, sensorsWithHistoricalData)
+            sensorTypeMetrics.historyCallbackDuration.observe(time.time() - started)
 
 
 
@@ -0,0 +1,11 @@
+'''
+This module implements the command line options of Current Cost monitor
+scripts. It is kept apart from txcurrentcost.monitor as it requires Twisted,
+which the asyncio engine does not.
+'''
+
+from twisted.python import usage
+
+
+class MonitorOptions(usage.Options):
+    optParameters = [['configfile', 'c', None, 'Configuration file path']]
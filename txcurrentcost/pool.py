@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+'''
+This module implements a pool of Current Cost monitors that run many
+Current Cost receivers within a single reactor process.
+'''
+
+import logging
+import os
+try:
+    from ConfigParser import SafeConfigParser as ConfigParser
+except ImportError:
+    from configparser import ConfigParser
+from txcurrentcost.metrics import MonitorMetrics
+from txcurrentcost.monitor import MonitorConfig, Monitor
+
+
+class DeviceConfig(object):
+    """
+    Configuration for a single device within a monitor pool.
+
+    Provides the same attributes as a MonitorConfig so that it can be
+    passed to a Monitor.
+    """
+
+    def __init__(self, device_id, port, baudrate, clamp_count, use_utc_timestamps):
+        self.device_id = device_id
+        self.port = port
+        self.baudrate = baudrate
+        self.clamp_count = clamp_count
+        self.use_utc_timestamps = use_utc_timestamps
+
+
+class MonitorPoolConfig(object):
+    """
+    Current Cost Monitor Pool Configuration
+
+    Each device is configured in its own section named using the device
+    section prefix followed by a device identifier, for example
+    [current_cost:kitchen]. Each device section holds the same fields as
+    the current_cost section of a MonitorConfig.
+    """
+
+    DEVICE_SECTION_PREFIX = "%s:" % MonitorConfig.CURRENT_COST_SECTION
+
+    def __init__(self, config_file):
+        if not os.path.exists(config_file):
+            raise Exception("Invalid configuration file path: %s" % config_file)
+        self.config_file = config_file
+
+        # attribute populated after config file parsing
+        self.devices = []
+
+        self.parse(config_file)
+
+    def parse(self, config_file):
+        parser = ConfigParser()
+        parser.read(config_file)
+
+        for section in parser.sections():
+            if not section.startswith(MonitorPoolConfig.DEVICE_SECTION_PREFIX):
+                continue
+            device_id = section[len(MonitorPoolConfig.DEVICE_SECTION_PREFIX):]
+            device = DeviceConfig(device_id,
+                                  parser.get(section, MonitorConfig.PORT),
+                                  parser.getint(section, MonitorConfig.BAUDRATE),
+                                  parser.getint(section, MonitorConfig.CLAMP_COUNT),
+                                  parser.getboolean(section, MonitorConfig.USE_UTC_TIMESTAMPS))
+            self.devices.append(device)
+
+        if not self.devices:
+            raise Exception("No device sections found in configuration file: %s" % config_file)
+
+
+class PooledMonitor(Monitor):
+    """
+    A Monitor for a single device within a MonitorPool. Updates are
+    forwarded to the pool tagged with the device identifier.
+    """
+
+    def __init__(self, config, pool, clock=None):
+        """
+        @param config: A DeviceConfig instance holding configuration settings
+        @type config: a DeviceConfig instance
+        @param pool: The pool that updates are forwarded to
+        @type pool: a MonitorPool instance
+        @param clock: The reactor used by the monitor, see Monitor.
+        """
+        super(PooledMonitor, self).__init__(config, clock)
+        self.device_id = config.device_id
+        self.pool = pool
+
+    def periodicUpdateReceived(self, timestamp, temperature, sensor_type, sensor_instance, sensor_data):
+        self.pool.periodicUpdateReceived(self.device_id, timestamp, temperature,
+                                         sensor_type, sensor_instance, sensor_data)
+
+    def periodicReadingReceived(self, reading):
+        self.pool.periodicReadingReceived(self.device_id, reading)
+
+    def periodicBatchReceived(self, batch):
+        self.pool.periodicBatchReceived(self.device_id, batch)
+
+    def historyUpdateReceived(self, sensor_type, sensorHistoryData):
+        self.pool.historyUpdateReceived(self.device_id, sensor_type, sensorHistoryData)
+
+    def serialPortRecovered(self, gap):
+        self.pool.serialPortRecovered(self.device_id, gap)
+
+
+class MonitorPool(object):
+    """
+    Monitor many current cost devices from a single reactor.
+
+    Each device gets its own serial port, protocol and history state while
+    all updates are delivered through the pool's periodicUpdateReceived and
+    historyUpdateReceived methods tagged with the device identifier. When
+    typed readings have been enabled using enableTypedReadings periodic
+    updates are delivered through periodicReadingReceived instead, and when
+    batching has been enabled using enablePeriodicBatching through
+    periodicBatchReceived.
+
+    The pool expects a MonitorPoolConfig object passed to it as the config
+    argument but any object providing a devices attribute holding a list
+    of DeviceConfig objects will suffice.
+
+    Each device is monitored by an instance of the monitorFactory class
+    attribute, which must accept the same arguments as PooledMonitor.
+    """
+
+    monitorFactory = PooledMonitor
+
+    def __init__(self, config, clock=None):
+        """
+        @param config: A MonitorPoolConfig instance holding configuration settings
+        @type config: a MonitorPoolConfig instance
+        @param clock: The reactor used by every monitor, see Monitor.
+        """
+        self.config = config
+        self.monitors = {}
+        for device in config.devices:
+            if device.device_id in self.monitors:
+                raise Exception("Duplicate device identifier: %s" % device.device_id)
+            self.monitors[device.device_id] = self.monitorFactory(device, self, clock)
+
+    def enableMetrics(self, registry):
+        """
+        Record metrics for every device in the pool, labelled with the device
+        identifier. Call this before starting the pool.
+
+        @param registry: The registry holding the metrics
+        @type registry: txcurrentcost.metrics.MetricsRegistry
+        """
+        for device_id, monitor in self.monitors.items():
+            monitor.metrics = MonitorMetrics(registry, device_id)
+
+    def enableReadingLog(self, log):
+        """
+        Append the periodic readings of every device in the pool to a log,
+        tagged with the device identifier. Call this before starting the pool.
+
+        @param log: The log the readings are appended to
+        @type log: txcurrentcost.readinglog.ReadingLog
+        """
+        for device_id, monitor in self.monitors.items():
+            monitor.readingLog = log.device(device_id)
+
+    def enableTypedReadings(self):
+        """
+        Deliver the periodic updates of every device in the pool decoded
+        into txcurrentcost.decoder.PeriodicReading objects to
+        periodicReadingReceived, see Monitor.typedReadings. Call this
+        before starting the pool.
+        """
+        for monitor in self.monitors.values():
+            monitor.typedReadings = True
+
+    def enablePeriodicBatching(self, max_count=100, max_delay=1.0):
+        """
+        Deliver the periodic updates of every device in the pool in batches
+        to periodicBatchReceived, see Monitor.enablePeriodicBatching. Each
+        device has its own batches. Call this before starting the pool.
+        """
+        for monitor in self.monitors.values():
+            monitor.enablePeriodicBatching(max_count, max_delay)
+
+    def enableReconnection(self, initial_delay=0.05, max_delay=1.0):
+        """
+        Reopen the serial port of any device in the pool whenever it is lost,
+        see Monitor.enableReconnection. Call this before starting the pool.
+        """
+        for monitor in self.monitors.values():
+            monitor.enableReconnection(initial_delay, max_delay)
+
+    def periodicUpdateReceived(self, device_id, timestamp, temperature, sensor_type, sensor_instance, sensor_data):
+        """
+        Called to notify receipt of a periodic update message from any device
+        in the pool.
+
+        @param device_id: The identifier of the device that sent the message
+        @type device_id: string
+
+        The remaining parameters are the same as Monitor.periodicUpdateReceived.
+
+        Implement this method to handle data in the way you want.
+        """
+        pass
+
+    def periodicReadingReceived(self, device_id, reading):
+        """
+        Called instead of periodicUpdateReceived to notify receipt of a
+        periodic update message from any device in the pool when typed
+        readings have been enabled using enableTypedReadings.
+
+        @param device_id: The identifier of the device that sent the message
+        @type device_id: string
+
+        The remaining parameters are the same as Monitor.periodicReadingReceived.
+
+        Implement this method to handle data in the way you want.
+        """
+        pass
+
+    def periodicBatchReceived(self, device_id, batch):
+        """
+        Called to deliver a batch of periodic updates from a device in the
+        pool when batching has been enabled using enablePeriodicBatching.
+
+        @param device_id: The identifier of the device that sent the messages
+        @type device_id: string
+
+        The remaining parameters are the same as Monitor.periodicBatchReceived.
+
+        Implement this method to handle data in the way you want.
+        """
+        pass
+
+    def historyUpdateReceived(self, device_id, sensor_type, sensorHistoryData):
+        """
+        Called to notify the completion of a history update message cycle from
+        any device in the pool.
+
+        @param device_id: The identifier of the device that sent the messages
+        @type device_id: string
+
+        The remaining parameters are the same as Monitor.historyUpdateReceived.
+
+        Implement this method to handle data in the way you want.
+        """
+        pass
+
+    def serialPortRecovered(self, device_id, gap):
+        """
+        Called when the serial port of a device in the pool has been reopened
+        after being lost, when reconnection has been enabled.
+
+        @param device_id: The identifier of the device whose port was reopened
+        @type device_id: string
+        @param gap: The interval during which the port was not open
+        @type gap: txcurrentcost.supervisor.Gap
+        """
+        pass
+
+    def start(self):
+        """
+        Start monitoring every device in the pool. A device that fails to
+        start does not prevent the other devices from starting.
+        """
+        logging.info('CurrentCostMonitorPool starting %i devices' % len(self.monitors))
+        for device_id, monitor in self.monitors.items():
+            try:
+                monitor.start()
+            except Exception as ex:
+                logging.error("Problem starting monitor for device %s" % device_id)
+                logging.exception(ex)
+
+    def stop(self):
+        """
+        Stop monitoring every device in the pool.
+        """
+        logging.info('CurrentCostMonitorPool stopping')
+        for device_id, monitor in self.monitors.items():
+            if monitor.serialPort is None:
+                continue
+            try:
+                monitor.stop()
+            except Exception as ex:
+                logging.error("Problem stopping monitor for device %s" % device_id)
+                logging.exception(ex)
@@ -0,0 +1,423 @@
+'''
+This module implements an append-only binary log of periodic readings.
+
+Each reading is stored as a fixed width record holding the receipt time,
+the device identifier, the sensor type and instance, the temperature and
+up to MaxChannels channel values. Records are appended to numbered segment
+files in a log directory and a new segment is started once the current one
+reaches the segment size limit.
+
+Each segment starts with a header holding the record format version. The
+temperature and channel values are stored as doubles from version 2, so
+impulse counts and readings are kept exactly. Version 1 segments, which
+have no header and store single precision values, can still be read, and a
+log whose last segment is a version 1 segment is continued in a new one.
+
+Writes are buffered in memory and written and fsynced in groups, once a
+number of records is waiting or a flush interval has passed, whichever is
+first. Records are expected to be appended in time order.
+
+A ReadingLogReader memory maps the segments and answers time range queries
+using a binary search over the records, so a query only reads the records
+it returns.
+
+To log the readings of a monitor:
+
+    log = ReadingLog("/var/lib/currentcost")
+    monitor.readingLog = log.device("house")
+'''
+
+import bisect
+import collections
+import logging
+import mmap
+import os
+import struct
+
+
+# The maximum number of channel values held in a record. The whole house
+# sensor supports up to three clamps.
+MaxChannels = 3
+
+# The maximum length of a device identifier held in a record.
+MaxDeviceLength = 16
+
+# The version of the record format written to new segments.
+FormatVersion = 2
+
+# magic, format version
+SegmentHeader = struct.Struct('<4sI')
+SegmentMagic = b'CCRL'
+
+# timestamp, device, sensor type, sensor instance, channel count, temperature, channel values
+Record = struct.Struct('<d%isBBB5xd%id' % (MaxDeviceLength, MaxChannels))
+Timestamp = struct.Struct('<d')
+
+# The record of version 1 segments, which have no header.
+LegacyRecord = struct.Struct('<d%isBBBxf%if' % (MaxDeviceLength, MaxChannels))
+
+SegmentPrefix = "readings."
+SegmentSuffix = ".log"
+
+_Missing = float('nan')
+
+
+# A reading read back from the log. Missing values are held as NaN.
+Reading = collections.namedtuple('Reading',
+                                 ['timestamp', 'device', 'sensor_type', 'sensor_instance',
+                                  'temperature', 'values'])
+
+
+def _segmentPath(directory, number):
+    return os.path.join(directory, "%s%08i%s" % (SegmentPrefix, number, SegmentSuffix))
+
+
+def _segmentFormat(header):
+    """
+    Return the format version, header size and record of a segment given
+    its first SegmentHeader.size bytes.
+    """
+    if len(header) < SegmentHeader.size or header[:len(SegmentMagic)] != SegmentMagic:
+        return 1, 0, LegacyRecord
+    magic, version = SegmentHeader.unpack_from(header)
+    if version != FormatVersion:
+        raise ValueError("Unsupported reading log format version %i" % version)
+    return version, SegmentHeader.size, Record
+
+
+def _segmentNumbers(directory):
+    """ Return the numbers of the segments in a log directory in order """
+    numbers = []
+    for name in os.listdir(directory):
+        if name.startswith(SegmentPrefix) and name.endswith(SegmentSuffix):
+            try:
+                numbers.append(int(name[len(SegmentPrefix):-len(SegmentSuffix)]))
+            except ValueError:
+                pass
+    numbers.sort()
+    return numbers
+
+
+if bytes is str:
+    def _deviceBytes(device):
+        return device
+
+    def _deviceText(device):
+        return device
+else:
+    def _deviceBytes(device):
+        """ Return a device identifier as the bytes stored in a record """
+        return device if isinstance(device, bytes) else device.encode('utf-8')
+
+    def _deviceText(device):
+        """ Return a device identifier read from a record as text """
+        return device.decode('utf-8', 'replace')
+
+
+def _number(value):
+    if value is None or value == "":
+        return _Missing
+    return float(value)
+
+
+class ReadingLog(object):
+    """
+    Append periodic readings to the segment files of a log directory.
+    """
+
+    def __init__(self, directory, clock=None, flush_count=100, flush_interval=1.0,
+                 segment_size=64 * 1024 * 1024):
+        """
+        @param directory: The log directory, created if it does not exist
+        @type directory: string
+        @param clock: The reactor used to schedule flushes. Defaults to the
+                      global reactor.
+        @param flush_count: The number of buffered records that triggers a flush
+        @type flush_count: int
+        @param flush_interval: The maximum seconds a record is buffered
+        @type flush_interval: float
+        @param segment_size: The size, in bytes, at which a new segment is started
+        @type segment_size: int
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.clock = clock
+        self.flush_count = flush_count
+        self.flush_interval = flush_interval
+        self.segment_size = SegmentHeader.size + max(1, (segment_size - SegmentHeader.size) // Record.size) * Record.size
+
+        self._buffer = bytearray()
+        self._buffered = 0
+        self._flushCall = None
+        self._segment = None
+        self._segmentNumber = None
+        self._openSegment()
+
+    def _openSegment(self):
+        """
+        Open the last segment for appending, or a new segment if the last one
+        is full. A partial record left by an interrupted write is discarded.
+        """
+        numbers = _segmentNumbers(self.directory)
+        if numbers:
+            number = numbers[-1]
+            path = _segmentPath(self.directory, number)
+            size = os.path.getsize(path)
+            with open(path, 'rb') as segment:
+                header = segment.read(SegmentHeader.size)
+            if size < SegmentHeader.size:
+                # Nothing but part of a header was written.
+                with open(path, 'r+b') as segment:
+                    segment.truncate(0)
+                self._openNewSegment(number)
+                return
+            version = _segmentFormat(header)[0]
+            if version != FormatVersion:
+                # Records are not appended to segments of an older format.
+                self._openNewSegment(number + 1)
+                return
+            records = size - SegmentHeader.size
+            if records % Record.size:
+                logging.warning("Discarding partial record at end of reading log segment %s" % path)
+                with open(path, 'r+b') as segment:
+                    segment.truncate(size - records % Record.size)
+            if size >= self.segment_size:
+                self._openNewSegment(number + 1)
+                return
+            self._segmentNumber = number
+            self._segment = open(path, 'ab')
+            self._segment.seek(0, os.SEEK_END)
+        else:
+            self._openNewSegment(0)
+
+    def _openNewSegment(self, number):
+        """ Start a segment, writing its header with the first records """
+        self._segmentNumber = number
+        self._segment = open(_segmentPath(self.directory, number), 'ab')
+        self._segment.write(SegmentHeader.pack(SegmentMagic, FormatVersion))
+
+    def device(self, device_id):
+        """
+        Return a DeviceReadingLog that appends the readings of a device, for
+        assignment to the readingLog attribute of a Monitor.
+        """
+        return DeviceReadingLog(self, device_id)
+
+    def append(self, timestamp, device, sensor_type, sensor_instance, temperature, values):
+        """
+        Add a reading to the log.
+
+        @param timestamp: The receipt time of the reading in seconds since the epoch
+        @type timestamp: float
+        @param device: The device identifier, truncated to MaxDeviceLength bytes
+        @type device: string
+        @param temperature: The temperature, which may be a numeric string or None
+        @param values: The channel values, which may be numeric strings or None.
+                       Only the first MaxChannels values are stored.
+        @type values: sequence
+        """
+        values = [_number(v) for v in values[:MaxChannels]]
+        count = len(values)
+        values.extend([_Missing] * (MaxChannels - count))
+        self._buffer.extend(Record.pack(timestamp, _deviceBytes(device)[:MaxDeviceLength], sensor_type, sensor_instance,
+                                        count, _number(temperature), *values))
+        self._buffered += 1
+        if self._buffered >= self.flush_count:
+            self.flush()
+        elif self._flushCall is None:
+            self._flushCall = self.clock.callLater(self.flush_interval, self._flushLater)
+
+    def _flushLater(self):
+        self._flushCall = None
+        self.flush()
+
+    def flush(self):
+        """ Write and fsync the buffered records """
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+
+        if not self._buffered or self._segment is None:
+            return
+
+        data = self._buffer
+        self._buffer = bytearray()
+        self._buffered = 0
+        while data:
+            room = self.segment_size - self._segment.tell()
+            if room <= 0:
+                self._segment.close()
+                self._openNewSegment(self._segmentNumber + 1)
+                room = self.segment_size - SegmentHeader.size
+            self._segment.write(data[:room])
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+            data = data[room:]
+
+    def close(self):
+        """ Flush the buffered records and close the log """
+        self.flush()
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+
+class DeviceReadingLog(object):
+    """
+    Append the periodic readings of a single device to a ReadingLog.
+    """
+
+    def __init__(self, log, device_id):
+        self.log = log
+        self.device_id = device_id
+
+    def append(self, timestamp, temperature, sensor_type, sensor_instance, sensor_data):
+        """
+        Add a reading, using the Monitor.periodicUpdateReceived argument
+        order, received at timestamp seconds since the epoch.
+        """
+        self.log.append(timestamp, self.device_id, sensor_type, sensor_instance, temperature, sensor_data)
+
+    def flush(self):
+        self.log.flush()
+
+
+class _MappedSegment(object):
+    """ A memory mapped log segment supporting lookup of record timestamps """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.count = 0
+        self.map = None
+        # The format of the segment, read once its header is written.
+        self.version = None
+        self.offset = 0
+        self.record_struct = None
+
+    def refresh(self):
+        """ Remap the segment if it has grown """
+        size = os.path.getsize(self.path)
+        if self.version is None:
+            if size < SegmentHeader.size:
+                return
+            with open(self.path, 'rb') as segment:
+                self.version, self.offset, self.record_struct = _segmentFormat(segment.read(SegmentHeader.size))
+        size -= (size - self.offset) % self.record_struct.size
+        if size == self.size:
+            return
+        self.close()
+        self.size = size
+        self.count = (size - self.offset) // self.record_struct.size
+        if self.count:
+            with open(self.path, 'rb') as segment:
+                self.map = mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.count
+
+    def position(self, index):
+        """ Return the byte offset of a record in the segment """
+        return self.offset + index * self.record_struct.size
+
+    def __getitem__(self, index):
+        # Return the timestamp of a record, allowing bisect to search the segment
+        return Timestamp.unpack_from(self.map, self.position(index))[0]
+
+    def record(self, index):
+        fields = self.record_struct.unpack_from(self.map, self.position(index))
+        timestamp, device, sensor_type, sensor_instance, count, temperature = fields[:6]
+        return Reading(timestamp, _deviceText(device.rstrip(b'\0')), sensor_type, sensor_instance,
+                       temperature, fields[6:6 + count])
+
+    def close(self):
+        # The map is released rather than closed as arrays returned by
+        # ReadingLogReader.toNumpy may still be viewing it. It is unmapped
+        # once the last reference to it is gone.
+        self.map = None
+
+
+class ReadingLogReader(object):
+    """
+    Answer time range queries over the segments of a log directory. Segments
+    written since the last query are picked up by each new query.
+    """
+
+    def __init__(self, directory):
+        """
+        @param directory: The log directory
+        @type directory: string
+        """
+        self.directory = directory
+        self._segments = []
+
+    def _refresh(self):
+        known = len(self._segments)
+        for number in _segmentNumbers(self.directory)[known:]:
+            self._segments.append(_MappedSegment(_segmentPath(self.directory, number)))
+        # Only the last known segment and any new segments can have grown.
+        for segment in self._segments[max(0, known - 1):]:
+            segment.refresh()
+
+    def between(self, start, end, device=None):
+        """
+        Return a generator of the Readings received from start up to, but
+        not including, end.
+
+        @param start: The start of the range in seconds since the epoch
+        @type start: float
+        @param end: The end of the range in seconds since the epoch
+        @type end: float
+        @param device: Only return readings from this device if supplied
+        @type device: string
+        """
+        self._refresh()
+        for segment in self._segments:
+            if not segment.count or segment[segment.count - 1] < start:
+                continue
+            if segment[0] >= end:
+                break
+            index = bisect.bisect_left(segment, start)
+            last = bisect.bisect_left(segment, end, index)
+            for index in range(index, last):
+                reading = segment.record(index)
+                if device is None or reading.device == device:
+                    yield reading
+
+    def toNumpy(self, start, end):
+        """
+        Return the records received from start up to, but not including, end
+        as a NumPy structured array, see txcurrentcost.arrays.ReadingLogDtype.
+        When the records are held in a single segment the array is a view of
+        the memory mapped segment and no data is copied.
+
+        Requires NumPy, see txcurrentcost.arrays.
+        """
+        from txcurrentcost import arrays
+        self._refresh()
+        parts = []
+        for segment in self._segments:
+            if not segment.count or segment[segment.count - 1] < start:
+                continue
+            if segment[0] >= end:
+                break
+            index = bisect.bisect_left(segment, start)
+            last = bisect.bisect_left(segment, end, index)
+            if last > index:
+                parts.append(arrays.readingLogArray(segment.map, segment.position(index), last - index,
+                                                    segment.version))
+        if not parts:
+            return arrays.readingLogArray(b'', 0, 0)
+        if len(parts) == 1:
+            return parts[0]
+        return arrays.numpy.concatenate(parts)
+
+    def close(self):
+        """ Unmap the segments """
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
@@ -0,0 +1,301 @@
+'''
+This module implements an in-memory store of the most recent periodic
+readings of each sensor, for answering queries such as the last readings
+of a sensor, the power on a channel over the last few minutes or the
+latest reading of every sensor.
+
+The readings of each sensor are kept in a ring of a fixed number of slots,
+allocated when the first reading of the sensor is stored, so the memory
+used by a sensor never grows. Each slot uses SlotSize bytes. The receipt
+times, temperatures and values of the readings are held in contiguous
+arrays in time order, so a query finds the start of a time range by a
+binary search and then reads only the readings it returns.
+
+Readings older than the retention period, before the time of a query, are
+ignored by queries and are overwritten as new readings arrive.
+'''
+
+import array
+import collections
+
+
+# A reading held by the store. The values are the power in watts on each
+# channel of an electricity sensor or the impulse count and impulses per
+# unit of an OptiSmart sensor. Missing values and temperatures are None.
+RecentReading = collections.namedtuple('RecentReading',
+                                       ['timestamp', 'temperature', 'sensor_type', 'sensor_instance', 'values'])
+
+
+# Marks a missing value in the arrays of a SensorReadings.
+_Missing = float('nan')
+
+
+def _number(value):
+    """ Return a value as a float, or _Missing if it was not reported """
+    if value is None or value == '':
+        return _Missing
+    return float(value)
+
+
+def _value(number):
+    """ Return a stored float, or None if it is _Missing """
+    if number != number:
+        return None
+    return number
+
+
+class SensorReadings(object):
+    """
+    A time ordered ring of the most recent readings of a single sensor.
+    """
+
+    __slots__ = ('sensor_type', 'sensor_instance', 'capacity', 'retention', 'channels',
+                 'count', '_next', '_timestamps', '_temperatures', '_values')
+
+    def __init__(self, sensor_type, sensor_instance, capacity, retention, channels=3):
+        """
+        @param capacity: The maximum number of readings held
+        @type capacity: int
+        @param retention: The seconds a reading is kept for
+        @type retention: float
+        @param channels: The maximum number of values in each reading
+        @type channels: int
+        """
+        self.sensor_type = sensor_type
+        self.sensor_instance = sensor_instance
+        self.capacity = capacity
+        self.retention = retention
+        self.channels = channels
+        # The number of readings held and the ring position of the next one.
+        self.count = 0
+        self._next = 0
+        self._timestamps = array.array('d', [0.0]) * capacity
+        self._temperatures = array.array('d', [_Missing]) * capacity
+        self._values = array.array('d', [_Missing]) * (capacity * channels)
+
+    def add(self, timestamp, temperature, values):
+        """
+        Add a reading. A reading timestamped before the newest reading is
+        stored at the time of the newest reading, so the ring stays in time
+        order if the clock is set back.
+
+        @param timestamp: The receipt time of the reading in seconds
+        @type timestamp: float
+        @param temperature: The temperature or None if it was not reported
+        @type temperature: float
+        @param values: The values of the reading, see RecentReading
+        @type values: sequence of numbers or numeric strings
+        """
+        if self.count and timestamp < self.newest:
+            timestamp = self.newest
+        position = self._next
+        self._timestamps[position] = timestamp
+        self._temperatures[position] = _number(temperature)
+        start = position * self.channels
+        for channel in range(self.channels):
+            self._values[start + channel] = _number(values[channel]) if channel < len(values) else _Missing
+        self._next = (position + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    @property
+    def newest(self):
+        """ The receipt time of the newest reading, or None if there are none """
+        if not self.count:
+            return None
+        return self._timestamps[self._position(self.count - 1)]
+
+    def _position(self, index):
+        """ Return the ring position of the reading at index, oldest first """
+        return (self._next - self.count + index) % self.capacity
+
+    def _bisect(self, timestamp):
+        """
+        Return the index of the oldest reading received at or after timestamp.
+        """
+        low, high = 0, self.count
+        timestamps = self._timestamps
+        while low < high:
+            middle = (low + high) // 2
+            if timestamps[self._position(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _reading(self, index):
+        position = self._position(index)
+        start = position * self.channels
+        values = self._values[start:start + self.channels]
+        count = self.channels
+        while count and values[count - 1] != values[count - 1]:
+            count -= 1
+        return RecentReading(self._timestamps[position],
+                             _value(self._temperatures[position]),
+                             self.sensor_type,
+                             self.sensor_instance,
+                             tuple(_value(value) for value in values[:count]))
+
+    def _retained(self, now):
+        """ Return the index of the oldest reading retained at time now """
+        if now is None:
+            now = self.newest
+        return self._bisect(now - self.retention)
+
+    def last(self, n, now=None):
+        """
+        Return up to n of the newest retained readings, oldest first.
+
+        @param now: The time of the query. Defaults to the newest reading.
+        """
+        if not self.count:
+            return []
+        first = max(self._retained(now), self.count - n)
+        return [self._reading(index) for index in range(first, self.count)]
+
+    def latest(self, now=None):
+        """
+        Return the newest reading, or None if no reading is retained.
+
+        @param now: The time of the query. Defaults to the newest reading.
+        """
+        readings = self.last(1, now)
+        return readings[0] if readings else None
+
+    def between(self, start, end):
+        """
+        Return the retained readings received from start up to but not
+        including end, oldest first.
+        """
+        if not self.count:
+            return []
+        first = max(self._bisect(start), self._retained(end))
+        return [self._reading(index) for index in range(first, self._bisect(end))]
+
+    def channel(self, channel, start, end):
+        """
+        Return the (timestamp, value) 2-tuples of the retained readings of a
+        channel received from start up to but not including end, oldest
+        first. Channels are numbered from 1. Readings without a value for
+        the channel are left out.
+        """
+        if not self.count or channel < 1 or channel > self.channels:
+            return []
+        first = max(self._bisect(start), self._retained(end))
+        samples = []
+        for index in range(first, self._bisect(end)):
+            position = self._position(index)
+            value = self._values[position * self.channels + channel - 1]
+            if value == value:
+                samples.append((self._timestamps[position], value))
+        return samples
+
+
+class RecentReadings(object):
+    """
+    Keep the most recent readings of every sensor.
+
+    Electricity sensors report the power on each channel and OptiSmart
+    sensors report the impulse count and impulses per unit. Channels are
+    numbered from 1, as in the periodic update message.
+    """
+
+    # The number of values held for each reading, enough for the three
+    # channels of an electricity sensor.
+    Channels = 3
+
+    # The bytes used by each slot of a SensorReadings ring, holding the
+    # timestamp, temperature and values of a reading.
+    SlotSize = (2 + Channels) * 8
+
+    def __init__(self, retention=3600.0, capacity=1024):
+        """
+        @param retention: The seconds a reading is kept for
+        @type retention: float
+        @param capacity: The maximum number of readings kept for each sensor.
+                         Current Cost devices report every 6 seconds so one
+                         hour of readings needs 600.
+        @type capacity: int
+        """
+        self.retention = float(retention)
+        self.capacity = capacity
+        self.sensors = {}
+
+    @classmethod
+    def forBudget(cls, budget, sensors=10, retention=3600.0):
+        """
+        Return a store whose rings use at most budget bytes in total when
+        readings are received from up to the given number of sensors.
+
+        @param budget: The memory budget in bytes
+        @type budget: int
+        @param sensors: The number of sensors the budget is shared between
+        @type sensors: int
+        """
+        return cls(retention, max(1, budget // (sensors * cls.SlotSize)))
+
+    def add(self, timestamp, temperature, sensor_type, sensor_instance, values):
+        """
+        Add the reading of a periodic update.
+
+        @param timestamp: The receipt time of the periodic update in seconds
+        @type timestamp: float
+        @param temperature: The temperature or None if it was not reported
+        @param values: The values of the reading, see RecentReading
+        @type values: sequence of numbers or numeric strings
+        """
+        key = (sensor_type, sensor_instance)
+        readings = self.sensors.get(key)
+        if readings is None:
+            readings = SensorReadings(sensor_type, sensor_instance, self.capacity,
+                                      self.retention, RecentReadings.Channels)
+            self.sensors[key] = readings
+        readings.add(timestamp, temperature, values)
+
+    def sensor(self, sensor_type, sensor_instance):
+        """
+        Return the SensorReadings of a sensor or None if no readings have
+        been received from it.
+        """
+        return self.sensors.get((sensor_type, sensor_instance))
+
+    def last(self, sensor_type, sensor_instance, n, now=None):
+        """
+        Return up to n of the newest readings of a sensor, oldest first.
+
+        @param now: The time of the query. Defaults to the newest reading
+                    of the sensor.
+        """
+        readings = self.sensor(sensor_type, sensor_instance)
+        if readings is None:
+            return []
+        return readings.last(n, now)
+
+    def channel(self, sensor_type, sensor_instance, channel, seconds, now):
+        """
+        Return the (timestamp, value) 2-tuples of a sensor channel over the
+        given number of seconds before now, oldest first.
+
+        @param now: The time of the query in seconds, e.g. the monitor clock time
+        @type now: float
+        """
+        readings = self.sensor(sensor_type, sensor_instance)
+        if readings is None:
+            return []
+        # Include a reading received at the time of the query.
+        return readings.channel(channel, now - seconds, now + 1e-6)
+
+    def latest(self, now=None):
+        """
+        Return the newest retained reading of every sensor, keyed by
+        (sensor type, sensor instance) 2-tuples.
+
+        @param now: The time of the query. Defaults to the newest reading
+                    of each sensor.
+        """
+        latest = {}
+        for key, readings in self.sensors.items():
+            reading = readings.latest(now)
+            if reading is not None:
+                latest[key] = reading
+        return latest
@@ -0,0 +1,345 @@
+'''
+This module implements a replacement for the FixedSerialPort that feeds a
+CurrentCostDataProtocol from a recorded message stream or from a simulated
+Current Cost device. This allows a Monitor to be run without hardware, for
+example in tests or when measuring throughput.
+
+A message source is any iterable of (delay, line) 2-tuples where delay is
+the number of seconds to wait after the previous message before delivering
+the line. A captured log can be replayed using readCapturedLog and synthetic
+traffic can be generated using a DeviceSimulator.
+
+Messages can be replayed in real time (speed=1.0), accelerated (speed=N) or
+as fast as possible (speed=None). All scheduling is done using the reactor
+passed to the port so a twisted.internet.task.Clock can be used to drive the
+replay, and any history cycle timeouts of a Monitor using the same clock,
+from tests.
+
+For example, to run a Monitor against a simulated device:
+
+    clock = task.Clock()
+    monitor = Monitor(config, clock)
+    monitor.portFactory = ReplayPortFactory(DeviceSimulator(sensor_count=3))
+    monitor.start()
+    clock.advance(60)
+'''
+
+import datetime
+import logging
+import random
+from twisted.internet import defer, error
+from twisted.python import failure
+
+
+if bytes is str:
+    def _lineBytes(line):
+        return line + "\n"
+else:
+    def _lineBytes(line):
+        """ Return a message line as the bytes received from a serial port """
+        if isinstance(line, str):
+            line = line.encode('latin-1')
+        return line + b"\n"
+
+
+def readCapturedLog(path, interval=6.0):
+    """
+    Read the messages from a captured log file.
+
+    Each line of the log holds one raw Current Cost message. A line may be
+    prefixed by the time it was received, in seconds since the epoch,
+    followed by a tab character. The time between timestamped messages is
+    preserved. Messages without a timestamp are separated by interval
+    seconds, the rate at which a Current Cost device sends periodic updates.
+
+    @param path: The path of the captured log file
+    @type path: string
+    @param interval: The delay used for messages without a timestamp
+    @type interval: float
+
+    @return: A generator of (delay, line) 2-tuples
+    """
+    first = True
+    lastTimestamp = None
+    with open(path) as log:
+        for line in log:
+            line = line.rstrip("\r\n")
+            if not line:
+                continue
+
+            timestamp, message = None, line
+            prefix, sep, rest = line.partition("\t")
+            if sep:
+                try:
+                    timestamp, message = float(prefix), rest
+                except ValueError:
+                    pass
+
+            if first:
+                delay = 0.0
+            elif timestamp is not None and lastTimestamp is not None:
+                delay = max(0.0, timestamp - lastTimestamp)
+            else:
+                delay = interval
+            first = False
+            lastTimestamp = timestamp
+            yield delay, message
+
+
+class DeviceSimulator(object):
+    """
+    Generate the messages a Current Cost device would send.
+
+    The simulator emits periodic update messages for each sensor in turn,
+    each sensor reporting once per interval. Sensor 0 is the whole house
+    sensor reporting one value per clamp while the other sensors are
+    individual appliance monitors with a single channel. About one minute
+    past every odd hour of simulated time the simulator emits a history
+    update message cycle holding the full complement of hour, day, month
+    and year history for every sensor.
+
+    Iterating over a simulator returns (delay, line) 2-tuples suitable for
+    use as a ReplayPort message source.
+    """
+
+    # The number of history datapoints of each kind placed in one message.
+    HistoryTagsPerMessage = 4
+
+    def __init__(self, sensor_count=1, clamp_count=1, interval=6.0, history=True,
+                 history_interval=0.2, start=None, duration=None, seed=None):
+        """
+        @param sensor_count: The number of sensors, including the whole house sensor
+        @type sensor_count: int
+        @param clamp_count: The number of clamps attached to the whole house sensor
+        @type clamp_count: int
+        @param interval: The seconds between periodic updates from each sensor
+        @type interval: float
+        @param history: Whether history update message cycles are emitted
+        @type history: bool
+        @param history_interval: The seconds between history update messages
+        @type history_interval: float
+        @param start: The simulated wall clock time of the first message
+        @type start: datetime.datetime
+        @param duration: The number of seconds of traffic to simulate, forever if None
+        @type duration: float
+        @param seed: Seed for the generated sensor readings
+        """
+        self.sensor_count = sensor_count
+        self.clamp_count = clamp_count
+        self.interval = interval
+        self.history = history
+        self.history_interval = history_interval
+        self.start = start or datetime.datetime.now().replace(microsecond=0)
+        self.duration = duration
+        self.random = random.Random(seed)
+
+        self.source = "CC128-v0.11"
+        self.days_since_birth = 89
+        self.temperature = 19.0
+        self.watts = [[self.random.randint(0, 3000) for _ in range(clamp_count if sensor == 0 else 1)]
+                      for sensor in range(sensor_count)]
+
+    def __iter__(self):
+        return self.messages()
+
+    def messages(self):
+        """
+        Return a generator of (delay, line) 2-tuples.
+        """
+        step = self.interval / self.sensor_count
+        nextPeriodic = 0.0
+        nextHistory = self._firstHistoryCycle()
+        sensor = 0
+        historyMessages = []
+        last = 0.0
+
+        while True:
+            if self.history and not historyMessages and nextHistory <= nextPeriodic:
+                when = self.start + datetime.timedelta(seconds=nextHistory)
+                historyMessages = [(nextHistory + n * self.history_interval, line)
+                                   for n, line in enumerate(self.historyCycle(when))]
+                historyMessages.reverse()
+                nextHistory += 2 * 3600
+
+            if historyMessages and historyMessages[-1][0] <= nextPeriodic:
+                elapsed, line = historyMessages.pop()
+            else:
+                elapsed = nextPeriodic
+                line = self.periodicUpdate(self.start + datetime.timedelta(seconds=elapsed), sensor)
+                sensor = (sensor + 1) % self.sensor_count
+                nextPeriodic += step
+
+            if self.duration is not None and elapsed > self.duration:
+                return
+
+            yield elapsed - last, line
+            last = elapsed
+
+    def _firstHistoryCycle(self):
+        """
+        Return the seconds from the start until one minute past the next odd hour.
+        """
+        cycle = self.start.replace(minute=1, second=0, microsecond=0)
+        if cycle.hour % 2 == 0:
+            cycle += datetime.timedelta(hours=1)
+        while cycle < self.start:
+            cycle += datetime.timedelta(hours=2)
+        delta = cycle - self.start
+        return delta.days * 86400 + delta.seconds
+
+    def _header(self, when):
+        return "<src>%s</src><dsb>%05i</dsb><time>%s</time>" % (self.source,
+                                                               self.days_since_birth,
+                                                               when.strftime("%H:%M:%S"))
+
+    def periodicUpdate(self, when, sensor):
+        """
+        Return a periodic update message line for a sensor.
+        """
+        self.temperature = min(30.0, max(10.0, self.temperature + self.random.choice((-0.1, 0.0, 0.0, 0.1))))
+        channels = []
+        for channel, watts in enumerate(self.watts[sensor]):
+            watts = min(99999, max(0, watts + self.random.randint(-50, 50)))
+            self.watts[sensor][channel] = watts
+            channels.append("<ch%i><watts>%05i</watts></ch%i>" % (channel + 1, watts, channel + 1))
+
+        return "<msg>%s<tmpr>%.1f</tmpr><sensor>%i</sensor><id>%05i</id><type>1</type>%s</msg>" % (
+            self._header(when), self.temperature, sensor, 1000 + sensor, "".join(channels))
+
+    def historyCycle(self, when):
+        """
+        Return the history update message lines of a history update cycle.
+        """
+        tags = ["h%03i" % n for n in range(4, 745, 2)]
+        tags.extend("d%03i" % n for n in range(1, 91))
+        tags.extend("m%03i" % n for n in range(1, 85))
+        tags.extend("y%03i" % n for n in range(1, 5))
+
+        messages = []
+        for n in range(0, len(tags), DeviceSimulator.HistoryTagsPerMessage):
+            chunk = tags[n:n + DeviceSimulator.HistoryTagsPerMessage]
+            data = []
+            for sensor in range(self.sensor_count):
+                values = "".join("<%s>%05.1f</%s>" % (tag, self.random.random() * 10, tag) for tag in chunk)
+                data.append("<data><sensor>%i</sensor>%s</data>" % (sensor, values))
+            messages.append("<msg>%s<hist><dsw>%05i</dsw><type>1</type><units>kwhr</units>%s</hist></msg>" % (
+                self._header(when), self.days_since_birth, "".join(data)))
+        return messages
+
+
+class ReplayPort(object):
+    """
+    Deliver messages from a message source to a protocol as if they were
+    received from a serial port.
+
+    The finished attribute holds a Deferred that fires once the message
+    source is exhausted or the port is closed.
+    """
+
+    # The number of messages delivered at once when replaying as fast as
+    # possible before giving other events a chance to run.
+    chunkSize = 100
+
+    def __init__(self, protocol, source, clock, speed=1.0):
+        """
+        @param protocol: The protocol that messages are delivered to
+        @param source: An iterable of (delay, line) 2-tuples
+        @param clock: The reactor used to schedule message delivery
+        @param speed: The replay speed multiplier or None to replay as fast as possible
+        @type speed: float
+        """
+        self.protocol = protocol
+        self.source = iter(source)
+        self.clock = clock
+        self.speed = speed
+        self.connected = True
+        self.disconnecting = False
+        self.finished = defer.Deferred()
+        self._delayedCall = None
+        self._pending = None
+        # The clock time the pending message is due. Delays accumulate from
+        # the time the port was opened so that replay timing does not drift.
+        self._due = None
+
+        self.protocol.makeConnection(self)
+        self._scheduleNext()
+
+    def _scheduleNext(self):
+        """
+        Schedule the delivery of the next message from the source.
+        """
+        if self.speed is None:
+            self._delayedCall = self.clock.callLater(0, self._deliverChunk)
+            return
+
+        try:
+            delay, self._pending = next(self.source)
+        except StopIteration:
+            self._finish(error.ConnectionDone("Message source exhausted"))
+            return
+        if self._due is None:
+            self._due = self.clock.seconds()
+        self._due += delay / self.speed
+        self._delayedCall = self.clock.callLater(max(0.0, self._due - self.clock.seconds()),
+                                                 self._deliverPending)
+
+    def _deliverPending(self):
+        self._delayedCall = None
+        self.protocol.dataReceived(_lineBytes(self._pending))
+        if self.connected:
+            self._scheduleNext()
+
+    def _deliverChunk(self):
+        self._delayedCall = None
+        for _ in range(self.chunkSize):
+            try:
+                _, line = next(self.source)
+            except StopIteration:
+                self._finish(error.ConnectionDone("Message source exhausted"))
+                return
+            self.protocol.dataReceived(_lineBytes(line))
+            if not self.connected:
+                return
+        self._scheduleNext()
+
+    def _finish(self, reason):
+        if not self.connected:
+            return
+        self.connected = False
+        if self._delayedCall is not None and self._delayedCall.active():
+            self._delayedCall.cancel()
+        self._delayedCall = None
+        logging.debug("%s finished: %s" % (self.__class__.__name__, reason))
+        self.protocol.connectionLost(failure.Failure(reason))
+        self.finished.callback(None)
+
+    def write(self, data):
+        """ Data written to the device is discarded """
+        pass
+
+    def loseConnection(self):
+        """ Stop delivering messages """
+        self._finish(error.ConnectionDone("Replay stopped"))
+
+    def close(self):
+        """ Close the replay port """
+        self.loseConnection()
+
+
+class ReplayPortFactory(object):
+    """
+    Create ReplayPort instances using the same arguments used to create a
+    FixedSerialPort so that it can be used as a Monitor portFactory.
+    """
+
+    def __init__(self, source, speed=1.0):
+        """
+        @param source: An iterable of (delay, line) 2-tuples
+        @param speed: The replay speed multiplier or None to replay as fast as possible
+        @type speed: float
+        """
+        self.source = source
+        self.speed = speed
+
+    def __call__(self, protocol, port, clock, baudrate=None):
+        return ReplayPort(protocol, self.source, clock, self.speed)
@@ -0,0 +1,42 @@
+'''
+This module implements the Twisted serial port and protocol used to
+communicate with a Current Cost device.
+'''
+
+import logging
+from twisted.internet import protocol
+from twisted.internet.serialport import SerialPort
+from txcurrentcost.core import CurrentCostMessageReceiver
+
+
+class FixedSerialPort(SerialPort):
+    '''
+    My current Cost EnviR is connected to my computer using
+    a serial over USB connection. USB devices can be
+    disconnected or reset at any time. Ensure the delivery
+    of the connectionLost event.
+
+    See: http://stackoverflow.com/questions/3678661/twisteds-serialport-and-disappearing-serial-port-devices
+    '''
+    def connectionLost(self, reason):
+        super(FixedSerialPort, self).connectionLost(reason)
+        self.protocol.connectionLost(reason)
+
+    def close(self):
+        """ Close the serial port """
+        if self.protocol.transport:
+            self.protocol.transport.loseConnection()
+
+
+class CurrentCostDataProtocol(CurrentCostMessageReceiver, protocol.Protocol):
+    """
+    Receive CurrentCost messages from a Twisted transport, such as a
+    FixedSerialPort. See CurrentCostMessageReceiver.
+    """
+
+    def connectionMade(self):
+        logging.debug("%s connection made!" % self.__class__.__name__)
+
+    def connectionLost(self, reason):
+        logging.debug("%s connection lost!" % self.__class__.__name__)
+        self.framer.clear()
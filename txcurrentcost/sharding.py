@@ -0,0 +1,605 @@
+'''
+This module implements sharded ingestion, which monitors many Current Cost
+devices using several worker processes.
+
+Each worker process monitors its own shard of the devices using a
+MonitorPool running in its own reactor, so framing, decoding and history
+assembly for one shard never delay another. Workers publish each periodic
+reading into a ReadingRing, a fixed size ring of slots in a memory mapped
+file shared with the aggregating process, so readings are passed between
+processes without being pickled or serialized per message. The aggregator
+polls the rings of every shard and delivers the readings, tagged with the
+device identifier, to periodicReadingReceived.
+
+Completed history message cycles arrive once every two hours so they are
+sent to the aggregator as JSON over the standard output of the worker and
+delivered to historyUpdateReceived.
+
+A worker that exits or crashes only interrupts the devices of its own
+shard. It is restarted after a delay that doubles with each consecutive
+failure up to max_delay. Readings already published to the ring of the
+shard are kept.
+
+To monitor the devices of a MonitorPoolConfig using four worker processes:
+
+    class Ingest(ShardedMonitorPool):
+        def periodicReadingReceived(self, device_id, reading):
+            print(device_id, reading.watts)
+
+    pool = Ingest(config, shards=4)
+    pool.start()
+    reactor.run()
+
+Each ring has a single writer, the worker, and a single reader, the
+aggregator. The writer stores a slot before advancing the write count and
+the reader reads the slots before advancing the read count. Each slot also
+holds a sequence number, made odd by the writer while it stores the slot
+and even, for the reading the slot holds, once it is done. The reader only
+takes a reading whose sequence number is the same before and after it is
+read and matches the reading expected, so a slot whose stores have not all
+become visible to the aggregator yet is left for the next poll rather than
+read torn, whatever order the processor makes the stores visible in.
+'''
+
+import datetime
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from twisted.internet import defer, protocol, task
+from txcurrentcost.core import Sensors, SensorHistoryData
+from txcurrentcost.decoder import PeriodicReading
+from txcurrentcost.pool import DeviceConfig, MonitorPool, PooledMonitor
+
+
+class ReadingRing(object):
+    """
+    A fixed size ring of periodic readings held in a memory mapped file,
+    written by one process and read by another.
+
+    The file starts with a header holding a magic number, the capacity in
+    slots, the number of readings ever written, the number ever read and
+    the number dropped because the ring was full. A reading is kept in a
+    slot holding its sequence number, timestamps, temperature, up to three
+    values, the index of the device within its shard, the sensor type and
+    instance and the number of values.
+    """
+
+    Magic = b'CCRR'
+    Header = struct.Struct('<4sIQQQ')
+    Slot = struct.Struct('<Q' 'dddddd' 'HBBB3x')
+    Count = struct.Struct('<Q')
+
+    # Offsets of the header fields updated while the ring is in use.
+    WriteOffset = 8
+    ReadOffset = 16
+    DroppedOffset = 24
+
+    def __init__(self, path, capacity=None):
+        """
+        @param path: The path of the file holding the ring
+        @type path: string
+        @param capacity: The number of readings the ring holds. The file is
+                         created when a capacity is given, otherwise an
+                         existing ring is opened.
+        @type capacity: int
+        """
+        self.path = path
+        if capacity is not None:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.ftruncate(fd, ReadingRing.Header.size + capacity * ReadingRing.Slot.size)
+        else:
+            fd = os.open(path, os.O_RDWR)
+        try:
+            self.map = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+
+        if capacity is not None:
+            ReadingRing.Header.pack_into(self.map, 0, ReadingRing.Magic, capacity, 0, 0, 0)
+        magic, self.capacity, _, _, _ = ReadingRing.Header.unpack_from(self.map, 0)
+        if magic != ReadingRing.Magic:
+            raise Exception("Invalid reading ring: %s" % path)
+
+    @property
+    def dropped(self):
+        """ The number of readings dropped because the ring was full """
+        return ReadingRing.Count.unpack_from(self.map, ReadingRing.DroppedOffset)[0]
+
+    def __len__(self):
+        written = ReadingRing.Count.unpack_from(self.map, ReadingRing.WriteOffset)[0]
+        read = ReadingRing.Count.unpack_from(self.map, ReadingRing.ReadOffset)[0]
+        return written - read
+
+    def put(self, device, reading):
+        """
+        Write a periodic reading to the ring. The reading is dropped if the
+        ring is full.
+
+        @param device: The index of the device within its shard
+        @type device: int
+        @param reading: The reading
+        @type reading: txcurrentcost.decoder.PeriodicReading
+
+        @return: False if the reading was dropped
+        """
+        written = ReadingRing.Count.unpack_from(self.map, ReadingRing.WriteOffset)[0]
+        read = ReadingRing.Count.unpack_from(self.map, ReadingRing.ReadOffset)[0]
+        if written - read >= self.capacity:
+            ReadingRing.Count.pack_into(self.map, ReadingRing.DroppedOffset, self.dropped + 1)
+            return False
+
+        if reading.sensor_type == Sensors.ElectricitySensor:
+            values = reading.watts[:3]
+        else:
+            values = (reading.impulses, reading.impulses_per_unit)
+        count = len(values)
+        values = [_Missing if value is None else value for value in values]
+        values.extend([_Missing] * (3 - count))
+        temperature = _Missing if reading.temperature is None else reading.temperature
+
+        offset = ReadingRing.Header.size + (written % self.capacity) * ReadingRing.Slot.size
+        ReadingRing.Count.pack_into(self.map, offset, 2 * written + 1)
+        ReadingRing.Slot.pack_into(self.map, offset, 2 * written + 1,
+                                   reading.timestamp, reading.monotonic, temperature,
+                                   values[0], values[1], values[2],
+                                   device, reading.sensor_type, reading.sensor_instance, count)
+        ReadingRing.Count.pack_into(self.map, offset, 2 * written + 2)
+        ReadingRing.Count.pack_into(self.map, ReadingRing.WriteOffset, written + 1)
+        return True
+
+    def drain(self):
+        """
+        Read every reading waiting in the ring. Reading stops at a slot
+        that is still being stored, which is read by the next drain.
+
+        @return: A list of (device index, PeriodicReading) 2-tuples
+        """
+        written = ReadingRing.Count.unpack_from(self.map, ReadingRing.WriteOffset)[0]
+        read = ReadingRing.Count.unpack_from(self.map, ReadingRing.ReadOffset)[0]
+        readings = []
+        for n in range(read, written):
+            offset = ReadingRing.Header.size + (n % self.capacity) * ReadingRing.Slot.size
+            (sequence, timestamp, monotonic, temperature, value0, value1, value2,
+             device, sensor_type, sensor_instance, count) = ReadingRing.Slot.unpack_from(self.map, offset)
+            if sequence != 2 * n + 2 or ReadingRing.Count.unpack_from(self.map, offset)[0] != sequence:
+                written = n
+                break
+            if temperature != temperature:
+                temperature = None
+            if sensor_type == Sensors.ElectricitySensor:
+                reading = PeriodicReading(timestamp, monotonic, temperature, sensor_type, sensor_instance,
+                                          watts=tuple(int(value) for value in (value0, value1, value2)[:count]))
+            else:
+                reading = PeriodicReading(timestamp, monotonic, temperature, sensor_type, sensor_instance,
+                                          impulses=None if value0 != value0 else int(value0),
+                                          impulses_per_unit=None if value1 != value1 else int(value1))
+            readings.append((device, reading))
+        ReadingRing.Count.pack_into(self.map, ReadingRing.ReadOffset, written)
+        return readings
+
+    def close(self):
+        """ Unmap the ring """
+        self.map.close()
+
+
+# Marks a missing value in a ring slot.
+_Missing = float('nan')
+
+
+def _historyToJson(device, sensor_type, sensorHistoryData):
+    """
+    Encode a completed history message cycle of the device with the given
+    index within its shard as a line of JSON.
+    """
+    sensors = []
+    for sensor_instance, sensorHistory in sensorHistoryData.items():
+        last_update = sensorHistory.last_update
+        if last_update is not None:
+            last_update = list(last_update.timetuple()[:6]) + [last_update.microsecond]
+        sensors.append({'instance': sensor_instance,
+                        'units': sensorHistory.units,
+                        'last_update': last_update,
+                        'data': (sensorHistory.getHourData() + sensorHistory.getDayData() +
+                                 sensorHistory.getMonthData() + sensorHistory.getYearData())})
+    return json.dumps({'device': device, 'type': sensor_type, 'sensors': sensors}) + '\n'
+
+
+def _historyFromJson(line):
+    """
+    Decode a completed history message cycle encoded by _historyToJson.
+
+    @return: A (device index, sensor_type, sensorHistoryData) 3-tuple
+    """
+    cycle = json.loads(line)
+    sensor_type = cycle['type']
+    sensorHistoryData = {}
+    for sensor in cycle['sensors']:
+        sensorHistory = SensorHistoryData(sensor_type, sensor['instance'], sensor['units'])
+        last_update = sensor['last_update']
+        if last_update is not None:
+            last_update = datetime.datetime(*last_update)
+        sensorHistory.storeDataPoints(last_update, sensor['data'])
+        sensorHistory.buildIndex()
+        sensorHistoryData[sensor['instance']] = sensorHistory
+    return cycle['device'], sensor_type, sensorHistoryData
+
+
+class _ShardMonitor(PooledMonitor):
+    """
+    A Monitor for a device within the shard of a worker process.
+    """
+
+    def __init__(self, config, pool, clock=None):
+        super(_ShardMonitor, self).__init__(config, pool, clock)
+        self.typedReadings = True
+        self.device = pool.deviceIndex[config.device_id]
+
+    def periodicReadingReceived(self, reading):
+        self.pool.ring.put(self.device, reading)
+
+
+class _ShardPool(MonitorPool):
+    """
+    The MonitorPool of a worker process. Readings are written to the ring
+    of the shard and history cycles to the standard output.
+    """
+
+    monitorFactory = _ShardMonitor
+
+    def __init__(self, config, ring, clock=None):
+        self.ring = ring
+        self.output = None
+        self.deviceIndex = dict((device.device_id, n) for n, device in enumerate(config.devices))
+        super(_ShardPool, self).__init__(config, clock)
+
+    def historyUpdateReceived(self, device_id, sensor_type, sensorHistoryData):
+        if self.output is not None:
+            self.output.write(_historyToJson(self.deviceIndex[device_id], sensor_type, sensorHistoryData).encode('utf-8'))
+
+
+class _ShardConfig(object):
+    """ The devices of a shard """
+
+    def __init__(self, devices):
+        self.devices = [DeviceConfig(**device) for device in devices]
+
+
+def _runWorker(ring_path, options):
+    """
+    Monitor the devices of a shard until the standard input of the worker
+    process is closed.
+
+    @param ring_path: The path of the ring readings are written to
+    @type ring_path: string
+    @param options: The JSON encoded devices and options of the shard
+    @type options: string
+    """
+    from twisted.internet import reactor, stdio
+
+    options = json.loads(options)
+    # Log records are passed to the aggregator prefixed with their level.
+    logging.basicConfig(level=options['log_level'], stream=sys.stderr,
+                        format='%(levelno)i %(message)s')
+
+    pool = _ShardPool(_ShardConfig(options['devices']), ReadingRing(ring_path), reactor)
+    if options['reconnect'] is not None:
+        pool.enableReconnection(*options['reconnect'])
+    control = _WorkerControl(reactor)
+    stdio.StandardIO(control)
+    pool.output = control.transport
+    reactor.callWhenRunning(pool.start)
+    reactor.addSystemEventTrigger('before', 'shutdown', pool.stop)
+    reactor.run()
+
+
+class _WorkerControl(protocol.Protocol):
+    """ Stop a worker process when the aggregator closes its standard input """
+
+    def __init__(self, reactor):
+        self.reactor = reactor
+
+    def connectionLost(self, reason):
+        if self.reactor.running:
+            self.reactor.stop()
+
+
+class _WorkerProcess(protocol.ProcessProtocol):
+    """ Pass on the history cycles and log records written by a worker process """
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.output = b''
+        self.errors = b''
+
+    def outReceived(self, data):
+        self.output += data
+        lines = self.output.split(b'\n')
+        self.output = lines.pop()
+        for line in lines:
+            self.worker._historyReceived(line)
+
+    def errReceived(self, data):
+        self.errors += data
+        lines = self.errors.split(b'\n')
+        self.errors = lines.pop()
+        for line in lines:
+            self.worker._logReceived(line.decode('utf-8', 'replace'))
+
+    def processEnded(self, reason):
+        self.worker._processEnded(reason)
+
+
+class ShardWorker(object):
+    """
+    A worker process monitoring one shard of the devices of a
+    ShardedMonitorPool.
+    """
+
+    def __init__(self, pool, shard, devices, ring):
+        """
+        @param pool: The pool the worker belongs to
+        @type pool: a ShardedMonitorPool instance
+        @param shard: The index of the shard
+        @type shard: int
+        @param devices: The devices of the shard
+        @type devices: list of DeviceConfig objects
+        @param ring: The ring the worker writes readings to
+        @type ring: a ReadingRing instance
+        """
+        self.pool = pool
+        self.shard = shard
+        self.devices = devices
+        self.device_ids = [device.device_id for device in devices]
+        self.ring = ring
+        self.process = None
+        self.restarts = 0
+        self._failures = 0
+        self._started = None
+        self._restartCall = None
+        self._ended = None
+
+    @property
+    def running(self):
+        """ True while the worker process is running """
+        return self.process is not None
+
+    def start(self):
+        """ Start the worker process """
+        self._restartCall = None
+        options = json.dumps({'devices': [device.__dict__ for device in self.devices],
+                              'reconnect': self.pool.reconnectDelays,
+                              'log_level': logging.getLogger().getEffectiveLevel()})
+        self._started = self.pool.reactor.seconds()
+        self.process = self.pool.reactor.spawnProcess(_WorkerProcess(self), sys.executable,
+                                                      [sys.executable, '-m', 'txcurrentcost.sharding',
+                                                       self.ring.path, options],
+                                                      env=self.pool.environment())
+        logging.info("Started worker %i for shard %i" % (self.process.pid, self.shard))
+
+    def stop(self):
+        """
+        Stop the worker process.
+
+        @return: A Deferred that fires once the worker process has ended
+        """
+        if self._restartCall is not None and self._restartCall.active():
+            self._restartCall.cancel()
+        self._restartCall = None
+        if self.process is None:
+            return defer.succeed(None)
+        self._ended = defer.Deferred()
+        self.process.closeStdin()
+        return self._ended
+
+    def _historyReceived(self, line):
+        try:
+            device, sensor_type, sensorHistoryData = _historyFromJson(line.decode('utf-8'))
+        except Exception as ex:
+            logging.error("Problem decoding history from shard %i" % self.shard)
+            logging.exception(ex)
+            return
+        self.pool._historyReceived(self.device_ids[device], sensor_type, sensorHistoryData)
+
+    def _logReceived(self, line):
+        level, _, message = line.partition(' ')
+        try:
+            level = int(level)
+        except ValueError:
+            # Output not written by the logging module, such as a traceback.
+            level, message = logging.ERROR, line
+        logging.log(level, "shard %i: %s" % (self.shard, message))
+
+    def _processEnded(self, reason):
+        self.process = None
+        # Publish anything the worker wrote before it ended.
+        self.pool.poll()
+        if self._ended is not None:
+            ended, self._ended = self._ended, None
+            ended.callback(None)
+            return
+
+        now = self.pool.reactor.seconds()
+        if now - self._started >= self.pool.max_delay:
+            self._failures = 0
+        self._failures += 1
+        delay = min(self.pool.initial_delay * 2 ** (self._failures - 1), self.pool.max_delay)
+        logging.error("Worker for shard %i ended, restarting in %.2f seconds: %s" % (
+            self.shard, delay, reason.getErrorMessage()))
+        self.restarts += 1
+        self._restartCall = self.pool.reactor.callLater(delay, self.start)
+
+
+class ShardedMonitorPool(object):
+    """
+    Monitor many current cost devices using a pool of worker processes, each
+    monitoring a shard of the devices.
+
+    Periodic readings are delivered through periodicReadingReceived as
+    txcurrentcost.decoder.PeriodicReading objects and completed history
+    message cycles through historyUpdateReceived, tagged with the device
+    identifier.
+
+    The pool expects a MonitorPoolConfig object passed to it as the config
+    argument but any object providing a devices attribute holding a list
+    of DeviceConfig objects will suffice. Devices are assigned to the shards
+    in turn.
+    """
+
+    def __init__(self, config, shards=2, reactor=None, capacity=4096, poll_interval=0.02,
+                 initial_delay=0.1, max_delay=5.0, directory=None):
+        """
+        @param config: A MonitorPoolConfig instance holding configuration settings
+        @type config: a MonitorPoolConfig instance
+        @param shards: The number of worker processes
+        @type shards: int
+        @param reactor: The reactor used to run the worker processes and poll
+                        the rings. Defaults to the global reactor.
+        @param capacity: The number of readings held by the ring of each shard
+        @type capacity: int
+        @param poll_interval: The seconds between polls of the rings
+        @type poll_interval: float
+        @param initial_delay: The seconds before a failed worker is first restarted
+        @type initial_delay: float
+        @param max_delay: The maximum seconds before a failed worker is restarted.
+                          Consecutive failures are counted until a worker runs
+                          for this long.
+        @type max_delay: float
+        @param directory: The directory holding the ring files. Defaults to
+                          /dev/shm, where available, so the rings are held in
+                          memory, otherwise the temporary directory.
+        @type directory: string
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self.config = config
+        self.reactor = reactor
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        if directory is None:
+            directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        self.directory = directory
+        self.reconnectDelays = None
+
+        device_ids = set()
+        for device in config.devices:
+            if device.device_id in device_ids:
+                raise Exception("Duplicate device identifier: %s" % device.device_id)
+            device_ids.add(device.device_id)
+        shards = max(1, min(shards, len(config.devices)))
+        self.shardDevices = [config.devices[shard::shards] for shard in range(shards)]
+        self.workers = []
+        self._poller = None
+
+    def enableReconnection(self, initial_delay=0.05, max_delay=1.0):
+        """
+        Reopen the serial port of any device whenever it is lost, see
+        txcurrentcost.monitor.Monitor.enableReconnection. Call this before
+        starting the pool.
+        """
+        self.reconnectDelays = (initial_delay, max_delay)
+
+    def environment(self):
+        """
+        Return the environment of the worker processes, which import this
+        package from the same location as the aggregator.
+        """
+        environment = dict(os.environ)
+        location = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        path = environment.get('PYTHONPATH')
+        environment['PYTHONPATH'] = location if not path else os.pathsep.join([location, path])
+        return environment
+
+    def periodicReadingReceived(self, device_id, reading):
+        """
+        Called to notify receipt of a periodic update message from any device.
+
+        @param device_id: The identifier of the device that sent the message
+        @type device_id: string
+        @param reading: The numeric values of the message
+        @type reading: txcurrentcost.decoder.PeriodicReading
+
+        Implement this method to handle data in the way you want.
+        """
+        pass
+
+    def historyUpdateReceived(self, device_id, sensor_type, sensorHistoryData):
+        """
+        Called to notify the completion of a history update message cycle from
+        any device, see txcurrentcost.pool.MonitorPool.historyUpdateReceived.
+
+        Implement this method to handle data in the way you want.
+        """
+        pass
+
+    @property
+    def droppedReadings(self):
+        """ The number of readings dropped because the ring of a shard was full """
+        return sum(worker.ring.dropped for worker in self.workers)
+
+    def start(self):
+        """
+        Create the rings and start a worker process for each shard.
+        """
+        logging.info('ShardedMonitorPool starting %i workers' % len(self.shardDevices))
+        for shard, devices in enumerate(self.shardDevices):
+            path = os.path.join(self.directory, "txcurrentcost-%i-%i.ring" % (os.getpid(), shard))
+            worker = ShardWorker(self, shard, devices, ReadingRing(path, self.capacity))
+            self.workers.append(worker)
+            worker.start()
+        self._poller = task.LoopingCall(self.poll)
+        self._poller.clock = self.reactor
+        self._poller.start(self.poll_interval, now=False)
+
+    def stop(self):
+        """
+        Stop every worker process and remove the rings.
+
+        @return: A Deferred that fires once every worker has ended
+        """
+        logging.info('ShardedMonitorPool stopping')
+        if self._poller is not None and self._poller.running:
+            self._poller.stop()
+        self._poller = None
+        d = defer.gatherResults([worker.stop() for worker in self.workers])
+        d.addCallback(self._stopped)
+        return d
+
+    def _stopped(self, _):
+        self.poll()
+        for worker in self.workers:
+            worker.ring.close()
+            try:
+                os.unlink(worker.ring.path)
+            except OSError as ex:
+                logging.error("Problem removing ring %s: %s" % (worker.ring.path, ex))
+        self.workers = []
+
+    def poll(self):
+        """
+        Deliver the readings waiting in the ring of every shard.
+        """
+        for worker in self.workers:
+            device_ids = worker.device_ids
+            for device, reading in worker.ring.drain():
+                try:
+                    self.periodicReadingReceived(device_ids[device], reading)
+                except Exception as ex:
+                    logging.error("Problem handling reading from device %s" % device_ids[device])
+                    logging.exception(ex)
+
+    def _historyReceived(self, device_id, sensor_type, sensorHistoryData):
+        try:
+            self.historyUpdateReceived(device_id, sensor_type, sensorHistoryData)
+        except Exception as ex:
+            logging.error("Problem handling history from device %s" % device_id)
+            logging.exception(ex)
+
+
+if __name__ == "__main__":
+    _runWorker(sys.argv[1], sys.argv[2])
@@ -0,0 +1,223 @@
+'''
+This module implements incremental rolling window statistics for the power
+readings reported on each channel of each electricity sensor.
+
+For every channel the minimum, maximum and mean power and the energy used,
+found by integrating the power over the receipt time of the readings, are
+kept for a number of window lengths (by default 1 minute, 15 minutes and 1
+hour).
+
+Each window is a ring of time buckets. Adding a reading updates a single
+bucket and a query combines a fixed number of buckets, so neither depends
+on the number of readings held in the window. Windows are resolved to the
+bucket width, i.e. a window covers its buckets ending with the bucket
+holding the query time.
+'''
+
+import collections
+
+
+# A summary of the readings in a window. The energy is in watt hours. The
+# minimum, maximum and mean are None if the window holds no readings.
+WindowSummary = collections.namedtuple('WindowSummary',
+                                       ['count', 'minimum', 'maximum', 'mean', 'energy'])
+
+
+class RollingWindow(object):
+    """
+    Accumulate readings into a ring of time buckets covering a window.
+    """
+
+    __slots__ = ('length', 'buckets', 'width',
+                 '_slots', '_counts', '_sums', '_minimums', '_maximums', '_energies')
+
+    def __init__(self, length, buckets=60):
+        """
+        @param length: The window length in seconds
+        @type length: float
+        @param buckets: The number of buckets the window is divided into
+        @type buckets: int
+        """
+        self.length = float(length)
+        self.buckets = buckets
+        self.width = self.length / buckets
+        # The absolute bucket number held in each ring position
+        self._slots = [None] * buckets
+        self._counts = [0] * buckets
+        self._sums = [0.0] * buckets
+        self._minimums = [None] * buckets
+        self._maximums = [None] * buckets
+        self._energies = [0.0] * buckets
+
+    def add(self, timestamp, value, energy=0.0):
+        """
+        Add a reading to the window.
+
+        @param timestamp: The receipt time of the reading in seconds
+        @type timestamp: float
+        @param value: The reading
+        @type value: float
+        @param energy: The energy, in watt seconds, used since the previous reading
+        @type energy: float
+        """
+        slot = int(timestamp // self.width)
+        index = slot % self.buckets
+        current = self._slots[index]
+        if current != slot:
+            if current is not None and current > slot:
+                # The reading is older than the window
+                return
+            self._slots[index] = slot
+            self._counts[index] = 0
+            self._sums[index] = 0.0
+            self._minimums[index] = value
+            self._maximums[index] = value
+            self._energies[index] = 0.0
+
+        self._counts[index] += 1
+        self._sums[index] += value
+        if value < self._minimums[index]:
+            self._minimums[index] = value
+        if value > self._maximums[index]:
+            self._maximums[index] = value
+        self._energies[index] += energy
+
+    def summary(self, now):
+        """
+        Return a WindowSummary of the readings in the window ending now.
+
+        @param now: The time, in seconds, the window ends
+        @type now: float
+        """
+        newest = int(now // self.width)
+        oldest = newest - self.buckets + 1
+        count = 0
+        total = 0.0
+        minimum = None
+        maximum = None
+        energy = 0.0
+        for index, slot in enumerate(self._slots):
+            if slot is None or slot < oldest or slot > newest:
+                continue
+            count += self._counts[index]
+            total += self._sums[index]
+            energy += self._energies[index]
+            if minimum is None or self._minimums[index] < minimum:
+                minimum = self._minimums[index]
+            if maximum is None or self._maximums[index] > maximum:
+                maximum = self._maximums[index]
+
+        mean = total / count if count else None
+        return WindowSummary(count, minimum, maximum, mean, energy / 3600.0)
+
+
+class ChannelStatistics(object):
+    """
+    The rolling window statistics for a single sensor channel.
+    """
+
+    __slots__ = ('windows', 'max_gap', 'last_timestamp', 'last_value', 'gaps')
+
+    def __init__(self, windows, buckets, max_gap):
+        """
+        @param windows: The window lengths in seconds
+        @type windows: sequence of float
+        @param buckets: The number of buckets in each window
+        @type buckets: int
+        @param max_gap: The longest time, in seconds, between readings that
+                        is integrated when calculating energy.
+        @type max_gap: float
+        """
+        self.windows = dict((length, RollingWindow(length, buckets)) for length in windows)
+        self.max_gap = max_gap
+        self.last_timestamp = None
+        self.last_value = None
+        # The number of gaps between readings that were too long to integrate
+        self.gaps = 0
+
+    def add(self, timestamp, value):
+        """
+        Add a power reading, in watts, received at timestamp seconds.
+        """
+        energy = 0.0
+        if self.last_timestamp is not None:
+            elapsed = timestamp - self.last_timestamp
+            if elapsed > self.max_gap:
+                # The power used while no readings were received is unknown.
+                self.gaps += 1
+            elif elapsed > 0:
+                energy = (self.last_value + value) / 2.0 * elapsed
+        self.last_timestamp = timestamp
+        self.last_value = value
+
+        for window in self.windows.values():
+            window.add(timestamp, value, energy)
+
+    def summary(self, length, now=None):
+        """
+        Return a WindowSummary for the window of the given length ending now,
+        or at the last reading if now is not supplied.
+        """
+        if now is None:
+            now = self.last_timestamp or 0.0
+        return self.windows[length].summary(now)
+
+
+class StatisticsAggregator(object):
+    """
+    Keep rolling window statistics for every channel of every electricity
+    sensor. Channels are numbered from 1, as in the periodic update message.
+    """
+
+    DefaultWindows = (60, 900, 3600)
+
+    def __init__(self, windows=DefaultWindows, buckets=60, max_gap=30.0):
+        """
+        @param windows: The window lengths in seconds
+        @type windows: sequence of float
+        @param buckets: The number of buckets in each window
+        @type buckets: int
+        @param max_gap: The longest time, in seconds, between readings that
+                        is integrated when calculating energy. Current Cost
+                        devices report every 6 seconds.
+        @type max_gap: float
+        """
+        self.windows = tuple(windows)
+        self.buckets = buckets
+        self.max_gap = max_gap
+        self.channels = {}
+
+    def add(self, timestamp, sensor_type, sensor_instance, watts_on_channel):
+        """
+        Add the readings from a periodic update.
+
+        @param timestamp: The receipt time of the periodic update in seconds
+        @type timestamp: float
+        @param watts_on_channel: The power on each channel in watts
+        @type watts_on_channel: sequence of numbers or numeric strings
+        """
+        for channel, watts in enumerate(watts_on_channel, 1):
+            key = (sensor_type, sensor_instance, channel)
+            statistics = self.channels.get(key)
+            if statistics is None:
+                statistics = ChannelStatistics(self.windows, self.buckets, self.max_gap)
+                self.channels[key] = statistics
+            statistics.add(timestamp, float(watts))
+
+    def channel(self, sensor_type, sensor_instance, channel):
+        """
+        Return the ChannelStatistics for a channel or None if no readings
+        have been received for it.
+        """
+        return self.channels.get((sensor_type, sensor_instance, channel))
+
+    def summary(self, sensor_type, sensor_instance, channel, length, now=None):
+        """
+        Return a WindowSummary for the window of the given length ending now,
+        or at the last reading of the channel if now is not supplied. None is
+        returned if no readings have been received for the channel.
+        """
+        statistics = self.channel(sensor_type, sensor_instance, channel)
+        if statistics is None:
+            return None
+        return statistics.summary(length, now)
@@ -0,0 +1,184 @@
+'''
+This module implements a supervisor that keeps the serial port of a Current
+Cost device open.
+
+USB serial adapters can be unplugged or reset at any time. When the port is
+lost the supervisor reopens it, retrying after a delay that doubles with
+each failed attempt up to max_delay, so that monitoring resumes within
+max_delay seconds of the device coming back without restarting the reactor.
+A port that can not be opened when the supervisor starts is retried in the
+same way.
+
+Each interval during which the port was not open is recorded as a Gap, so
+that consumers know which periods have no readings.
+
+To supervise the serial port of a monitor:
+
+    monitor.enableReconnection()
+    monitor.start()
+'''
+
+import collections
+import logging
+from twisted.internet import protocol
+
+
+# An interval, in clock seconds, during which the port was not open and the
+# number of attempts made to reopen it.
+Gap = collections.namedtuple('Gap', ['start', 'end', 'attempts'])
+
+
+class _SupervisedProtocol(protocol.Protocol):
+    """
+    Pass the events of a single opening of a port on to the protocol and
+    tell the supervisor when the port is lost.
+    """
+
+    def __init__(self, supervisor, wrapped):
+        self.supervisor = supervisor
+        self.wrapped = wrapped
+        self.lost = False
+        # Received data is passed straight to the wrapped protocol.
+        self.dataReceived = wrapped.dataReceived
+
+    def makeConnection(self, transport):
+        # The port closes itself through the transport of its protocol.
+        protocol.Protocol.makeConnection(self, transport)
+        # The wrapped protocol uses the port as its transport.
+        self.wrapped.makeConnection(transport)
+
+    def connectionLost(self, reason):
+        # Some serial port implementations report the loss more than once.
+        if self.lost:
+            return
+        self.lost = True
+        self.wrapped.connectionLost(reason)
+        self.supervisor._portLost(self, reason)
+
+
+class SerialPortSupervisor(object):
+    """
+    Open a serial port using a port factory and reopen it whenever it is lost,
+    until the supervisor is closed.
+    """
+
+    def __init__(self, portFactory, protocol, port, clock, baudrate=None,
+                 initial_delay=0.05, max_delay=1.0, max_gaps=100, metrics=None,
+                 recovered=None):
+        """
+        @param portFactory: Called with the protocol, port, clock and baudrate
+                            to open the port, e.g. txcurrentcost.FixedSerialPort
+        @param protocol: The protocol that receives data from the port
+        @param port: The serial port device name
+        @type port: string
+        @param clock: The reactor used to open the port and schedule retries
+        @param baudrate: The serial port baudrate
+        @type baudrate: int
+        @param initial_delay: The seconds before the first attempt to reopen a lost port
+        @type initial_delay: float
+        @param max_delay: The maximum seconds between attempts to reopen the port
+        @type max_delay: float
+        @param max_gaps: The number of most recent gaps held in the gaps attribute
+        @type max_gaps: int
+        @param metrics: The metrics recorded for the device
+        @type metrics: txcurrentcost.metrics.MonitorMetrics
+        @param recovered: Called with a Gap each time the port is reopened
+        """
+        self.portFactory = portFactory
+        self.protocol = protocol
+        self.port = port
+        self.clock = clock
+        self.baudrate = baudrate
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.metrics = metrics
+        self.recovered = recovered
+        self.gaps = collections.deque(maxlen=max_gaps)
+
+        # The port currently open, if any, and the protocol wrapping it.
+        self.serialPort = None
+        self._supervised = None
+        self._lostAt = None
+        self._attempts = 0
+        self._retryCall = None
+        self._closed = False
+
+        self._open()
+
+    @property
+    def connected(self):
+        """ True while the port is open """
+        return self.serialPort is not None
+
+    def _open(self):
+        """ Open the port, or schedule another attempt if it can't be opened """
+        self._retryCall = None
+        supervised = _SupervisedProtocol(self, self.protocol)
+        try:
+            serialPort = self.portFactory(supervised, self.port, self.clock, baudrate=self.baudrate)
+        except Exception as ex:
+            if self._lostAt is None:
+                logging.error("Problem opening port %s: %s" % (self.port, ex))
+                self._lostAt = self.clock.seconds()
+            self._retry()
+            return
+
+        if supervised.lost:
+            # The port was lost while it was being opened.
+            if self._lostAt is None:
+                self._lostAt = self.clock.seconds()
+            self._retry()
+            return
+
+        self.serialPort = serialPort
+        self._supervised = supervised
+        if self.metrics is not None:
+            self.metrics.portConnected.set(1)
+
+        if self._lostAt is not None:
+            now = self.clock.seconds()
+            gap = Gap(self._lostAt, now, self._attempts)
+            self._lostAt = None
+            self._attempts = 0
+            self.gaps.append(gap)
+            logging.info("Reopened port %s after %.3f seconds" % (self.port, gap.end - gap.start))
+            if self.metrics is not None:
+                self.metrics.recoveryTime.observe(gap.end - gap.start)
+            if self.recovered is not None:
+                try:
+                    self.recovered(gap)
+                except Exception as ex:
+                    logging.error("Problem handling recovery of port %s" % self.port)
+                    logging.exception(ex)
+
+    def _retry(self):
+        """ Schedule the next attempt to open the port """
+        if self._closed:
+            return
+        self._attempts += 1
+        if self.metrics is not None:
+            self.metrics.reconnectAttempts.inc()
+        delay = min(self.initial_delay * 2 ** (self._attempts - 1), self.max_delay)
+        self._retryCall = self.clock.callLater(delay, self._open)
+
+    def _portLost(self, supervised, reason):
+        if supervised is not self._supervised:
+            return
+        self.serialPort = None
+        self._supervised = None
+        if self.metrics is not None:
+            self.metrics.portConnected.set(0)
+        if self._closed:
+            return
+        logging.error("Lost port %s, reopening: %s" % (self.port, reason.getErrorMessage()))
+        self._lostAt = self.clock.seconds()
+        self._retry()
+
+    def close(self):
+        """ Close the port and stop reopening it """
+        self._closed = True
+        if self._retryCall is not None and self._retryCall.active():
+            self._retryCall.cancel()
+        self._retryCall = None
+        if self.serialPort is not None:
+            self.serialPort.close()
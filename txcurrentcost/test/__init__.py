@@ -0,0 +1,7 @@
+'''
+Tests for txcurrentcost.
+
+Run them using trial:
+
+    trial txcurrentcost
+'''
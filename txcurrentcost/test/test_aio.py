@@ -0,0 +1,199 @@
+'''
+Tests for txcurrentcost.aio.
+'''
+
+import os
+import subprocess
+import sys
+from twisted.trial import unittest
+from txcurrentcost.decoder import PeriodicReading
+from txcurrentcost.test.test_decoder import PeriodicMessages
+from txcurrentcost.test.test_monitor import Config, HistoryCycle
+try:
+    import asyncio
+    from txcurrentcost import aio
+except (ImportError, SyntaxError):
+    # The asyncio engine requires Python 3.
+    aio = None
+
+
+class FakeTransport(object):
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.closed = False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.protocol.connection_lost(None)
+
+
+class RecordingMonitor(aio.AsyncioMonitor if aio else object):
+
+    def __init__(self, loop, max_queue=1000):
+        aio.AsyncioMonitor.__init__(self, Config(), loop, max_queue)
+        self.portFactory = self.openPort
+        self.opened = []
+        self.history = []
+
+    def openPort(self, protocol, port, loop, baudrate=57600):
+        """ Connect the protocol to a fake transport, as openSerialPort would """
+        self.opened.append((port, baudrate))
+        transport = FakeTransport(protocol)
+        protocol.connection_made(transport)
+        opened = loop.create_future()
+        opened.set_result(transport)
+        return opened
+
+    def historyUpdateReceived(self, sensor_type, sensorHistoryData):
+        self.history.append((sensor_type, sorted(sensorHistoryData)))
+
+    def receive(self, line):
+        self.protocol.data_received(line.encode('ascii') + b'\r\n')
+
+
+class AsyncioTestCase(unittest.TestCase):
+
+    if aio is None:
+        skip = "txcurrentcost.aio requires Python 3"
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def sleep(self, delay):
+        self.loop.run_until_complete(asyncio.sleep(delay))
+
+
+class AsyncioClockTests(AsyncioTestCase):
+
+    def setUp(self):
+        AsyncioTestCase.setUp(self)
+        self.clock = aio.AsyncioClock(self.loop)
+        self.calls = []
+
+    def test_callLater(self):
+        call = self.clock.callLater(0, self.calls.append, 1)
+        self.assertTrue(call.active())
+        self.sleep(0.01)
+        self.assertEqual(self.calls, [1])
+        self.assertFalse(call.active())
+
+    def test_cancel(self):
+        call = self.clock.callLater(0, self.calls.append, 1)
+        call.cancel()
+        self.sleep(0.01)
+        self.assertEqual(self.calls, [])
+        self.assertFalse(call.active())
+
+    def test_reset(self):
+        call = self.clock.callLater(0, self.calls.append, 1)
+        call.reset(60)
+        self.sleep(0.01)
+        self.assertEqual(self.calls, [])
+        self.assertTrue(call.active())
+        call.cancel()
+
+
+class AsyncioMonitorTests(AsyncioTestCase):
+
+    def setUp(self):
+        AsyncioTestCase.setUp(self)
+        self.monitor = RecordingMonitor(self.loop)
+
+    def start(self):
+        self.loop.run_until_complete(self.monitor.start())
+
+    def nextReading(self):
+        return self.loop.run_until_complete(self.monitor.__anext__())
+
+    def test_start(self):
+        self.start()
+        self.assertEqual(self.monitor.opened, [('/dev/null', 57600)])
+        self.assertIs(self.monitor.serialPort.protocol, self.monitor.protocol)
+
+    def test_readings(self):
+        self.start()
+        self.monitor.receive(PeriodicMessages[0])
+        self.monitor.receive(PeriodicMessages[1])
+        readings = [self.nextReading(), self.nextReading()]
+        self.assertIsInstance(readings[0], PeriodicReading)
+        self.assertEqual([(reading.sensor_instance, reading.watts) for reading in readings],
+                         [(0, (345, 2151, 0)), (3, (12,))])
+
+    def test_untypedReadings(self):
+        self.monitor.typedReadings = False
+        self.start()
+        self.monitor.receive(PeriodicMessages[0])
+        timestamp, temperature, sensor_type, sensor_instance, sensor_data = self.nextReading()
+        self.assertEqual((temperature, sensor_type, sensor_instance, sensor_data),
+                         ('18.7', 1, 0, ['00345', '02151', '00000']))
+
+    def test_oldestReadingsDropped(self):
+        self.monitor = RecordingMonitor(self.loop, max_queue=1)
+        self.start()
+        self.monitor.receive(PeriodicMessages[0])
+        self.monitor.receive(PeriodicMessages[1])
+        self.assertEqual(self.monitor.droppedReadings, 1)
+        self.assertEqual(self.nextReading().sensor_instance, 3)
+
+    def test_stopEndsIteration(self):
+        self.start()
+        self.monitor.receive(PeriodicMessages[0])
+        self.monitor.stop()
+        self.assertTrue(self.monitor.serialPort.closed)
+        self.assertEqual(self.nextReading().sensor_instance, 0)
+        self.assertRaises(StopAsyncIteration, self.nextReading)
+        self.assertRaises(StopAsyncIteration, self.nextReading)
+
+    def test_notStarted(self):
+        self.assertRaises(StopAsyncIteration, self.nextReading)
+
+    def test_portLost(self):
+        """
+        Iteration raises the error that closed the port.
+        """
+        self.start()
+        self.monitor.protocol.connection_lost(OSError("unplugged"))
+        self.assertRaises(OSError, self.nextReading)
+
+    def test_historyCycleTimeout(self):
+        """
+        History cycle timers are scheduled on the event loop.
+        """
+        self.monitor.historicDataMessageTimeout = 0.01
+        self.start()
+        for line in HistoryCycle:
+            self.monitor.receive(line)
+        self.assertEqual(self.monitor.history, [])
+        self.sleep(0.05)
+        self.assertEqual(self.monitor.history, [(1, [0, 1])])
+
+    def test_periodicBatching(self):
+        batches = []
+        self.monitor.periodicBatchReceived = batches.append
+        self.monitor.enablePeriodicBatching(max_count=10, max_delay=0.01)
+        self.start()
+        self.monitor.receive(PeriodicMessages[0])
+        self.monitor.receive(PeriodicMessages[1])
+        self.assertEqual(batches, [])
+        self.sleep(0.05)
+        self.assertEqual([len(batch) for batch in batches], [2])
+
+    def test_reconnectionNotSupported(self):
+        self.assertRaises(NotImplementedError, self.monitor.enableReconnection)
+
+    def test_historyDecoderNotSupported(self):
+        self.monitor.historyDecoder = object()
+        self.assertRaises(NotImplementedError, self.start)
+
+    def test_importWithoutTwisted(self):
+        """
+        The asyncio engine can be imported when Twisted is not installed.
+        """
+        code = ("import sys\n"
+                "sys.modules['twisted'] = None\n"
+                "import txcurrentcost.aio\n")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        self.assertEqual(subprocess.call([sys.executable, '-c', code], env=env), 0)
@@ -0,0 +1,142 @@
+'''
+Tests for txcurrentcost.arrays. They are skipped when NumPy is not installed.
+'''
+
+import datetime
+import mmap
+from twisted.internet import task
+from twisted.trial import unittest
+from txcurrentcost.batch import PeriodicBatch
+from txcurrentcost.core import SensorHistoryData
+from txcurrentcost.readinglog import ReadingLog, ReadingLogReader
+from txcurrentcost.test.test_core import Received, createHistory
+from txcurrentcost.test.test_decoder import PeriodicMessages
+try:
+    import numpy
+    from txcurrentcost import arrays
+except ImportError:
+    numpy = None
+
+
+def baseBuffer(array):
+    """ Return the object whose memory an array views """
+    while isinstance(array, numpy.ndarray) and array.base is not None:
+        array = array.base
+    if isinstance(array, memoryview):
+        return array.obj
+    return array
+
+
+class NumpyTestCase(unittest.TestCase):
+    if numpy is None:
+        skip = "NumPy is not installed"
+
+
+class HistoryArrayTests(NumpyTestCase):
+
+    def test_values(self):
+        history = createHistory()
+        values = history.toNumpy()
+        self.assertEqual(values.dtype, numpy.dtype('f8'))
+        self.assertEqual(len(values), SensorHistoryData.Data_Kind_Capacity[SensorHistoryData.Hour_Data])
+        self.assertEqual(list(values[[2, 4, 10, 24]]), [1.1, 1.3, 0.9, 0.0])
+        self.assertTrue(numpy.isnan(values[3]))
+
+    def test_valuesShareStore(self):
+        history = createHistory()
+        values = history.toNumpy()
+        self.assertFalse(values.flags.owndata)
+        self.assertFalse(values.flags.writeable)
+        history.storeHourData('h006', '002.0')
+        self.assertEqual(values[6], 2.0)
+
+    def test_irregularValuesMerged(self):
+        capacity = SensorHistoryData.Data_Kind_Capacity[SensorHistoryData.Year_Data]
+        history = createHistory([('y001', '0100.0'), ('y002', '50.25'), ('y%03d' % (capacity + 1), '0001.0')])
+        values = history.toNumpy(SensorHistoryData.Year_Data)
+        self.assertTrue(values.flags.owndata)
+        self.assertEqual(len(values), capacity + 2)
+        self.assertEqual(list(values[[1, 2, capacity + 1]]), [100.0, 50.25, 1.0])
+
+    def test_periods(self):
+        periods = createHistory().periodsToNumpy()
+        self.assertEqual(periods.dtype, arrays.HistoryPeriodDtype)
+        self.assertEqual([str(start) for start in periods['period_start']],
+                         ['2013-03-14T13:00:00', '2013-03-15T03:00:00', '2013-03-15T09:00:00', '2013-03-15T11:00:00'])
+        self.assertEqual(list(periods['value']), [0.0, 0.9, 1.3, 1.1])
+
+    def test_noPeriods(self):
+        periods = SensorHistoryData(1, 0, 'kwhr').periodsToNumpy()
+        self.assertEqual(periods.dtype, arrays.HistoryPeriodDtype)
+        self.assertEqual(len(periods), 0)
+
+
+class PeriodicBatchArrayTests(NumpyTestCase):
+
+    def test_batch(self):
+        batch = PeriodicBatch()
+        batch.append(Received, '18.7', 1, 0, ['00345', '02151', '00000'])
+        batch.append(Received + datetime.timedelta(seconds=6), '', 2, 9, ['89466', '1000'])
+        result = batch.toNumpy()
+        self.assertEqual(result.dtype, arrays.PeriodicDtype)
+        self.assertEqual([str(t) for t in result['timestamp']],
+                         ['2013-03-15T13:10:50.000000', '2013-03-15T13:10:56.000000'])
+        self.assertEqual(list(result['sensor_instance']), [0, 9])
+        self.assertEqual(list(result['values'][0][:3]), [345.0, 2151.0, 0.0])
+        self.assertEqual(list(result['values'][1][:2]), [89466.0, 1000.0])
+        self.assertTrue(numpy.isnan(result['temperature'][1]))
+        self.assertTrue(numpy.isnan(result['values'][1][2]))
+
+
+class ReadingLogArrayTests(NumpyTestCase):
+
+    def setUp(self):
+        self.directory = self.mktemp()
+        self.reader = ReadingLogReader(self.directory)
+        self.addCleanup(self.reader.close)
+
+    def write(self, count, **kw):
+        log = ReadingLog(self.directory, clock=task.Clock(), **kw)
+        for n in range(count):
+            log.append(100.0 + n, 'house', 1, 0, '18.7', ['%05i' % n, '00001'])
+        log.close()
+
+    def test_singleSegmentView(self):
+        """ Records held in a single segment are returned without copying """
+        self.write(10)
+        records = self.reader.toNumpy(102.0, 106.0)
+        self.assertEqual(records.dtype, arrays.ReadingLogDtype)
+        self.assertFalse(records.flags.owndata)
+        self.assertIsInstance(baseBuffer(records), mmap.mmap)
+        self.assertEqual(list(records['timestamp']), [102.0, 103.0, 104.0, 105.0])
+        self.assertEqual(list(records['values'][:, 0]), [2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(list(records['device']), [b'house'] * 4)
+
+    def test_segmentsConcatenated(self):
+        self.write(10, flush_count=1, segment_size=256)
+        records = self.reader.toNumpy(0, 1e12)
+        self.assertTrue(len(self.reader._segments) > 1)
+        self.assertEqual(records.dtype, arrays.ReadingLogDtype)
+        self.assertEqual(list(records['timestamp']), [100.0 + n for n in range(10)])
+
+    def test_empty(self):
+        self.write(2)
+        records = self.reader.toNumpy(200.0, 300.0)
+        self.assertEqual(records.dtype, arrays.ReadingLogDtype)
+        self.assertEqual(len(records), 0)
+
+
+class CapturedLogArrayTests(NumpyTestCase):
+
+    def test_loadCapturedLog(self):
+        path = self.mktemp()
+        with open(path, 'w') as log:
+            log.write('1000.0\t%s\n1006.0\t%s\n1012.0\t%s\n' % (PeriodicMessages[0], PeriodicMessages[1].strip(),
+                                                                  PeriodicMessages[0]))
+        sensors = arrays.loadCapturedLog(path)
+        self.assertEqual(sorted(sensors), [(1, 0), (1, 3)])
+        house = sensors[(1, 0)]
+        self.assertEqual(house.dtype, arrays.CapturedDtype)
+        self.assertEqual(list(house['timestamp']), [1000.0, 1012.0])
+        self.assertEqual(list(house['values'][0][:3]), [345.0, 2151.0, 0.0])
+        self.assertEqual(list(sensors[(1, 3)]['temperature']), [18.7])
@@ -0,0 +1,62 @@
+'''
+Tests for txcurrentcost.batch.
+'''
+
+from twisted.internet import task
+from twisted.trial import unittest
+from txcurrentcost.batch import PeriodicBatcher
+
+
+class PeriodicBatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.batches = []
+        self.batcher = PeriodicBatcher(self.clock, self.batches.append, max_count=3, max_delay=1.0)
+
+    def add(self, n):
+        self.batcher.add(n, '18.7', 1, 0, ['%05i' % n])
+
+    def test_deliveredWhenFull(self):
+        for n in range(4):
+            self.add(n)
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(list(self.batches[0].rows()),
+                         [(n, '18.7', 1, 0, ['%05i' % n]) for n in range(3)])
+        self.assertEqual(len(self.batcher.batch), 1)
+
+    def test_deliveredAfterMaxDelay(self):
+        self.add(0)
+        self.clock.advance(0.5)
+        self.add(1)
+        self.assertEqual(self.batches, [])
+        self.clock.advance(0.5)
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(self.batches[0].timestamps, [0, 1])
+
+    def test_fullBatchCancelsTimer(self):
+        for n in range(3):
+            self.add(n)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_flush(self):
+        self.batcher.flush()
+        self.assertEqual(self.batches, [])
+        self.add(0)
+        self.batcher.flush()
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_handlerFailure(self):
+        """
+        A failure delivering a batch is logged and the batcher carries on.
+        """
+        def fail(batch):
+            raise ValueError("failed")
+        self.batcher.batchReceived = fail
+        self.add(0)
+        self.batcher.flush()
+        self.batcher.batchReceived = self.batches.append
+        self.add(1)
+        self.batcher.flush()
+        self.assertEqual(self.batches[0].timestamps, [1])
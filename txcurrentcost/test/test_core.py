@@ -0,0 +1,235 @@
+'''
+Tests for txcurrentcost.core.
+'''
+
+import datetime
+import json
+from twisted.trial import unittest
+from txcurrentcost.core import SensorHistoryData
+
+
+Received = datetime.datetime(2013, 3, 15, 13, 10, 50)
+
+Datapoints = [('h004', '001.3'), ('h002', '001.1'), ('h024', '000.0'), ('h010', '000.9'),
+              ('d001', '011.50'), ('d002', '012.25'),
+              ('m001', '00345'),
+              ('y001', '1234.5')]
+
+
+def createHistory(datapoints=Datapoints, timestamp=Received):
+    history = SensorHistoryData(1, 0, 'kwhr')
+    history.storeDataPoints(timestamp, datapoints)
+    return history
+
+
+def tagOrder(datapoints):
+    """ Sort datapoints in numeric tag order """
+    return sorted(datapoints, key=lambda x: int(x[0][1:]))
+
+
+class SensorHistoryDataTests(unittest.TestCase):
+    """
+    The array backed store returns the value strings it was given.
+    """
+
+    def assertDatapoints(self, history, datapoints):
+        for data_kind, prefix in [('hour', 'h'), ('day', 'd'), ('month', 'm'), ('year', 'y')]:
+            expected = [x for x in datapoints if x[0].startswith(prefix)]
+            self.assertEqual(getattr(history, data_kind + 'Data'), dict(expected))
+            self.assertEqual(json.loads(history.toJson())['data'][data_kind],
+                             [list(x) for x in tagOrder(expected)])
+
+    def test_datapoints(self):
+        history = createHistory()
+        self.assertEqual(history.getHourData(),
+                         [('h002', '001.1'), ('h004', '001.3'), ('h010', '000.9'), ('h024', '000.0')])
+        self.assertEqual(history.getMonthData(), [('m001', '00345')])
+        self.assertDatapoints(history, Datapoints)
+        self.assertTrue(history.dataPresent)
+
+    def test_json(self):
+        decoded = json.loads(createHistory().toJson())
+        self.assertEqual(decoded['type'], 1)
+        self.assertEqual(decoded['instance'], 0)
+        self.assertEqual(decoded['units'], 'kwhr')
+        self.assertEqual(decoded['timestamp'], str(Received))
+
+    def test_irregularValues(self):
+        """
+        Values that do not match the format of the first value of their kind
+        are returned unchanged.
+        """
+        datapoints = [('h002', '001.1'), ('h004', '1.25'), ('h006', '---'), ('h008', ''),
+                      ('h010', '-01.0'), ('d001', 'nan')]
+        history = createHistory(datapoints)
+        self.assertDatapoints(history, datapoints)
+
+    def test_irregularValueReplaced(self):
+        history = createHistory([('h002', '001.1'), ('h004', '1.25')])
+        history.storeHourData('h004', '001.3')
+        self.assertEqual(history.getHourData(), [('h002', '001.1'), ('h004', '001.3')])
+        history.storeHourData('h002', 'x')
+        self.assertEqual(history.getHourData(), [('h002', 'x'), ('h004', '001.3')])
+
+    def test_irregularTags(self):
+        """ Tags that are not three digits are kept and sort by number """
+        datapoints = [('h002', '001.1'), ('h1', '000.5'), ('h0004', '000.7'), ('hx', '000.1')]
+        history = createHistory(datapoints)
+        self.assertEqual(history.getHourData(),
+                         [('h1', '000.5'), ('h002', '001.1'), ('h0004', '000.7'), ('hx', '000.1')])
+
+    def test_capacityOverflow(self):
+        """ Datapoints beyond the capacity of the arrays are still kept """
+        capacity = SensorHistoryData.Data_Kind_Capacity[SensorHistoryData.Year_Data]
+        datapoints = [('y%03d' % n, '0100.0') for n in range(1, capacity + 3)]
+        history = createHistory(datapoints)
+        self.assertEqual(history.getYearData(), datapoints)
+        self.assertEqual(history.datapointCount(), len(datapoints))
+
+    def test_zeroDataNotPresent(self):
+        history = createHistory([('h002', '000.0'), ('d001', '000.00')])
+        self.assertFalse(history.dataPresent)
+
+    def test_assignData(self):
+        history = createHistory()
+        history.hourData = {'h006': '002.2', 'h002': '2.5'}
+        self.assertEqual(history.getHourData(), [('h002', '2.5'), ('h006', '002.2')])
+        self.assertEqual(json.loads(history.toJson())['data']['hour'], [['h002', '2.5'], ['h006', '002.2']])
+        history.dayData = {}
+        self.assertEqual(history.getDayData(), [])
+        self.assertEqual(history.getMonthData(), [('m001', '00345')])
+
+
+class HistoryCacheTests(unittest.TestCase):
+    """
+    The sorted datapoint views and the JSON encoding are rebuilt once a
+    datapoint has been stored.
+    """
+
+    def setUp(self):
+        self.history = createHistory()
+        self.history.getHourData()
+        self.history.toJson()
+
+    def test_cached(self):
+        self.assertIdentical(self.history.toJson(), self.history.toJson())
+        self.assertNotIdentical(self.history._sortedData.get(SensorHistoryData.Hour_Data), None)
+
+    def test_returnedListIsCopy(self):
+        self.history.getHourData().append(('h999', '000.0'))
+        self.assertEqual(len(self.history.getHourData()), 4)
+
+    def test_storeDataPoint(self):
+        self.history.storeHourData('h006', '002.0')
+        self.assertIdentical(self.history._json, None)
+        self.assertIdentical(self.history._sortedData.get(SensorHistoryData.Hour_Data), None)
+        self.assertIn(('h006', '002.0'), self.history.getHourData())
+        self.assertIn(['h006', '002.0'], json.loads(self.history.toJson())['data']['hour'])
+
+    def test_storeDataPoints(self):
+        later = Received + datetime.timedelta(hours=2)
+        self.history.storeDataPoints(later, [('d001', '013.00')])
+        self.assertEqual(json.loads(self.history.toJson())['timestamp'], str(later))
+        self.assertEqual(self.history.getDayData()[0], ('d001', '013.00'))
+
+
+class BetweenTests(unittest.TestCase):
+    """
+    Datapoints are found by the start of their period, from the start of
+    the range up to but not including its end.
+    """
+
+    def setUp(self):
+        self.history = createHistory()
+
+    def hour(self, day, hour):
+        return datetime.datetime(2013, 3, day, hour)
+
+    def test_ascendingTime(self):
+        self.assertEqual(self.history.between(self.hour(14, 0), self.hour(16, 0)),
+                         [(self.hour(14, 13), 0.0), (self.hour(15, 3), 0.9),
+                          (self.hour(15, 9), 1.3), (self.hour(15, 11), 1.1)])
+
+    def test_startInclusive(self):
+        self.assertEqual(self.history.between(self.hour(15, 9), self.hour(15, 10)), [(self.hour(15, 9), 1.3)])
+
+    def test_endExclusive(self):
+        self.assertEqual(self.history.between(self.hour(15, 8), self.hour(15, 9)), [])
+        self.assertEqual(self.history.between(self.hour(15, 3), self.hour(15, 11)),
+                         [(self.hour(15, 3), 0.9), (self.hour(15, 9), 1.3)])
+
+    def test_emptyRanges(self):
+        self.assertEqual(self.history.between(self.hour(15, 9), self.hour(15, 9)), [])
+        self.assertEqual(self.history.between(self.hour(15, 11), self.hour(15, 3)), [])
+        self.assertEqual(self.history.between(self.hour(16, 0), self.hour(17, 0)), [])
+
+    def test_dataKinds(self):
+        self.assertEqual(self.history.between(datetime.datetime(2013, 3, 13), Received, SensorHistoryData.Day_Data),
+                         [(datetime.datetime(2013, 3, 13), 12.25), (datetime.datetime(2013, 3, 14), 11.5)])
+        self.assertEqual(self.history.between(datetime.datetime(2013, 2, 1), Received, SensorHistoryData.Month_Data),
+                         [(datetime.datetime(2013, 2, 1), 345.0)])
+        self.assertEqual(self.history.between(datetime.datetime(2012, 1, 1), Received, SensorHistoryData.Year_Data),
+                         [(datetime.datetime(2012, 1, 1), 1234.5)])
+
+    def test_monthsCrossYear(self):
+        history = createHistory([('m003', '00001')], datetime.datetime(2013, 1, 31, 13, 0))
+        self.assertEqual(history.between(datetime.datetime(2012, 1, 1), Received, SensorHistoryData.Month_Data),
+                         [(datetime.datetime(2012, 10, 1), 1.0)])
+
+    def test_indexRebuiltAfterStore(self):
+        self.history.buildIndex()
+        self.history.storeHourData('h006', '002.0')
+        self.assertEqual(self.history.between(self.hour(15, 7), self.hour(15, 8)), [(self.hour(15, 7), 2.0)])
+
+    def test_noHistoryReceived(self):
+        history = SensorHistoryData(1, 0, 'kwhr')
+        self.assertEqual(history.between(datetime.datetime.min, datetime.datetime.max), [])
+
+
+class ChangedSinceTests(unittest.TestCase):
+    """
+    Only datapoints of periods that are new or whose value changed since
+    a snapshot are returned, whatever their tag.
+    """
+
+    Cycle = [('h002', '001.1'), ('h004', '001.3'), ('h006', '000.9'), ('h008', '000.0'),
+             ('d001', '011.50'), ('d002', '012.25')]
+
+    def setUp(self):
+        self.history = createHistory(self.Cycle)
+        self.snapshot = self.history.snapshot()
+
+    def nextCycle(self, datapoints):
+        """ Store the datapoints of a history cycle sent two hours later """
+        self.history.storeDataPoints(Received + datetime.timedelta(hours=2), datapoints)
+        return self.history.changedSince(self.snapshot)
+
+    def test_unchanged(self):
+        changed = self.history.changedSince(self.snapshot)
+        self.assertEqual(changed.datapointCount(), 0)
+        self.assertEqual(changed.last_update, Received)
+        self.assertEqual((changed.type, changed.instance, changed.units), (1, 0, 'kwhr'))
+
+    def test_tagsShifted(self):
+        """ The same periods are sent under later tags in the next cycle """
+        changed = self.nextCycle([('h002', '001.7'), ('h004', '001.1'), ('h006', '001.3'), ('h008', '000.9'),
+                                  ('h010', '000.0'), ('d001', '011.50'), ('d002', '012.25')])
+        self.assertEqual(changed.getHourData(), [('h002', '001.7')])
+        self.assertEqual(changed.getDayData(), [])
+        self.assertEqual(changed.last_update, Received + datetime.timedelta(hours=2))
+
+    def test_valueChanged(self):
+        changed = self.nextCycle([('h002', '001.7'), ('h004', '001.2'), ('h006', '001.3'), ('h008', '000.9'),
+                                  ('h010', '000.0'), ('d001', '011.75'), ('d002', '012.25')])
+        self.assertEqual(changed.getHourData(), [('h002', '001.7'), ('h004', '001.2')])
+        self.assertEqual(changed.getDayData(), [('d001', '011.75')])
+
+    def test_emptySnapshot(self):
+        changed = self.history.changedSince({})
+        self.assertEqual(changed.datapointCount(), len(self.Cycle))
+        self.assertEqual(changed.toJson(), self.history.toJson())
+
+    def test_noHistoryReceived(self):
+        history = SensorHistoryData(1, 0, 'kwhr')
+        self.assertEqual(history.snapshot(), {})
+        self.assertEqual(history.changedSince(self.snapshot).datapointCount(), 0)
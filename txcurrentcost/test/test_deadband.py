@@ -0,0 +1,60 @@
+'''
+Tests for txcurrentcost.deadband.
+'''
+
+from twisted.trial import unittest
+from txcurrentcost.deadband import DeadbandFilter
+
+
+class DeadbandFilterTests(unittest.TestCase):
+
+    def test_firstReadingForwarded(self):
+        self.assertTrue(DeadbandFilter(threshold=5).accept(0, 1, 0, ['00100']))
+
+    def test_threshold(self):
+        deadband = DeadbandFilter(threshold=5, heartbeat=None)
+        deadband.accept(0, 1, 0, ['00100', '00200'])
+        self.assertFalse(deadband.accept(6, 1, 0, ['00105', '00196']))
+        self.assertTrue(deadband.accept(12, 1, 0, ['00100', '00206']))
+        # Changes are measured from the last forwarded reading.
+        self.assertFalse(deadband.accept(18, 1, 0, ['00104', '00206']))
+
+    def test_heartbeat(self):
+        deadband = DeadbandFilter(threshold=5, heartbeat=30)
+        deadband.accept(0, 1, 0, ['00100'])
+        self.assertFalse(deadband.accept(24, 1, 0, ['00100']))
+        self.assertTrue(deadband.accept(30, 1, 0, ['00100']))
+
+    def test_missingValueForwarded(self):
+        deadband = DeadbandFilter(threshold=5, heartbeat=None)
+        deadband.accept(0, 2, 9, ('89466', '1000'))
+        self.assertTrue(deadband.accept(6, 2, 9, ('89466', None)))
+        self.assertFalse(deadband.accept(12, 2, 9, ('89466', None)))
+
+    def test_channelCountChangeForwarded(self):
+        deadband = DeadbandFilter(threshold=5, heartbeat=None)
+        deadband.accept(0, 1, 0, [100])
+        self.assertTrue(deadband.accept(6, 1, 0, [100, 200]))
+
+    def test_sensorSettings(self):
+        deadband = DeadbandFilter(threshold=5, heartbeat=None)
+        deadband.accept(0, 1, 0, [100, 200])
+        deadband.setThreshold(50, 1, 0)
+        deadband.setThreshold(0, 1, 0, channel=2)
+        self.assertFalse(deadband.accept(6, 1, 0, [140, 200]))
+        self.assertTrue(deadband.accept(12, 1, 0, [140, 201]))
+        deadband.setHeartbeat(10, 1, 0)
+        self.assertTrue(deadband.accept(22, 1, 0, [140, 201]))
+        # Other sensors keep the defaults.
+        deadband.accept(0, 1, 1, [100])
+        self.assertTrue(deadband.accept(6, 1, 1, [106]))
+
+    def test_suppressionRatio(self):
+        deadband = DeadbandFilter(threshold=5, heartbeat=None)
+        self.assertEqual(deadband.suppressionRatio(), 0.0)
+        for value in (100, 101, 102, 110):
+            deadband.accept(0, 1, 0, [value])
+        deadband.accept(0, 1, 1, [100])
+        self.assertEqual(deadband.suppressionRatio(1, 0), 0.5)
+        self.assertEqual(deadband.suppressionRatio(), 0.4)
+        self.assertEqual(deadband.suppressionRatio(1, 2), 0.0)
@@ -0,0 +1,111 @@
+'''
+Tests for txcurrentcost.decoder.
+
+The fast path decoders are checked against the ElementTree parsing path
+using a corpus of sample messages, which benchmarks/decoder.py also uses.
+'''
+
+from twisted.trial import unittest
+from txcurrentcost.decoder import (decodeHistoryLine, decodePeriodicFrame, decodePeriodicReading,
+                                   decodePeriodicReadingFrame, decodePeriodicUpdate, etree)
+
+
+PeriodicMessages = [
+    '<msg><src>CC128-v0.11</src><dsb>00089</dsb><time>13:02:39</time><tmpr>18.7</tmpr><sensor>0</sensor><id>01234</id><type>1</type><ch1><watts>00345</watts></ch1><ch2><watts>02151</watts></ch2><ch3><watts>00000</watts></ch3></msg>',
+    '<msg><src>CC128-v0.11</src><dsb>00089</dsb><time>13:02:45</time><tmpr>18.7</tmpr><sensor>3</sensor><id>00077</id><type>1</type><ch1><watts>00012</watts></ch1></msg>\r',
+    '<msg><src>CC128-v1.29</src><dsb>00089</dsb><time>13:02:51</time><tmprF>65.6</tmprF><sensor>9</sensor><id>02100</id><type>2</type><imp>0000089466</imp><ipu>1000</ipu></msg>',
+    '  <msg><src>CC128-v0.11</src> <dsb>00089</dsb> <tmpr>19.0</tmpr> <sensor>0</sensor> <id>01234</id> <type>1</type> <ch1> <watts>00504</watts> </ch1></msg>']
+
+OtherMessages = [
+    '<msg><src>CC128-v0.11</src><dsb>00089</dsb><time>13:10:50</time><hist><dsw>00032</dsw><type>1</type><units>kwhr</units><data><sensor>0</sensor><h024>001.1</h024><h022>000.9</h022><h020>000.3</h020><h018>000.4</h018></data></hist></msg>',
+    '<msg><src>CC128-v0.11</src><dsb>00089</dsb><time>13:02:39</time><tmpr>18.7</tm',
+    'atts></ch1></msg>',
+    '<msg><src>CC128&amp;v0.11</src><sensor>0</sensor><type>1</type></msg>']
+
+
+def extract(msg):
+    """ Extract the fields used by the monitor from a decoded message """
+    fields = [msg.findtext(tag) for tag in ("src", "dsb", "tmpr", "tmprF", "sensor", "id", "type", "imp", "ipu")]
+    fields.extend(msg.findtext("ch%i/watts" % n) for n in range(1, 10))
+    return fields
+
+
+def readingFields(reading):
+    return (reading.temperature, reading.sensor_type, reading.sensor_instance, reading.watts,
+            reading.impulses, reading.impulses_per_unit, reading.source, reading.days_since_birth)
+
+
+class PeriodicUpdateParityTests(unittest.TestCase):
+    """
+    The fast path decoder extracts the same information as ElementTree.
+    """
+
+    def test_lines(self):
+        for line in PeriodicMessages:
+            self.assertEqual(extract(decodePeriodicUpdate(line)), extract(etree.fromstring(line)), line)
+
+    def test_bytes(self):
+        for line in PeriodicMessages:
+            self.assertEqual(extract(decodePeriodicUpdate(line.encode('ascii'))),
+                             extract(etree.fromstring(line)), line)
+
+    def test_frames(self):
+        for line in PeriodicMessages:
+            frame = memoryview(line.strip().encode('ascii')) if bytes is not str else line.strip()
+            self.assertEqual(extract(decodePeriodicFrame(frame)), extract(etree.fromstring(line)), line)
+
+    def test_otherMessagesRejected(self):
+        for line in OtherMessages:
+            self.assertIdentical(decodePeriodicUpdate(line), None, line)
+
+
+class PeriodicReadingTests(unittest.TestCase):
+
+    def test_wholeHouseSensor(self):
+        reading = decodePeriodicReading(PeriodicMessages[0], 3)
+        self.assertEqual(readingFields(reading),
+                         (18.7, 1, 0, (345, 2151, 0), None, None, 'CC128-v0.11', '00089'))
+
+    def test_clampCount(self):
+        """ Only the channels of the clamps fitted are held """
+        self.assertEqual(decodePeriodicReading(PeriodicMessages[0], 2).watts, (345, 2151))
+
+    def test_otherSensorsHaveOneChannel(self):
+        line = '<msg><sensor>3</sensor><type>1</type><ch1><watts>12</watts></ch1><ch2><watts>7</watts></ch2></msg>'
+        self.assertEqual(decodePeriodicReading(line, 3).watts, (12,))
+
+    def test_optiSmartSensor(self):
+        reading = decodePeriodicReading(PeriodicMessages[2], 3)
+        self.assertEqual(readingFields(reading),
+                         (None, 2, 9, (), 89466, 1000, 'CC128-v1.29', '00089'))
+
+    def test_bytesAndFrames(self):
+        for line in PeriodicMessages:
+            expected = readingFields(decodePeriodicReading(line, 3))
+            self.assertEqual(readingFields(decodePeriodicReading(line.encode('ascii'), 3)), expected)
+            frame = memoryview(line.strip().encode('ascii')) if bytes is not str else line.strip()
+            self.assertEqual(readingFields(decodePeriodicReadingFrame(frame, 3)), expected)
+
+    def test_otherMessagesRejected(self):
+        for line in OtherMessages:
+            self.assertIdentical(decodePeriodicReading(line, 3), None, line)
+
+    def test_firstRepeatedElementIsUsed(self):
+        line = '<msg><sensor>0</sensor><type>1</type><ch1><watts>7</watts></ch1><ch1><watts>9</watts></ch1></msg>'
+        self.assertEqual(decodePeriodicReading(line, 3).watts, (7,))
+
+    def test_invalidNumberRejected(self):
+        self.assertIdentical(decodePeriodicReading('<msg><sensor>x</sensor><type>1</type></msg>', 3), None)
+        self.assertIdentical(decodePeriodicReading('<msg><type>1</type></msg>', 3), None)
+
+
+class HistoryDecoderTests(unittest.TestCase):
+
+    def test_decodeHistoryLine(self):
+        update = decodeHistoryLine(OtherMessages[0])
+        self.assertEqual(update.source, 'CC128-v0.11')
+        self.assertEqual(update.days_since_wiped, '00032')
+        self.assertEqual(update.sensor_type, 1)
+        self.assertEqual(update.sensor_units, 'kwhr')
+        self.assertEqual(update.sensors,
+                         [(0, [('h024', '001.1'), ('h022', '000.9'), ('h020', '000.3'), ('h018', '000.4')])])
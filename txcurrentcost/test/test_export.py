@@ -0,0 +1,199 @@
+'''
+Tests for txcurrentcost.export.
+'''
+
+import json
+import os
+from twisted.internet import defer, reactor, task
+from twisted.trial import unittest
+from twisted.web import resource, server
+from txcurrentcost.export import ExportError, Exporter, HTTPSender
+from txcurrentcost.metrics import ExporterMetrics, MetricsRegistry
+
+
+class FakeSender(object):
+    """ Record each batch sent and return a Deferred the test fires """
+
+    def __init__(self):
+        self.batches = []
+        self.results = []
+
+    def __call__(self, batch):
+        self.batches.append(batch)
+        d = defer.Deferred()
+        self.results.append(d)
+        return d
+
+
+class ExporterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.sender = FakeSender()
+        self.exporter = Exporter(self.sender, clock=self.clock, max_queue=5, max_batch=2, max_delay=1.0,
+                                 initial_backoff=1.0, max_backoff=4.0, timeout=10.0)
+
+    def test_sentWhenBatchFull(self):
+        self.exporter.add(1)
+        self.assertEqual(self.sender.batches, [])
+        self.exporter.add(2)
+        self.assertEqual(self.sender.batches, [[1, 2]])
+
+    def test_sentAfterMaxDelay(self):
+        self.exporter.add(1)
+        self.clock.advance(1.0)
+        self.assertEqual(self.sender.batches, [[1]])
+
+    def test_oneBatchInFlight(self):
+        for item in range(4):
+            self.exporter.add(item)
+        self.assertEqual(self.sender.batches, [[0, 1]])
+        self.sender.results[0].callback(None)
+        self.assertEqual(self.sender.batches, [[0, 1], [2, 3]])
+        self.sender.results[1].callback(None)
+        self.assertEqual(len(self.exporter), 0)
+
+    def test_retryWithBackoff(self):
+        self.exporter.add(1)
+        self.exporter.add(2)
+        for delay in (1.0, 2.0, 4.0, 4.0):
+            self.sender.results[-1].errback(ExportError("rejected"))
+            sent = len(self.sender.batches)
+            self.clock.advance(delay - 0.1)
+            self.assertEqual(len(self.sender.batches), sent)
+            self.clock.advance(0.1)
+            self.assertEqual(self.sender.batches[-1], [1, 2])
+        self.sender.results[-1].callback(None)
+        self.assertEqual(len(self.exporter), 0)
+
+    def test_timeout(self):
+        """ A batch that is never answered is cancelled and retried """
+        self.exporter.add(1)
+        self.exporter.add(2)
+        self.clock.advance(10.0)
+        self.assertEqual(len(self.sender.batches), 1)
+        self.clock.advance(1.0)
+        self.assertEqual(self.sender.batches, [[1, 2], [1, 2]])
+
+    def test_dropWhenFull(self):
+        self.exporter.max_batch = 10
+        results = [self.exporter.add(item) for item in range(6)]
+        self.assertEqual(results, [True] * 5 + [False])
+        self.assertTrue(self.exporter.full)
+
+    def test_spill(self):
+        path = self.mktemp()
+        exporter = Exporter(self.sender, clock=self.clock, max_queue=2, max_batch=2, spill_path=path)
+        for item in range(5):
+            exporter.add({'n': item})
+        self.assertEqual(len(exporter), 5)
+        self.assertTrue(os.path.exists(path))
+        self.sender.results[0].callback(None)
+        self.assertEqual(self.sender.batches[1], [{'n': 2}, {'n': 3}])
+        self.sender.results[1].callback(None)
+        self.clock.advance(1.0)
+        self.assertEqual(self.sender.batches[2], [{'n': 4}])
+        self.assertFalse(os.path.exists(path))
+
+    def test_spillRecovered(self):
+        """ Items spilled by a previous run are queued again """
+        path = self.mktemp()
+        exporter = Exporter(self.sender, clock=self.clock, max_queue=1, max_batch=10, spill_path=path)
+        for item in range(3):
+            exporter.add(item)
+        exporter.stop()
+        recovered = Exporter(FakeSender(), clock=self.clock, max_queue=10, max_batch=10, spill_path=path)
+        self.assertEqual(len(recovered), 2)
+        self.clock.advance(1.0)
+        self.assertEqual(recovered.sender.batches, [[1, 2]])
+
+
+class ReadingsResource(resource.Resource):
+    """
+    Record each posted batch and respond with the next status code, the
+    last code being used once the others have been used.
+    """
+
+    isLeaf = True
+
+    def __init__(self, codes):
+        resource.Resource.__init__(self)
+        self.codes = list(codes)
+        self.requests = []
+
+    def render_POST(self, request):
+        code = self.codes.pop(0) if len(self.codes) > 1 else self.codes[0]
+        self.requests.append((reactor.seconds(), request.getHeader(b'x-api-key'),
+                              json.loads(request.content.read().decode('utf-8'))))
+        request.setResponseCode(code)
+        return b''
+
+
+class TrackingSite(server.Site):
+    """ A site holding a Deferred for each connection that fires once it is lost """
+
+    def __init__(self, resource):
+        server.Site.__init__(self, resource)
+        self.lost = []
+
+    def buildProtocol(self, addr):
+        protocol = server.Site.buildProtocol(self, addr)
+        lost = defer.Deferred()
+        self.lost.append(lost)
+        connectionLost = protocol.connectionLost
+
+        def notify(reason):
+            connectionLost(reason)
+            lost.callback(None)
+        protocol.connectionLost = notify
+        return protocol
+
+
+class HTTPSenderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.resource = ReadingsResource([503, 500, 200])
+        self.site = TrackingSite(self.resource)
+        port = reactor.listenTCP(0, self.site, interface='127.0.0.1')
+        self.addCleanup(port.stopListening)
+        self.sender = HTTPSender('http://127.0.0.1:%i/readings' % port.getHost().port,
+                                 headers={b'X-API-Key': b'secret'})
+        self.addCleanup(self.closeConnections)
+        self.registry = MetricsRegistry()
+        self.exporter = Exporter(self.sender, max_batch=2, initial_backoff=0.1, max_backoff=0.15,
+                                 metrics=ExporterMetrics(self.registry, 'http'))
+        self.addCleanup(self.exporter.stop)
+
+    def closeConnections(self):
+        d = self.sender.close()
+        d.addCallback(lambda _: defer.gatherResults(self.site.lost))
+        return d
+
+    @defer.inlineCallbacks
+    def waitForExport(self):
+        while len(self.exporter):
+            yield task.deferLater(reactor, 0.01, lambda: None)
+
+    def test_retryOnServerError(self):
+        """
+        A batch refused with a 5xx response is posted again after a backoff
+        that doubles up to the maximum, until it is accepted.
+        """
+        self.exporter.add({'watts': 345})
+        self.exporter.add({'watts': 2151})
+
+        def exported(_):
+            self.assertEqual([(key, batch) for _, key, batch in self.resource.requests],
+                             [(b'secret', [{'watts': 345}, {'watts': 2151}])] * 3)
+            times = [when for when, _, _ in self.resource.requests]
+            self.assertTrue(times[1] - times[0] >= 0.1)
+            self.assertTrue(times[2] - times[1] >= 0.15)
+            snapshot = self.registry.snapshot()
+            self.assertEqual(snapshot['export_retries_total'], [({'exporter': 'http'}, 2)])
+            self.assertEqual(snapshot['exported_total'], [({'exporter': 'http'}, 2)])
+        return self.waitForExport().addCallback(exported)
+
+    def test_failedResponse(self):
+        self.resource.codes = [500]
+        d = self.sender([1, 2])
+        return self.assertFailure(d, ExportError)
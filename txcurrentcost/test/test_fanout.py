@@ -0,0 +1,66 @@
+'''
+Tests for txcurrentcost.fanout.
+'''
+
+import json
+from twisted.internet import address
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+from txcurrentcost.fanout import FanoutFactory
+
+
+class FanoutFactoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = FanoutFactory(max_buffer=100)
+
+    def subscribe(self):
+        subscriber = self.factory.buildProtocol(address.IPv4Address('TCP', '127.0.0.1', 0))
+        transport = StringTransport()
+        subscriber.makeConnection(transport)
+        return subscriber, transport
+
+    def test_publish(self):
+        transports = [self.subscribe()[1] for _ in range(2)]
+        self.factory.publish({'sensor_type': 1, 'sensor_data': ['00345']})
+        for transport in transports:
+            data = transport.value()
+            self.assertIsInstance(data, bytes)
+            self.assertTrue(data.endswith(b'\n'))
+            self.assertEqual(json.loads(data.decode('utf-8')), {'sensor_type': 1, 'sensor_data': ['00345']})
+
+    def test_unsupportedValuesSentAsStrings(self):
+        transport = self.subscribe()[1]
+        self.factory.publish({'timestamp': object})
+        self.assertIn(b'"timestamp": "', transport.value())
+
+    def test_disconnect(self):
+        subscriber, transport = self.subscribe()
+        subscriber.connectionLost(None)
+        self.factory.publish({'n': 1})
+        self.assertEqual(transport.value(), b'')
+        self.assertEqual(self.factory.subscribers, set())
+
+    def test_slowSubscriberDropped(self):
+        slow, slowTransport = self.subscribe()
+        fast, fastTransport = self.subscribe()
+        slow.pauseProducing()
+        for n in range(10):
+            self.factory.publish({'n': n, 'padding': 'x' * 10})
+        self.assertTrue(slowTransport.disconnecting)
+        self.assertEqual(self.factory.subscribers, set([fast]))
+        self.assertEqual(fastTransport.value().count(b'\n'), 10)
+
+    def test_resumedSubscriberKept(self):
+        subscriber, transport = self.subscribe()
+        subscriber.pauseProducing()
+        self.factory.publish({'padding': 'x' * 80})
+        subscriber.resumeProducing()
+        subscriber.pauseProducing()
+        self.factory.publish({'padding': 'x' * 80})
+        self.assertFalse(transport.disconnecting)
+
+    def test_close(self):
+        transport = self.subscribe()[1]
+        self.factory.close()
+        self.assertTrue(transport.disconnecting)
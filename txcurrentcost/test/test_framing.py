@@ -0,0 +1,64 @@
+'''
+Tests for txcurrentcost.framing.
+'''
+
+from twisted.trial import unittest
+from txcurrentcost.framing import MessageFramer
+
+
+class MessageFramerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.frames = []
+        # Frames are only valid during the call so they are copied.
+        self.framer = MessageFramer(lambda frame: self.frames.append(bytes(frame)), max_frame=64)
+
+    def test_messagesInOneChunk(self):
+        self.framer.feed(b'<msg>a</msg>\r\n<msg>b</msg>\r\n')
+        self.assertEqual(self.frames, [b'<msg>a</msg>', b'<msg>b</msg>'])
+        self.assertEqual(self.framer.discarded, 0)
+
+    def test_messageSplitAcrossChunks(self):
+        for chunk in (b'<m', b'sg>a</m', b'sg', b'>\n'):
+            self.framer.feed(chunk)
+        self.assertEqual(self.frames, [b'<msg>a</msg>'])
+
+    def test_noiseIsDiscarded(self):
+        self.framer.feed(b'\x00\xffnoise<msg>a</msg>')
+        self.assertEqual(self.frames, [b'<msg>a</msg>'])
+        self.assertEqual(self.framer.discarded, 7)
+
+    def test_messageWithoutNewLine(self):
+        self.framer.feed(b'<msg>a</msg><msg>b</msg>')
+        self.assertEqual(self.frames, [b'<msg>a</msg>', b'<msg>b</msg>'])
+
+    def test_interruptedMessageIsDiscarded(self):
+        self.framer.feed(b'<msg>partial<msg>b</msg>')
+        self.assertEqual(self.frames, [b'<msg>b</msg>'])
+        self.assertEqual(self.framer.discarded, len(b'<msg>partial'))
+
+    def test_unclosedMessageResynchronises(self):
+        self.framer.feed(b'<msg>' + b'x' * 100)
+        self.framer.feed(b'<msg>b</msg>')
+        self.assertEqual(self.frames, [b'<msg>b</msg>'])
+
+    def test_oversizedMessageIsDiscarded(self):
+        self.framer.feed(b'<msg>' + b'x' * 100 + b'</msg><msg>b</msg>')
+        self.assertEqual(self.frames, [b'<msg>b</msg>'])
+
+    def test_handlerFailureRemovesFramedData(self):
+        """
+        Framed data is removed from the buffer even if the frame handler
+        raises.
+        """
+        def fail(frame):
+            raise ValueError(bytes(frame))
+        framer = MessageFramer(fail)
+        self.assertRaises(ValueError, framer.feed, b'<msg>a</msg>')
+        self.assertEqual(len(framer.buffer), 0)
+
+    def test_clear(self):
+        self.framer.feed(b'<msg>part')
+        self.framer.clear()
+        self.framer.feed(b'</msg><msg>b</msg>')
+        self.assertEqual(self.frames, [b'<msg>b</msg>'])
@@ -0,0 +1,88 @@
+'''
+Tests for txcurrentcost.metrics.
+'''
+
+from twisted.internet import reactor
+from twisted.trial import unittest
+from twisted.web.client import Agent, readBody
+from txcurrentcost.core import CurrentCostMessageReceiver
+from txcurrentcost.metrics import MetricsRegistry, MonitorMetrics, listenMetrics
+from txcurrentcost.test.test_decoder import PeriodicMessages
+
+
+class RenderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counterAndGauge(self):
+        self.registry.counter('lines_total', 'Lines received', device='b').inc(3)
+        self.registry.counter('lines_total', 'Lines received', device='a').inc()
+        self.registry.gauge('depth', 'Queue depth').set(7)
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# HELP currentcost_depth Queue depth',
+            '# TYPE currentcost_depth gauge',
+            'currentcost_depth 7',
+            '# HELP currentcost_lines_total Lines received',
+            '# TYPE currentcost_lines_total counter',
+            'currentcost_lines_total{device="a"} 1',
+            'currentcost_lines_total{device="b"} 3',
+            '']))
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('seconds', 'Durations', buckets=(0.5, 1.0), device='a')
+        histogram.observe(0.25)
+        histogram.observe(0.5)
+        histogram.observe(2.0)
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# HELP currentcost_seconds Durations',
+            '# TYPE currentcost_seconds histogram',
+            'currentcost_seconds_bucket{device="a",le="0.5"} 2',
+            'currentcost_seconds_bucket{device="a",le="1.0"} 2',
+            'currentcost_seconds_bucket{device="a",le="+Inf"} 3',
+            'currentcost_seconds_sum{device="a"} 2.75',
+            'currentcost_seconds_count{device="a"} 3',
+            '']))
+
+    def test_labelEscaping(self):
+        self.registry.counter('total', 'Total', device='a "b" \\c').inc()
+        self.assertIn('currentcost_total{device="a \\"b\\" \\\\c"} 1', self.registry.render().split('\n'))
+
+    def test_sameMetricReturned(self):
+        self.assertIdentical(self.registry.counter('total', 'Total', device='a'),
+                             self.registry.counter('total', 'Total', device='a'))
+        self.assertNotIdentical(self.registry.counter('total', 'Total', device='a'),
+                                self.registry.counter('total', 'Total', device='b'))
+
+    def test_receiverMetrics(self):
+        metrics = MonitorMetrics(self.registry, 'house')
+        receiver = CurrentCostMessageReceiver(lambda kind, message: None, metrics=metrics)
+        data = b''.join(line.encode('ascii') + b'\r\n' for line in PeriodicMessages)
+        receiver.dataReceived(data)
+        snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot['bytes_received_total'], [({'device': 'house'}, len(data))])
+        self.assertEqual(snapshot['lines_framed_total'], [({'device': 'house'}, len(PeriodicMessages))])
+        self.assertEqual(snapshot['parse_errors_total'], [({'device': 'house'}, 0)])
+
+
+class MetricsEndpointTests(unittest.TestCase):
+
+    def test_get(self):
+        registry = MetricsRegistry()
+        registry.counter('lines_total', 'Lines received', device='a').inc(5)
+        port = listenMetrics(registry, 0)
+        self.addCleanup(port.stopListening)
+        self.assertEqual(port.getHost().host, '127.0.0.1')
+
+        url = 'http://127.0.0.1:%i/metrics' % port.getHost().port
+        d = Agent(reactor).request(b'GET', url.encode('ascii'))
+
+        def received(response):
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.headers.getRawHeaders(b'content-type'), [b'text/plain; version=0.0.4'])
+            return readBody(response)
+
+        def read(body):
+            self.assertEqual(body.decode('utf-8'), registry.render())
+        d.addCallback(received)
+        return d.addCallback(read)
@@ -0,0 +1,202 @@
+'''
+Tests for txcurrentcost.monitor.
+'''
+
+from twisted.internet import task
+from twisted.trial import unittest
+from txcurrentcost.core import CurrentCostMessageReceiver
+from txcurrentcost.metrics import MetricsRegistry, MonitorMetrics
+from txcurrentcost.monitor import Monitor
+from txcurrentcost.test.test_decoder import PeriodicMessages
+
+
+class Config(object):
+    port = '/dev/null'
+    baudrate = 57600
+    clamp_count = 3
+    use_utc_timestamps = False
+
+
+class RecordingMonitor(Monitor):
+
+    def __init__(self):
+        Monitor.__init__(self, Config(), task.Clock())
+        self.updates = []
+        self.readings = []
+        self.history = []
+
+    def periodicUpdateReceived(self, timestamp, temperature, sensor_type, sensor_instance, sensor_data):
+        self.updates.append((temperature, sensor_type, sensor_instance, sensor_data))
+
+    def periodicReadingReceived(self, reading):
+        self.readings.append(reading)
+
+    def historyUpdateReceived(self, sensor_type, sensorHistoryData):
+        self.history.append((self.clock.seconds(), sensor_type, sorted(sensorHistoryData)))
+
+    def receive(self, line, clampCount=None):
+        receiver = CurrentCostMessageReceiver(self._messageHandler, clampCount=clampCount)
+        receiver.dataReceived(line.encode('ascii') + b'\r\n')
+
+
+def historyMessage(sensor_instance, tags, sensor_type=1):
+    """ Return a history update message line holding a value for each tag """
+    values = ''.join('<%s>001.5</%s>' % (tag, tag) for tag in tags)
+    return ('<msg><src>CC128-v0.11</src><dsb>00089</dsb><time>13:10:50</time><hist><dsw>00032</dsw>'
+            '<type>%i</type><units>kwhr</units><data><sensor>%i</sensor>%s</data></hist></msg>' % (
+                sensor_type, sensor_instance, values))
+
+
+# The history messages of a cycle for two sensors
+HistoryCycle = [historyMessage(0, ['h002', 'h004']),
+                historyMessage(0, ['d001']),
+                historyMessage(1, ['h002', 'h004'])]
+
+
+class PeriodicUpdateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.monitor = RecordingMonitor()
+
+    def test_periodicUpdate(self):
+        self.monitor.receive(PeriodicMessages[0])
+        self.assertEqual(self.monitor.updates, [('18.7', 1, 0, ['00345', '02151', '00000'])])
+        self.assertEqual(self.monitor.source, 'CC128-v0.11')
+
+    def test_typedReadingDecodedByReceiver(self):
+        self.monitor.typedReadings = True
+        self.monitor.receive(PeriodicMessages[0], self.monitor._readingClampCount())
+        self.assertEqual([reading.watts for reading in self.monitor.readings], [(345, 2151, 0)])
+        self.assertEqual(self.monitor.source, 'CC128-v0.11')
+        self.assertEqual(self.monitor.days_since_birth, '00089')
+
+    def test_typedReadingFallback(self):
+        """
+        A message the fast path rejects is still delivered as a typed reading.
+        """
+        self.monitor.typedReadings = True
+        self.monitor.receive('<msg><src>CC&amp;128</src><sensor>3</sensor><type>1</type>'
+                             '<ch1><watts>00012</watts></ch1></msg>', self.monitor._readingClampCount())
+        self.assertEqual([reading.watts for reading in self.monitor.readings], [(12,)])
+        self.assertEqual(self.monitor.source, 'CC&128')
+
+    def test_unsupportedSensorType(self):
+        self.monitor.typedReadings = True
+        self.monitor.receive('<msg><sensor>1</sensor><type>7</type></msg>', self.monitor._readingClampCount())
+        self.assertEqual(self.monitor.readings, [])
+
+
+class HistoryCycleTests(unittest.TestCase):
+    """
+    A history cycle completes once every expected datapoint tag has been
+    received or, failing that, once no history message has been received
+    for the timeout.
+    """
+
+    def setUp(self):
+        self.monitor = RecordingMonitor()
+        self.clock = self.monitor.clock
+        self.registry = MetricsRegistry()
+        self.monitor.metrics = MonitorMetrics(self.registry, 'house')
+        self.timeout = self.monitor.historicDataMessageTimeout
+
+    def receiveCycle(self, messages=HistoryCycle, interval=1.0):
+        for line in messages:
+            self.clock.advance(interval)
+            self.monitor.receive(line)
+
+    def cycles(self):
+        return dict((labels['reason'], count)
+                    for labels, count in self.registry.snapshot().get('history_cycles_total', []))
+
+    def test_firstCycleCompletesOnTimeout(self):
+        """ The tags of the first cycle are learned from the cycle itself """
+        self.receiveCycle()
+        self.clock.advance(self.timeout - 0.5)
+        self.assertEqual(self.monitor.history, [])
+        self.clock.advance(0.5)
+        self.assertEqual(self.monitor.history, [(3.0 + self.timeout, 1, [0, 1])])
+        self.assertEqual(self.cycles(), {'timeout': 1})
+        self.assertEqual(self.monitor.expectedHistory[1],
+                         set([(0, 'h002'), (0, 'h004'), (0, 'd001'), (1, 'h002'), (1, 'h004')]))
+
+    def test_completeCycleDeliveredEarly(self):
+        self.receiveCycle()
+        self.clock.advance(self.timeout)
+        self.receiveCycle(HistoryCycle[:-1])
+        self.assertEqual(len(self.monitor.history), 1)
+        self.receiveCycle(HistoryCycle[-1:])
+        self.assertEqual(len(self.monitor.history), 2)
+        self.assertEqual(self.monitor.history[1], (self.clock.seconds(), 1, [0, 1]))
+        self.assertEqual(self.cycles(), {'timeout': 1, 'structure': 1})
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_configuredExpectedHistory(self):
+        """ The expected tags can be configured for the first cycle """
+        self.monitor.expectedHistory[1] = set([(0, 'h002'), (0, 'h004'), (0, 'd001')])
+        self.receiveCycle(HistoryCycle[:2])
+        self.assertEqual(self.monitor.history, [(2.0, 1, [0])])
+        self.assertEqual(self.cycles(), {'structure': 1})
+
+    def test_lateMessageStartsPartialCycle(self):
+        """
+        A history message received after a cycle completed early starts a
+        new cycle, which can only complete on the timeout.
+        """
+        self.receiveCycle()
+        self.clock.advance(self.timeout)
+        self.receiveCycle()
+        self.receiveCycle(HistoryCycle[-1:])
+        self.assertEqual(len(self.monitor.history), 2)
+        self.clock.advance(self.timeout - 0.5)
+        self.assertEqual(len(self.monitor.history), 2)
+        self.clock.advance(0.5)
+        self.assertEqual(len(self.monitor.history), 3)
+        self.assertEqual(self.cycles(), {'timeout': 2, 'structure': 1})
+
+    def test_expectedHistoryShrinks(self):
+        """
+        Once a sensor stops sending history for historyShrinkCycles cycles
+        its tags are no longer expected and cycles complete early again.
+        """
+        self.receiveCycle()
+        self.clock.advance(self.timeout)
+        for n in range(self.monitor.historyShrinkCycles):
+            self.receiveCycle(HistoryCycle[:2])
+            self.assertEqual(len(self.monitor.history), n + 1)
+            self.clock.advance(self.timeout)
+            self.assertEqual(len(self.monitor.history), n + 2)
+        self.assertEqual(self.monitor.expectedHistory[1], set([(0, 'h002'), (0, 'h004'), (0, 'd001')]))
+
+        self.receiveCycle(HistoryCycle[:2])
+        self.assertEqual(len(self.monitor.history), self.monitor.historyShrinkCycles + 2)
+        self.assertEqual(self.cycles(), {'timeout': self.monitor.historyShrinkCycles + 1, 'structure': 1})
+
+
+class ExpectedHistoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.monitor = RecordingMonitor()
+        self.full = set([(0, 'h002'), (0, 'h004'), (1, 'h002')])
+        self.monitor._updateExpectedHistory(1, set(self.full))
+
+    def test_newTagsAdded(self):
+        """ A partial cycle holding a new tag adds it to the expected tags """
+        self.monitor._updateExpectedHistory(1, set([(0, 'h002'), (2, 'h002')]))
+        self.assertEqual(self.monitor.expectedHistory[1], self.full | set([(2, 'h002')]))
+
+    def test_shrinkAfterConsecutiveShortCycles(self):
+        received = set([(0, 'h002'), (0, 'h004')])
+        for _ in range(self.monitor.historyShrinkCycles - 1):
+            self.monitor._updateExpectedHistory(1, received)
+            self.assertEqual(self.monitor.expectedHistory[1], self.full)
+        self.monitor._updateExpectedHistory(1, received)
+        self.assertEqual(self.monitor.expectedHistory[1], received)
+
+    def test_completeCycleResetsShrinking(self):
+        received = set([(0, 'h002'), (0, 'h004')])
+        for _ in range(self.monitor.historyShrinkCycles - 1):
+            self.monitor._updateExpectedHistory(1, received)
+        self.monitor._updateExpectedHistory(1, set(self.full))
+        self.monitor._updateExpectedHistory(1, received)
+        self.assertEqual(self.monitor.expectedHistory[1], self.full)
@@ -0,0 +1,38 @@
+'''
+Tests for txcurrentcost.
+'''
+
+import os
+import subprocess
+import sys
+from twisted.trial import unittest
+import txcurrentcost
+from txcurrentcost import serialport
+
+
+class PackageTests(unittest.TestCase):
+
+    def test_importDoesNotImportReactor(self):
+        """
+        Importing the package does not install the Twisted reactor.
+        """
+        code = ("import sys\n"
+                "import txcurrentcost\n"
+                "sys.exit('twisted.internet.reactor' in sys.modules)\n")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        self.assertEqual(subprocess.call([sys.executable, '-c', code], env=env), 0)
+
+    def test_lazyAttributes(self):
+        self.assertIs(txcurrentcost.FixedSerialPort, serialport.FixedSerialPort)
+        self.assertIs(txcurrentcost.CurrentCostDataProtocol, serialport.CurrentCostDataProtocol)
+
+    def test_unknownAttribute(self):
+        self.assertRaises(AttributeError, getattr, txcurrentcost, 'Missing')
+
+    def test_all(self):
+        """
+        Every name in __all__, including the lazy attributes, resolves.
+        """
+        for name in txcurrentcost.__all__:
+            self.assertTrue(hasattr(txcurrentcost, name), name)
+        self.assertIn('FixedSerialPort', dir(txcurrentcost))
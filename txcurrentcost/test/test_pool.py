@@ -0,0 +1,72 @@
+'''
+Tests for txcurrentcost.pool.
+'''
+
+from twisted.internet import task
+from twisted.trial import unittest
+from txcurrentcost.pool import DeviceConfig, MonitorPool
+from txcurrentcost.replay import ReplayPortFactory
+from txcurrentcost.test.test_decoder import PeriodicMessages
+
+
+class PoolConfig(object):
+
+    def __init__(self, device_ids):
+        self.devices = [DeviceConfig(device_id, '/dev/null', 57600, 3, True) for device_id in device_ids]
+
+
+class RecordingPool(MonitorPool):
+
+    def __init__(self, config, clock):
+        MonitorPool.__init__(self, config, clock)
+        self.updates = []
+        self.readings = []
+        self.batches = []
+
+    def periodicUpdateReceived(self, device_id, timestamp, temperature, sensor_type, sensor_instance, sensor_data):
+        self.updates.append((device_id, sensor_instance))
+
+    def periodicReadingReceived(self, device_id, reading):
+        self.readings.append((device_id, reading.sensor_instance, reading.watts))
+
+    def periodicBatchReceived(self, device_id, batch):
+        self.batches.append((device_id, list(batch.sensor_instances)))
+
+
+class MonitorPoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.pool = RecordingPool(PoolConfig(['kitchen', 'garage']), self.clock)
+
+    def replay(self, lines):
+        """ Feed each device in the pool the lines, one per second """
+        for monitor in self.pool.monitors.values():
+            monitor.portFactory = ReplayPortFactory([(1.0, line) for line in lines])
+        self.pool.start()
+        self.clock.pump([1.0] * len(lines))
+
+    def test_periodicUpdates(self):
+        self.replay(PeriodicMessages[:2])
+        self.assertEqual(sorted(self.pool.updates),
+                         [('garage', 0), ('garage', 3), ('kitchen', 0), ('kitchen', 3)])
+        self.pool.stop()
+
+    def test_typedReadings(self):
+        self.pool.enableTypedReadings()
+        self.replay(PeriodicMessages[:2])
+        self.assertEqual(sorted(self.pool.readings),
+                         [('garage', 0, (345, 2151, 0)), ('garage', 3, (12,)),
+                          ('kitchen', 0, (345, 2151, 0)), ('kitchen', 3, (12,))])
+        self.assertEqual(self.pool.updates, [])
+        self.pool.stop()
+
+    def test_periodicBatching(self):
+        """ Each device in the pool delivers its own batches """
+        self.pool.enablePeriodicBatching(max_count=2, max_delay=10.0)
+        self.replay(PeriodicMessages[:3])
+        self.assertEqual(sorted(self.pool.batches), [('garage', [0, 3]), ('kitchen', [0, 3])])
+        self.pool.stop()
+        self.assertEqual(sorted(self.pool.batches),
+                         [('garage', [0, 3]), ('garage', [9]), ('kitchen', [0, 3]), ('kitchen', [9])])
+        self.assertEqual(self.pool.updates, [])
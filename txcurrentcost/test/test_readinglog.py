@@ -0,0 +1,103 @@
+'''
+Tests for txcurrentcost.readinglog.
+'''
+
+import os
+from twisted.internet import task
+from twisted.trial import unittest
+from txcurrentcost import readinglog
+from txcurrentcost.readinglog import LegacyRecord, Reading, ReadingLog, ReadingLogReader
+
+
+class ReadingLogTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = self.mktemp()
+        self.clock = task.Clock()
+
+    def open(self, **kw):
+        log = ReadingLog(self.directory, clock=self.clock, **kw)
+        self.addCleanup(log.close)
+        return log
+
+    def read(self, start=0, end=1e12, device=None):
+        reader = ReadingLogReader(self.directory)
+        self.addCleanup(reader.close)
+        return list(reader.between(start, end, device))
+
+    def test_roundTrip(self):
+        log = self.open()
+        log.device("house").append(100.0, "18.7", 1, 0, ["00345", "02151"])
+        log.append(106.0, "garage", 2, 9, None, ["123456789", "1000"])
+        log.flush()
+        readings = self.read()
+        self.assertEqual(readings[0], Reading(100.0, "house", 1, 0, 18.7, (345.0, 2151.0)))
+        # Impulse counts are stored exactly.
+        self.assertEqual(readings[1].values, (123456789.0, 1000.0))
+        self.assertNotEqual(readings[1].temperature, readings[1].temperature)
+
+    def test_flushCount(self):
+        log = self.open(flush_count=2)
+        log.append(100.0, "house", 1, 0, "18.7", [1])
+        self.assertEqual(self.read(), [])
+        log.append(106.0, "house", 1, 0, "18.7", [2])
+        self.assertEqual(len(self.read()), 2)
+
+    def test_flushInterval(self):
+        log = self.open(flush_interval=1.0)
+        log.append(100.0, "house", 1, 0, "18.7", [1])
+        self.clock.advance(1.0)
+        self.assertEqual(len(self.read()), 1)
+
+    def test_timeRangeAndDevice(self):
+        log = self.open()
+        for n in range(10):
+            log.append(100.0 + n, "house" if n % 2 else "garage", 1, 0, None, [n])
+        log.flush()
+        self.assertEqual([reading.timestamp for reading in self.read(103, 107)], [103, 104, 105, 106])
+        self.assertEqual([reading.timestamp for reading in self.read(103, 107, "house")], [103, 105])
+
+    def test_segments(self):
+        log = self.open(segment_size=readinglog.SegmentHeader.size + 3 * readinglog.Record.size)
+        for n in range(7):
+            log.append(100.0 + n, "house", 1, 0, None, [n])
+        log.flush()
+        self.assertEqual(len(readinglog._segmentNumbers(self.directory)), 3)
+        self.assertEqual([reading.timestamp for reading in self.read(102, 106)], [102, 103, 104, 105])
+
+    def test_reopen(self):
+        """ A reopened log continues its last segment """
+        log = self.open()
+        log.append(100.0, "house", 1, 0, None, [1])
+        log.close()
+        log = self.open()
+        log.append(106.0, "house", 1, 0, None, [2])
+        log.flush()
+        self.assertEqual(readinglog._segmentNumbers(self.directory), [0])
+        self.assertEqual(len(self.read()), 2)
+
+    def test_partialRecordDiscarded(self):
+        log = self.open()
+        log.append(100.0, "house", 1, 0, None, [1])
+        log.close()
+        with open(readinglog._segmentPath(self.directory, 0), 'ab') as segment:
+            segment.write(b'partial')
+        log = self.open()
+        log.append(106.0, "house", 1, 0, None, [2])
+        log.flush()
+        self.assertEqual([reading.values for reading in self.read()], [(1.0,), (2.0,)])
+
+    def test_legacySegment(self):
+        """
+        Version 1 segments are read and the log continues in a new segment.
+        """
+        os.makedirs(self.directory)
+        with open(readinglog._segmentPath(self.directory, 0), 'wb') as segment:
+            segment.write(LegacyRecord.pack(100.0, b"house", 1, 0, 1, 18.5, 345.0, float('nan'), float('nan')))
+        log = self.open()
+        log.append(106.0, "house", 1, 0, None, [2])
+        log.flush()
+        self.assertEqual(readinglog._segmentNumbers(self.directory), [0, 1])
+        readings = self.read()
+        self.assertEqual(readings[0], Reading(100.0, "house", 1, 0, 18.5, (345.0,)))
+        self.assertEqual((readings[1].timestamp, readings[1].values), (106.0, (2.0,)))
@@ -0,0 +1,63 @@
+'''
+Tests for txcurrentcost.recent.
+'''
+
+from twisted.trial import unittest
+from txcurrentcost.recent import RecentReading, RecentReadings
+
+
+class RecentReadingsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.readings = RecentReadings(retention=60.0, capacity=4)
+
+    def test_last(self):
+        self.readings.add(0, '18.7', 1, 0, ['00100', '00200'])
+        self.readings.add(6, None, 1, 0, ['00300'])
+        self.assertEqual(self.readings.last(1, 0, 5),
+                         [RecentReading(0, 18.7, 1, 0, (100.0, 200.0)),
+                          RecentReading(6, None, 1, 0, (300.0,))])
+        self.assertEqual(self.readings.last(1, 0, 1), [RecentReading(6, None, 1, 0, (300.0,))])
+        self.assertEqual(self.readings.last(1, 1, 1), [])
+
+    def test_capacity(self):
+        for n in range(6):
+            self.readings.add(n, None, 1, 0, [n])
+        self.assertEqual([reading.timestamp for reading in self.readings.last(1, 0, 10)], [2, 3, 4, 5])
+
+    def test_retention(self):
+        self.readings.add(0, None, 1, 0, [1])
+        self.readings.add(30, None, 1, 0, [2])
+        self.assertEqual(len(self.readings.last(1, 0, 10, now=70)), 1)
+        self.assertIdentical(self.readings.sensor(1, 0).latest(now=100), None)
+
+    def test_clockSetBack(self):
+        """ A reading timestamped before the newest is stored at its time """
+        self.readings.add(10, None, 1, 0, [1])
+        self.readings.add(5, None, 1, 0, [2])
+        self.assertEqual([reading.timestamp for reading in self.readings.last(1, 0, 10)], [10, 10])
+
+    def test_between(self):
+        for n in range(4):
+            self.readings.add(n * 6, None, 1, 0, [n])
+        self.assertEqual([reading.values for reading in self.readings.sensor(1, 0).between(6, 18)],
+                         [(1.0,), (2.0,)])
+
+    def test_channel(self):
+        self.readings.add(0, None, 1, 0, [100, 200])
+        self.readings.add(6, None, 1, 0, [110])
+        self.readings.add(12, None, 1, 0, [120, 220])
+        self.assertEqual(self.readings.channel(1, 0, 2, 12, now=12), [(0, 200.0), (12, 220.0)])
+        self.assertEqual(self.readings.channel(1, 0, 1, 6, now=12), [(6, 110.0), (12, 120.0)])
+        self.assertEqual(self.readings.channel(1, 0, 4, 12, now=12), [])
+
+    def test_latest(self):
+        self.readings.add(0, None, 1, 0, [100])
+        self.readings.add(6, None, 2, 9, [89466, 1000])
+        latest = self.readings.latest()
+        self.assertEqual(sorted(latest), [(1, 0), (2, 9)])
+        self.assertEqual(latest[(2, 9)].values, (89466.0, 1000.0))
+
+    def test_forBudget(self):
+        readings = RecentReadings.forBudget(RecentReadings.SlotSize * 100, sensors=10)
+        self.assertEqual(readings.capacity, 10)
@@ -0,0 +1,117 @@
+'''
+Tests for txcurrentcost.replay.
+'''
+
+from twisted.internet import task
+from twisted.trial import unittest
+from txcurrentcost.monitor import Monitor
+from txcurrentcost.replay import DeviceSimulator, ReplayPortFactory, readCapturedLog
+from txcurrentcost.test.test_decoder import OtherMessages, PeriodicMessages
+
+
+class Config(object):
+    port = '/dev/null'
+    baudrate = 57600
+    clamp_count = 3
+    use_utc_timestamps = False
+
+
+class RecordingMonitor(Monitor):
+
+    def __init__(self, clock):
+        Monitor.__init__(self, Config(), clock)
+        self.updates = []
+        self.history = []
+
+    def periodicUpdateReceived(self, timestamp, temperature, sensor_type, sensor_instance, sensor_data):
+        self.updates.append((self.clock.seconds(), sensor_instance))
+
+    def historyUpdateReceived(self, sensor_type, sensorHistoryData):
+        self.history.append((self.clock.seconds(), sorted(sensorHistoryData)))
+
+
+class CapturedLogTests(unittest.TestCase):
+
+    def writeLog(self, lines):
+        path = self.mktemp()
+        with open(path, 'w') as log:
+            log.write('\n'.join(lines) + '\n')
+        return path
+
+    def test_delays(self):
+        first, second, third = [line.strip() for line in PeriodicMessages[:3]]
+        path = self.writeLog(['1000.0\t' + first,
+                              '1006.5\t' + second + '\r',
+                              '',
+                              third,
+                              '1020.0\t' + first,
+                              '1010.0\t' + second])
+        self.assertEqual(list(readCapturedLog(path, interval=4.0)),
+                         [(0.0, first), (6.5, second), (4.0, third), (4.0, first), (0.0, second)])
+
+    def test_acceleratedReplay(self):
+        """
+        A captured log replayed at ten times real speed delivers its periodic
+        updates, and its history cycle once the cycle times out, in a tenth
+        of the captured time.
+        """
+        path = self.writeLog(['1000.0\t' + PeriodicMessages[0],
+                              '1006.0\t' + PeriodicMessages[1],
+                              '1010.0\t' + OtherMessages[0],
+                              '1012.0\t' + PeriodicMessages[0]])
+        clock = task.Clock()
+        monitor = RecordingMonitor(clock)
+        monitor.portFactory = ReplayPortFactory(readCapturedLog(path), speed=10.0)
+        monitor.start()
+        finished = monitor.serialPort.finished
+
+        clock.advance(0)
+        self.assertEqual(monitor.updates, [(0.0, 0)])
+        clock.advance(0.5)
+        self.assertEqual(len(monitor.updates), 1)
+        clock.pump([0.1, 0.4, 0.2])
+        self.assertEqual(monitor.updates, [(0.0, 0), (0.6, 3), (1.2, 0)])
+        self.successResultOf(finished)
+
+        clock.advance(monitor.historicDataMessageTimeout - 0.3)
+        self.assertEqual(monitor.history, [])
+        clock.advance(0.1)
+        self.assertEqual([sensors for _, sensors in monitor.history], [[0]])
+        monitor.stop()
+
+
+class ReplayPortTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.monitor = RecordingMonitor(self.clock)
+
+    def test_simulatedDevice(self):
+        """ Each simulated sensor reports once per interval """
+        simulator = DeviceSimulator(sensor_count=3, clamp_count=3, history=False, duration=59.0, seed=1)
+        self.monitor.portFactory = ReplayPortFactory(simulator)
+        self.monitor.start()
+        self.clock.pump([0] + [1.0] * 60)
+        self.assertEqual([sensor for _, sensor in self.monitor.updates], [0, 1, 2] * 10)
+        self.assertEqual([when for when, _ in self.monitor.updates], [float(n) * 2 for n in range(30)])
+        self.successResultOf(self.monitor.serialPort.finished)
+
+    def test_asFastAsPossible(self):
+        simulator = DeviceSimulator(sensor_count=2, history=False, duration=6000.0, seed=1)
+        self.monitor.portFactory = ReplayPortFactory(simulator, speed=None)
+        self.monitor.start()
+        self.clock.advance(0)
+        self.assertEqual(len(self.monitor.updates), 2001)
+        self.successResultOf(self.monitor.serialPort.finished)
+        self.assertEqual(set(when for when, _ in self.monitor.updates), set([0.0]))
+
+    def test_stop(self):
+        self.monitor.portFactory = ReplayPortFactory(DeviceSimulator(history=False, seed=1))
+        self.monitor.start()
+        self.clock.advance(60)
+        count = len(self.monitor.updates)
+        self.monitor.stop()
+        self.successResultOf(self.monitor.serialPort.finished)
+        self.clock.advance(60)
+        self.assertEqual(len(self.monitor.updates), count)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
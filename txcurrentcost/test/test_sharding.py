@@ -0,0 +1,83 @@
+'''
+Tests for txcurrentcost.sharding.
+'''
+
+import datetime
+from twisted.trial import unittest
+from txcurrentcost.core import SensorHistoryData
+from txcurrentcost.decoder import PeriodicReading
+from txcurrentcost.sharding import ReadingRing, _historyFromJson, _historyToJson
+
+
+def readingFields(reading):
+    return (reading.timestamp, reading.monotonic, reading.temperature, reading.sensor_type,
+            reading.sensor_instance, reading.watts, reading.impulses, reading.impulses_per_unit)
+
+
+class ReadingRingTests(unittest.TestCase):
+
+    def setUp(self):
+        path = self.mktemp()
+        self.writer = ReadingRing(path, capacity=4)
+        self.reader = ReadingRing(path)
+        self.addCleanup(self.writer.close)
+        self.addCleanup(self.reader.close)
+
+    def test_roundTrip(self):
+        electricity = PeriodicReading(1.5, 2.5, 18.7, 1, 0, watts=(345, 2151, 0))
+        optiSmart = PeriodicReading(3.5, 4.5, None, 2, 9, impulses=89466, impulses_per_unit=None)
+        self.assertTrue(self.writer.put(0, electricity))
+        self.assertTrue(self.writer.put(3, optiSmart))
+        self.assertEqual(len(self.reader), 2)
+        readings = self.reader.drain()
+        self.assertEqual([device for device, _ in readings], [0, 3])
+        self.assertEqual([readingFields(reading) for _, reading in readings],
+                         [readingFields(electricity), readingFields(optiSmart)])
+        self.assertEqual(len(self.reader), 0)
+        self.assertEqual(self.reader.drain(), [])
+
+    def test_full(self):
+        reading = PeriodicReading(1.0, 1.0, None, 1, 0, watts=(1,))
+        results = [self.writer.put(n, reading) for n in range(6)]
+        self.assertEqual(results, [True] * 4 + [False] * 2)
+        self.assertEqual(self.reader.dropped, 2)
+        self.assertEqual([device for device, _ in self.reader.drain()], [0, 1, 2, 3])
+        # Slots are reused once read.
+        self.assertTrue(self.writer.put(6, reading))
+        self.assertEqual([device for device, _ in self.reader.drain()], [6])
+
+    def test_slotBeingStored(self):
+        """
+        A slot whose sequence number shows it is still being stored is left
+        for the next drain, along with the slots after it.
+        """
+        reading = PeriodicReading(1.0, 1.0, None, 1, 0, watts=(1,))
+        for n in range(3):
+            self.writer.put(n, reading)
+        offset = ReadingRing.Header.size + ReadingRing.Slot.size
+        ReadingRing.Count.pack_into(self.writer.map, offset, 3)
+        self.assertEqual([device for device, _ in self.reader.drain()], [0])
+        self.assertEqual(len(self.reader), 2)
+        ReadingRing.Count.pack_into(self.writer.map, offset, 4)
+        self.assertEqual([device for device, _ in self.reader.drain()], [1, 2])
+
+    def test_invalidFile(self):
+        path = self.mktemp()
+        with open(path, 'wb') as ring:
+            ring.write(b'\0' * 64)
+        self.assertRaises(Exception, ReadingRing, path)
+
+
+class HistoryJsonTests(unittest.TestCase):
+
+    def test_roundTrip(self):
+        last_update = datetime.datetime(2026, 1, 1, 13, 5, 0, 250)
+        sensorHistory = SensorHistoryData(1, 0, 'kwhr')
+        sensorHistory.storeDataPoints(last_update, [('h002', '001.0'), ('h004', '002.0'), ('d001', '010.0')])
+        device, sensor_type, sensorHistoryData = _historyFromJson(_historyToJson(2, 1, {0: sensorHistory}))
+        self.assertEqual((device, sensor_type, list(sensorHistoryData)), (2, 1, [0]))
+        decoded = sensorHistoryData[0]
+        self.assertEqual(decoded.units, 'kwhr')
+        self.assertEqual(decoded.last_update, last_update)
+        self.assertEqual(decoded.getHourData(), sensorHistory.getHourData())
+        self.assertEqual(decoded.getDayData(), sensorHistory.getDayData())
@@ -0,0 +1,60 @@
+'''
+Tests for txcurrentcost.stats.
+'''
+
+from twisted.trial import unittest
+from txcurrentcost.stats import ChannelStatistics, RollingWindow, StatisticsAggregator
+
+
+class RollingWindowTests(unittest.TestCase):
+
+    def test_summary(self):
+        window = RollingWindow(60, buckets=6)
+        for timestamp, value in [(0, 100.0), (15, 300.0), (30, 200.0)]:
+            window.add(timestamp, value)
+        summary = window.summary(30)
+        self.assertEqual((summary.count, summary.minimum, summary.maximum, summary.mean),
+                         (3, 100.0, 300.0, 200.0))
+
+    def test_oldBucketsExpire(self):
+        window = RollingWindow(60, buckets=6)
+        window.add(0, 100.0)
+        window.add(65, 300.0)
+        self.assertEqual(window.summary(65).count, 1)
+        self.assertEqual(window.summary(130).count, 0)
+        self.assertIdentical(window.summary(130).mean, None)
+
+    def test_readingOlderThanWindowIgnored(self):
+        window = RollingWindow(60, buckets=6)
+        window.add(65, 300.0)
+        window.add(5, 100.0)
+        self.assertEqual(window.summary(65).minimum, 300.0)
+
+
+class ChannelStatisticsTests(unittest.TestCase):
+
+    def test_energy(self):
+        """ Energy is integrated over the time between readings """
+        statistics = ChannelStatistics((3600,), 60, max_gap=30.0)
+        statistics.add(0, 1000.0)
+        statistics.add(6, 2000.0)
+        self.assertAlmostEqual(statistics.summary(3600).energy, 1500.0 * 6 / 3600)
+
+    def test_gapNotIntegrated(self):
+        statistics = ChannelStatistics((3600,), 60, max_gap=30.0)
+        statistics.add(0, 1000.0)
+        statistics.add(60, 1000.0)
+        self.assertEqual(statistics.summary(3600).energy, 0.0)
+        self.assertEqual(statistics.gaps, 1)
+
+
+class StatisticsAggregatorTests(unittest.TestCase):
+
+    def test_channels(self):
+        aggregator = StatisticsAggregator(windows=(60,))
+        aggregator.add(0, 1, 0, ['00100', '00200'])
+        aggregator.add(6, 1, 0, ['00300', '00400'])
+        self.assertEqual(aggregator.summary(1, 0, 1, 60).mean, 200.0)
+        self.assertEqual(aggregator.summary(1, 0, 2, 60, now=6).maximum, 400.0)
+        self.assertIdentical(aggregator.summary(1, 0, 3, 60), None)
+        self.assertIdentical(aggregator.channel(1, 1, 1), None)
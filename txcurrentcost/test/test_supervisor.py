@@ -0,0 +1,188 @@
+'''
+Tests for txcurrentcost.supervisor.
+'''
+
+from twisted.internet import error, protocol, task
+from twisted.python import failure
+from twisted.trial import unittest
+from txcurrentcost.metrics import MetricsRegistry, MonitorMetrics
+from txcurrentcost.monitor import Monitor
+from txcurrentcost.supervisor import Gap, SerialPortSupervisor
+from txcurrentcost.test.test_decoder import PeriodicMessages
+
+
+class FakePort(object):
+    """ A serial port that can be unplugged """
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.closed = False
+        protocol.makeConnection(self)
+
+    def write(self, data):
+        pass
+
+    def loseConnection(self):
+        self.close()
+
+    def close(self):
+        self.lose(error.ConnectionDone("Port closed"))
+
+    def lose(self, reason=None):
+        """ Report the loss of the port, once, as a serial port does """
+        if self.closed:
+            return
+        self.closed = True
+        self.protocol.connectionLost(failure.Failure(reason or error.ConnectionLost("Device unplugged")))
+
+
+class FakePortFactory(object):
+    """
+    Open FakePorts, failing while the device is unplugged, and record the
+    clock time of each attempt.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.unplugged = False
+        self.attempts = []
+        self.ports = []
+
+    def __call__(self, protocol, port, clock, baudrate=None):
+        self.attempts.append(self.clock.seconds())
+        if self.unplugged:
+            raise IOError("No such device: %s" % port)
+        serialPort = FakePort(protocol)
+        self.ports.append(serialPort)
+        return serialPort
+
+
+class Config(object):
+    port = '/dev/ttyUSB0'
+    baudrate = 57600
+    clamp_count = 3
+    use_utc_timestamps = False
+
+
+class RecordingMonitor(Monitor):
+
+    def __init__(self, clock):
+        Monitor.__init__(self, Config(), clock)
+        self.updates = []
+        self.recoveries = []
+
+    def periodicUpdateReceived(self, timestamp, temperature, sensor_type, sensor_instance, sensor_data):
+        self.updates.append(sensor_instance)
+
+    def serialPortRecovered(self, gap):
+        self.recoveries.append(gap)
+
+
+class SerialPortSupervisorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.portFactory = FakePortFactory(self.clock)
+        self.registry = MetricsRegistry()
+        self.monitor = RecordingMonitor(self.clock)
+        self.monitor.portFactory = self.portFactory
+        self.monitor.metrics = MonitorMetrics(self.registry, 'house')
+        self.monitor.enableReconnection(initial_delay=0.05, max_delay=0.3)
+
+    def metric(self, name):
+        value = self.registry.snapshot()[name][0][1]
+        return value['count'] if isinstance(value, dict) else value
+
+    def receive(self, line):
+        self.portFactory.ports[-1].protocol.dataReceived(line.encode('ascii') + b'\r\n')
+
+    def test_reconnectBackoff(self):
+        """
+        A lost port is reopened after a delay that doubles with each failed
+        attempt up to the maximum delay.
+        """
+        self.monitor.start()
+        supervisor = self.monitor.serialPort
+        self.assertTrue(supervisor.connected)
+        self.clock.advance(10.0)
+        self.portFactory.unplugged = True
+        self.portFactory.ports[-1].lose()
+        self.assertFalse(supervisor.connected)
+        self.assertEqual(self.metric('serial_port_connected'), 0)
+
+        self.clock.pump([0.05, 0.1, 0.2, 0.3, 0.3])
+        attempts = self.portFactory.attempts
+        self.assertEqual([round(b - a, 6) for a, b in zip(attempts[1:], attempts[2:])], [0.1, 0.2, 0.3, 0.3])
+        self.assertAlmostEqual(attempts[1], 10.05)
+        self.portFactory.unplugged = False
+        self.clock.advance(0.3)
+        self.assertTrue(supervisor.connected)
+        self.assertEqual(len(self.portFactory.attempts), 7)
+        self.assertEqual(self.metric('serial_reconnect_attempts_total'), 6)
+        self.assertEqual(self.metric('serial_port_connected'), 1)
+        self.assertEqual(self.metric('serial_recovery_seconds'), 1)
+
+    def test_gapRecorded(self):
+        self.monitor.start()
+        self.clock.advance(10.0)
+        self.portFactory.unplugged = True
+        self.portFactory.ports[-1].lose()
+        self.clock.advance(0.05)
+        self.portFactory.unplugged = False
+        self.clock.advance(0.1)
+        self.assertEqual(len(self.monitor.recoveries), 1)
+        gap = self.monitor.recoveries[0]
+        self.assertEqual((gap.start, gap.attempts), (10.0, 2))
+        self.assertAlmostEqual(gap.end, 10.15)
+        self.assertEqual(list(self.monitor.serialPort.gaps), [gap])
+
+    def test_readingsResumeAfterReconnect(self):
+        self.monitor.start()
+        self.receive(PeriodicMessages[0])
+        self.portFactory.ports[-1].lose()
+        self.clock.advance(0.05)
+        self.receive(PeriodicMessages[1])
+        self.assertEqual(self.monitor.updates, [0, 3])
+        self.assertEqual(len(self.portFactory.ports), 2)
+
+    def test_openFailureAtStart(self):
+        """ A port that can't be opened at start is retried """
+        self.portFactory.unplugged = True
+        self.monitor.start()
+        self.assertFalse(self.monitor.serialPort.connected)
+        self.portFactory.unplugged = False
+        self.clock.advance(0.05)
+        self.assertTrue(self.monitor.serialPort.connected)
+        self.assertEqual(self.monitor.recoveries, [Gap(0.0, 0.05, 1)])
+
+    def test_stop(self):
+        """ Stopping the monitor closes the port without reopening it """
+        self.monitor.start()
+        self.monitor.stop()
+        self.assertTrue(self.portFactory.ports[-1].closed)
+        self.assertFalse(self.monitor.serialPort.connected)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.clock.advance(10.0)
+        self.assertEqual(len(self.portFactory.attempts), 1)
+        self.assertEqual(self.monitor.recoveries, [])
+
+    def test_stopWhileReconnecting(self):
+        self.monitor.start()
+        self.portFactory.unplugged = True
+        self.portFactory.ports[-1].lose()
+        self.clock.advance(0.05)
+        self.monitor.stop()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.portFactory.unplugged = False
+        self.clock.advance(10.0)
+        self.assertEqual(len(self.portFactory.attempts), 2)
+
+    def test_lossReportedTwice(self):
+        """ A port reporting its loss twice is only reopened once """
+        supervisor = SerialPortSupervisor(self.portFactory, protocol.Protocol(), Config.port, self.clock)
+        supervised = self.portFactory.ports[-1].protocol
+        reason = failure.Failure(error.ConnectionLost())
+        supervised.connectionLost(reason)
+        supervised.connectionLost(reason)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        supervisor.close()
@@ -0,0 +1,110 @@
+'''
+Tests for txcurrentcost.workers.
+'''
+
+import threading
+from twisted.internet import defer, reactor, task
+from twisted.trial import unittest
+from txcurrentcost import workers
+from txcurrentcost.workers import HistoryDecodeError, ProcessHistoryDecoder, ThreadedHistoryDecoder
+from txcurrentcost.test.test_decoder import OtherMessages
+
+
+class DeferredCallsClock(task.Clock):
+    """
+    A clock that holds calls made from other threads until they are run, so
+    that a decode can be timed out before its result is delivered.
+    """
+
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.threadCalls = []
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.threadCalls.append((f, args, kwargs))
+
+    def runThreadCalls(self):
+        calls, self.threadCalls = self.threadCalls, []
+        for f, args, kwargs in calls:
+            f(*args, **kwargs)
+
+
+class DecoderTestsMixin(object):
+
+    def createDecoder(self, reactor, timeout=60.0):
+        raise NotImplementedError()
+
+    def startDecoder(self, reactor, timeout=60.0):
+        decoder = self.createDecoder(reactor, timeout)
+        decoder.start()
+        self.addCleanup(decoder.stop)
+        return decoder
+
+    def test_decode(self):
+        decoder = self.startDecoder(reactor)
+        d = decoder.decode(OtherMessages[0])
+
+        def decoded(update):
+            self.assertEqual(update.sensor_type, 1)
+            self.assertEqual(update.sensors[0][1][0], ('h024', '001.1'))
+        return d.addCallback(decoded)
+
+    def test_decodeCycle(self):
+        """ The messages of a history cycle are each decoded """
+        decoder = self.startDecoder(reactor)
+        lines = [OtherMessages[0].replace('<sensor>0</sensor>', '<sensor>%i</sensor>' % n) for n in range(4)]
+        d = defer.gatherResults([decoder.decode(line) for line in lines])
+
+        def decoded(updates):
+            self.assertEqual([update.sensors[0][0] for update in updates], [0, 1, 2, 3])
+        return d.addCallback(decoded)
+
+    @defer.inlineCallbacks
+    def test_lateResultIgnoredAfterTimeout(self):
+        clock = DeferredCallsClock()
+        decoder = self.startDecoder(clock, timeout=5.0)
+        d = decoder.decode(OtherMessages[0])
+        clock.advance(5.0)
+        self.failureResultOf(d, defer.TimeoutError)
+        while not clock.threadCalls:
+            yield task.deferLater(reactor, 0.01, lambda: None)
+        clock.runThreadCalls()
+
+
+class ThreadedHistoryDecoderTests(DecoderTestsMixin, unittest.TestCase):
+
+    def createDecoder(self, reactor, timeout=60.0):
+        return ThreadedHistoryDecoder(reactor, timeout=timeout)
+
+    def test_decodedOffReactorThread(self):
+        threadNames = []
+
+        def decodeHistoryLine(line):
+            threadNames.append(threading.current_thread().name)
+            return decode(line)
+        decode = workers.decodeHistoryLine
+        self.patch(workers, 'decodeHistoryLine', decodeHistoryLine)
+        decoder = self.startDecoder(reactor)
+        d = decoder.decode(OtherMessages[0])
+
+        def decoded(update):
+            self.assertEqual(len(threadNames), 1)
+            self.assertNotEqual(threadNames[0], threading.current_thread().name)
+        return d.addCallback(decoded)
+
+    def test_error(self):
+        decoder = self.startDecoder(reactor)
+        d = decoder.decode(OtherMessages[1])
+        return self.assertFailure(d, Exception)
+
+
+class ProcessHistoryDecoderTests(DecoderTestsMixin, unittest.TestCase):
+
+    def createDecoder(self, reactor, timeout=60.0):
+        return ProcessHistoryDecoder(reactor, timeout=timeout)
+
+    def test_error(self):
+        """ A decoding error in a worker process is reported in the reactor """
+        decoder = self.startDecoder(reactor)
+        d = decoder.decode(OtherMessages[1])
+        return self.assertFailure(d, HistoryDecodeError)
@@ -0,0 +1,160 @@
+'''
+This module implements worker pools used to decode Current Cost history
+update messages away from the reactor thread.
+
+About one minute past every odd hour a Current Cost device emits a burst of
+history update messages. Decoding these in the reactor thread delays the
+handling of periodic updates from every other device served by the reactor.
+A Monitor given one of these decoders passes raw history lines to it and
+receives the decoded txcurrentcost.decoder.HistoryUpdate through a Deferred.
+
+The ThreadedHistoryDecoder decodes messages in a thread pool. Decoding still
+competes with the reactor for the interpreter lock but the reactor is no
+longer blocked for the duration of the whole burst. The ProcessHistoryDecoder
+decodes messages in a pool of worker processes.
+
+A history message whose decoding does not finish within the timeout of the
+decoder, for example because its worker process died, fails with a
+TimeoutError so that later history messages are not held up behind it.
+'''
+
+import logging
+import multiprocessing
+import signal
+import sys
+from twisted.internet import defer, threads
+from twisted.python.threadpool import ThreadPool
+from txcurrentcost.decoder import decodeHistoryLine
+
+
+def _initWorker():
+    """
+    Restore the default SIGTERM handling in a worker process. A worker forked
+    from a running reactor inherits its signal handlers, which would stop the
+    worker from being terminated when the pool is stopped.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def _decodeHistoryLineInWorker(line):
+    """
+    Decode a history line in a worker process. Exceptions are returned
+    rather than raised so the failure can be reported in the reactor.
+    """
+    try:
+        return True, decodeHistoryLine(line)
+    except Exception as ex:
+        return False, "%s: %s" % (ex.__class__.__name__, ex)
+
+
+class HistoryDecodeError(Exception):
+    """ Raised when a worker process fails to decode a history message """
+
+
+class ThreadedHistoryDecoder(object):
+    """
+    Decode history update messages in a pool of threads.
+    """
+
+    def __init__(self, reactor, workers=1, timeout=60.0):
+        """
+        @param reactor: The reactor that results are delivered to
+        @param workers: The maximum number of worker threads
+        @type workers: int
+        @param timeout: The seconds allowed to decode a message
+        @type timeout: float
+        """
+        self.reactor = reactor
+        self.timeout = timeout
+        self.threadPool = ThreadPool(minthreads=0, maxthreads=workers,
+                                     name=self.__class__.__name__)
+
+    def start(self):
+        """ Start the worker threads """
+        self.threadPool.start()
+
+    def stop(self):
+        """ Stop the worker threads """
+        self.threadPool.stop()
+
+    def decode(self, line):
+        """
+        Decode a raw history update message line.
+
+        @return: A Deferred that fires with a HistoryUpdate
+        """
+        d = threads.deferToThreadPool(self.reactor, self.threadPool, decodeHistoryLine, line)
+        d.addTimeout(self.timeout, self.reactor)
+        return d
+
+
+class ProcessHistoryDecoder(object):
+    """
+    Decode history update messages in a pool of worker processes.
+
+    Forking a process that is running threads, such as the reactor's thread
+    pool, can leave locks held in the child. On Python 3 the workers are
+    started by a fork server, or spawned where that is not available, rather
+    than forked from the reactor process, so the main module of the program
+    must only start the reactor under an "if __name__ == '__main__'" guard.
+    On Python 2 the worker processes are forked when the decoder is created,
+    so create it before the reactor is started.
+    """
+
+    def __init__(self, reactor, workers=1, timeout=60.0):
+        """
+        @param reactor: The reactor that results are delivered to
+        @param workers: The number of worker processes
+        @type workers: int
+        @param timeout: The seconds allowed to decode a message
+        @type timeout: float
+        """
+        self.reactor = reactor
+        self.workers = workers
+        self.timeout = timeout
+        self.processPool = None
+        if sys.version_info[0] < 3:
+            self.processPool = multiprocessing.Pool(self.workers, _initWorker)
+
+    def start(self):
+        """ Start the worker processes """
+        if self.processPool is not None:
+            return
+        if sys.version_info[0] < 3:
+            self.processPool = multiprocessing.Pool(self.workers, _initWorker)
+            return
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self.processPool = context.Pool(self.workers, _initWorker)
+
+    def stop(self):
+        """ Stop the worker processes """
+        if self.processPool is not None:
+            self.processPool.terminate()
+            self.processPool = None
+
+    def decode(self, line):
+        """
+        Decode a raw history update message line.
+
+        @return: A Deferred that fires with a HistoryUpdate
+        """
+        d = defer.Deferred()
+        callbacks = {'callback': lambda result: self.reactor.callFromThread(self._decoded, d, result)}
+        if sys.version_info[0] >= 3:
+            callbacks['error_callback'] = lambda ex: self.reactor.callFromThread(
+                self._decoded, d, (False, "%s: %s" % (ex.__class__.__name__, ex)))
+        self.processPool.apply_async(_decodeHistoryLineInWorker, (line,), **callbacks)
+        d.addTimeout(self.timeout, self.reactor)
+        return d
+
+    def _decoded(self, d, result):
+        if d.called:
+            # The decode has already timed out.
+            return
+        ok, value = result
+        if ok:
+            d.callback(value)
+        else:
+            logging.debug("History worker process failed: %s" % value)
+            d.errback(HistoryDecodeError(value))